@@ -1,21 +1,26 @@
 import os
+import math
+import time
 import logging
-from flask import Flask, render_template, request, flash, redirect, url_for, session
+import hmac
+from functools import wraps
+from flask import Flask, render_template, request, flash, redirect, url_for, session, g, Response, abort, jsonify, make_response
 from werkzeug.middleware.proxy_fix import ProxyFix
-from keymaster_auth import authenticate_client_user, get_persistent_hwid
+from keymaster_auth import authenticate_client_user, get_persistent_hwid, get_default_client, UpstreamBusyError
+from keymaster_metrics import registry as metrics_registry, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from keymaster_session import SessionTokenManager, InvalidSessionToken
+from keymaster_ratelimit import RateLimiter, parse_limit, RATE_LIMIT_IP, RATE_LIMIT_USERNAME
+from keymaster_logging import configure_logging, SAMPLED
+from keymaster_static import StaticAssets, CachedPage
+from keymaster_profile import (span, sampled, start_profile, current_profile, finish_profile, write_profile,
+                               PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_HEADER, PROFILE_DIR, PROFILE_MIN_MS)
 from dotenv import load_dotenv
 load_dotenv('.env.local')
 import secrets
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: records are queued and written by a single background writer
+# (the gunicorn master under gunicorn), so requests never wait on log I/O
+configure_logging()
 logger = logging.getLogger(__name__)
 
 def create_app():
@@ -28,7 +33,7 @@ def create_app():
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     app.config['PERMANENT_SESSION_LIFETIME'] = 1800  # 30 minutes
     
-    # Rate limiting and security headers
+    # Request size limit (rate limiting: see limit_login_attempts)
     app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024  # 1MB max file size
     
     # Trust proxy headers if behind reverse proxy
@@ -39,6 +44,33 @@ def create_app():
 app = create_app()
 
 # Configuration
+BUSY_RETRY_AFTER = os.environ.get("BUSY_RETRY_AFTER", "5")  # seconds, sent with 503 responses
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # optional bearer token protecting /metrics
+SESSION_TOKEN_COOKIE = os.environ.get("SESSION_TOKEN_COOKIE", "km_session")
+
+# Fingerprinted, precompressed static files and a render-once anonymous login page
+static_assets = StaticAssets(app)
+login_page_cache = CachedPage(lambda: render_template("index.html"))
+
+# Signed session tokens let protected routes skip KeyMaster (SECRET_KEY must be the same in every worker)
+session_tokens = SessionTokenManager(app.config['SECRET_KEY'])
+
+HTTP_REQUEST_SECONDS = metrics_registry.histogram(
+    "keymaster_http_request_seconds",
+    "Time spent handling requests in the Flask app (excluding upstream queueing in gunicorn)",
+    ("route", "method", "status")
+)
+RATE_LIMITED_TOTAL = metrics_registry.counter(
+    "keymaster_rate_limited_total",
+    "Login attempts rejected with 429, by limit scope",
+    ("scope",)
+)
+
+# Token buckets per client IP and per username, shared by all workers via KEYMASTER_RATELIMIT_DB
+auth_rate_limiter = RateLimiter({
+    "ip": parse_limit(RATE_LIMIT_IP),
+    "username": parse_limit(RATE_LIMIT_USERNAME)
+})
 MY_KEYMASTER_ACCOUNT_UID = os.environ.get("KEYMASTER_ACCOUNT_UID")
 if not MY_KEYMASTER_ACCOUNT_UID:
     raise ValueError("KEYMASTER_ACCOUNT_UID environment variable is required")
@@ -49,6 +81,88 @@ def security_headers():
     """Add security headers to all responses"""
     pass
 
+@app.before_request
+def start_request_timer():
+    """Remember when request handling started"""
+    g.request_started = time.perf_counter()
+
+def start_request_profile():
+    """Profile 1 in PROFILE_SAMPLE_RATE requests, and any request sending X-Profile: <PROFILE_TOKEN>"""
+    supplied = request.headers.get(PROFILE_HEADER)
+    requested = bool(PROFILE_TOKEN and supplied and hmac.compare_digest(supplied, PROFILE_TOKEN))
+    if requested or sampled():
+        start_profile(request.endpoint or "unmatched")
+        g.profile_requested = requested
+
+def add_profile_header(response):
+    """Tell the caller of a requested profile which file to look for"""
+    profile = current_profile()
+    if profile is not None and g.get("profile_requested"):
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+def finish_request_profile(error):
+    """Write the request's folded stacks to PROFILE_DIR"""
+    profile = finish_profile()
+    if profile is None:
+        return
+    if profile.duration * 1000 < PROFILE_MIN_MS and not g.get("profile_requested"):
+        return
+    try:
+        write_profile(profile, PROFILE_DIR)
+    except OSError as e:
+        logger.warning("Could not write request profile: %s", e)
+
+# Profiling hooks are only installed when enabled, so other requests pay nothing
+if PROFILE_SAMPLE_RATE > 0 or PROFILE_TOKEN:
+    app.before_request(start_request_profile)
+    app.after_request(add_profile_header)
+    app.teardown_request(finish_request_profile)
+
+@app.before_request
+def limit_login_attempts():
+    """
+    Reject login floods with a bare 429 before any template rendering or KeyMaster call.
+    
+    The per-IP bucket is checked first without reading the request body;
+    only requests it lets through have their form parsed for the username.
+    """
+    if request.method != "POST" or request.endpoint != "auth_user" or not auth_rate_limiter.enabled:
+        return None
+    scope, wait = auth_rate_limiter.check(ip=request.remote_addr)
+    if scope is None:
+        scope, wait = auth_rate_limiter.check(username=request.form.get("username", "")[:50])
+    if scope is None:
+        return None
+    RATE_LIMITED_TOTAL.inc(scope=scope)
+    logger.warning("Rate limited login attempt (%s) from %s", scope, request.remote_addr,
+                   extra={"event": "rate_limited", "scope": scope, "client_ip": request.remote_addr})
+    return Response("Too many login attempts, please try again later.\n", status=429,
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))}, mimetype="text/plain")
+
+@app.after_request
+def record_request_metrics(response):
+    """Record request latency by route"""
+    started = g.get("request_started")
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method,
+            status=str(response.status_code)
+        )
+    return response
+
+@app.after_request
+def refresh_session_token(response):
+    """Send the sliding-window replacement for a session token that is getting old"""
+    token = g.get("refreshed_session_token")
+    if token:
+        set_session_token(response, token)
+        if g.get("session_token_from_header"):
+            response.headers['X-Session-Token'] = token
+    return response
+
 @app.after_request
 def add_security_headers(response):
     """Add security headers"""
@@ -59,85 +173,199 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "default-src 'self'; style-src 'self' 'unsafe-inline'; script-src 'self'"
     return response
 
+def set_session_token(response, token):
+    """Store a session token in a secure, HTTP-only cookie"""
+    response.set_cookie(
+        SESSION_TOKEN_COOKIE,
+        token,
+        max_age=session_tokens.ttl,
+        secure=app.config['SESSION_COOKIE_SECURE'],
+        httponly=True,
+        samesite='Lax'
+    )
+    return response
+
+def login_required(view):
+    """
+    Require a valid session token, verified locally without calling KeyMaster.
+    
+    The token is read from the ``Authorization: Bearer`` header or the session
+    cookie. Its claims are available as ``g.session_claims``.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        authorization = request.headers.get("Authorization", "")
+        from_header = authorization.startswith("Bearer ")
+        token = authorization[7:].strip() if from_header else request.cookies.get(SESSION_TOKEN_COOKIE)
+        try:
+            claims = session_tokens.verify(token)
+        except InvalidSessionToken as e:
+            logger.debug("Rejected session token from %s: %s", request.remote_addr, e)
+            if from_header or request.accept_mimetypes.best == "application/json":
+                return jsonify({"success": False, "message": "Authentication required"}), 401
+            return redirect(url_for("login_page"))
+        
+        g.session_claims = claims
+        g.session_token_from_header = from_header
+        if session_tokens.needs_refresh(claims):
+            g.refreshed_session_token = session_tokens.refresh(claims)
+        return view(*args, **kwargs)
+    return wrapped
+
 @app.errorhandler(404)
 def not_found(error):
-    logger.warning(f"404 error: {request.url}")
+    logger.warning("404 error: %s", request.url)
     return render_template('error.html', error_code=404, error_message="Page not found"), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"500 error: {str(error)}")
+    logger.error("500 error: %s", error)
     return render_template('error.html', error_code=500, error_message="Internal server error"), 500
 
 @app.errorhandler(413)
 def too_large(error):
-    logger.warning(f"413 error: Request too large from {request.remote_addr}")
+    logger.warning("413 error: Request too large from %s", request.remote_addr)
     return render_template('error.html', error_code=413, error_message="Request too large"), 413
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose metrics of all workers in Prometheus text format"""
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}"):
+            abort(404)
+    return Response(render_metrics(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
 @app.route("/", methods=["GET"])
 def login_page():
-    """Render login page"""
+    """Render login page (identical for every visitor, so rendered once and cached)"""
     try:
-        return render_template("index.html")
+        return login_page_cache.response()
     except Exception as e:
-        logger.error(f"Error rendering login page: {str(e)}")
+        logger.error("Error rendering login page: %s", e)
         return "Server error", 500
 
+def render_index(**context):
+    """Render index.html inside a profiling span"""
+    with span("render_template"):
+        return render_template("index.html", **context)
+
 @app.route("/auth", methods=["POST"])
 def auth_user():
     """Authenticate user credentials"""
     try:
         # Input validation
-        username = request.form.get("username", "").strip()
-        password = request.form.get("password", "")
+        with span("parse_form"):
+            username = request.form.get("username", "").strip()
+            password = request.form.get("password", "")
         
         if not username or not password:
-            logger.warning(f"Invalid login attempt - missing credentials from {request.remote_addr}")
-            return render_template("index.html", 
-                                   auth_result=False, 
-                                   message="Username and password are required")
+            logger.warning("Invalid login attempt - missing credentials from %s", request.remote_addr)
+            return render_index(auth_result=False,
+                                message="Username and password are required")
         
         # Length validation
         if len(username) > 50 or len(password) > 100:
-            logger.warning(f"Invalid login attempt - credentials too long from {request.remote_addr}")
-            return render_template("index.html", 
-                                   auth_result=False, 
-                                   message="Invalid credentials")
+            logger.warning("Invalid login attempt - credentials too long from %s", request.remote_addr)
+            return render_index(auth_result=False,
+                                message="Invalid credentials")
         
         # Get hardware ID
-        hwid = get_persistent_hwid("StreamerPanel")
+        with span("hwid"):
+            hwid = get_persistent_hwid("StreamerPanel")
         
         # Log authentication attempt
-        logger.info(f"Authentication attempt for user: {username} from {request.remote_addr}")
+        logger.info("Authentication attempt for user: %s from %s", username, request.remote_addr, extra=SAMPLED)
         
         # Authenticate with KeyMaster
-        response = authenticate_client_user(
-            MY_KEYMASTER_ACCOUNT_UID, 
-            username, 
-            password, 
-            APP_VERSION
-        )
+        with span("authenticate"):
+            response = authenticate_client_user(
+                MY_KEYMASTER_ACCOUNT_UID, 
+                username, 
+                password, 
+                APP_VERSION
+            )
         
         if response.get("success"):
-            logger.info(f"Successful authentication for user: {username}")
+            logger.info("Successful authentication for user: %s", username,
+                        extra={"event": "auth_success", "username": username, **SAMPLED})
             session['authenticated'] = True
             session['username'] = username
             session.permanent = True
             
-            return render_template("index.html", 
-                                   auth_result=True, 
-                                   message=response.get('message', 'Login successful'),
-                                   username=username)
+            page = make_response(render_index(auth_result=True,
+                                              message=response.get('message', 'Login successful'),
+                                              username=username))
+            with span("session_token"):
+                token = session_tokens.issue(username, response)
+            return set_session_token(page, token)
         else:
-            logger.warning(f"Failed authentication for user: {username} from {request.remote_addr}")
-            return render_template("index.html", 
-                                   auth_result=False, 
-                                   message=response.get('message', 'Authentication failed'))
+            logger.warning("Failed authentication for user: %s from %s", username, request.remote_addr,
+                           extra={"event": "auth_failure", "username": username,
+                                  "client_ip": request.remote_addr, "error_code": response.get("errorCode")})
+            return render_index(auth_result=False,
+                                message=response.get('message', 'Authentication failed'))
+    except UpstreamBusyError:
+        logger.warning("Authentication server busy, shedding login for %s", request.remote_addr,
+                       extra={"event": "upstream_busy", "client_ip": request.remote_addr})
+        return render_index(auth_result=False,
+                            message="Service is busy, please try again in a few seconds"), 503, {"Retry-After": BUSY_RETRY_AFTER}
+    except Exception as e:
+        logger.error("Authentication error: %s", e, exc_info=True)
+        return render_index(auth_result=False,
+                            message="An error occurred during authentication")
+
+@app.route("/session", methods=["GET"])
+@login_required
+def session_info():
+    """Return the verified session (no KeyMaster round trip)"""
+    claims = g.session_claims
+    return jsonify({
+        "success": True,
+        "username": claims["sub"],
+        "userStatus": claims.get("st"),
+        "expiresAt": claims["exp"]
+    })
+
+@app.route("/logout", methods=["POST"])
+def logout():
+    """Clear the session and revoke its token"""
+    session.clear()
+    authorization = request.headers.get("Authorization", "")
+    token = authorization[7:].strip() if authorization.startswith("Bearer ") else request.cookies.get(SESSION_TOKEN_COOKIE)
+    if token:
+        try:
+            session_tokens.revoke(session_tokens.verify(token))
+        except InvalidSessionToken:
+            pass  # already invalid
+    response = redirect(url_for("login_page"))
+    response.delete_cookie(SESSION_TOKEN_COOKIE)
+    return response
+
+def warm_up_worker():
+    """
+    Do the one-off work of a worker's first /auth request before it accepts traffic.
+    
+    Called from gunicorn's post_worker_init hook. Resolves the HWID, compiles the
+    templates and opens keep-alive connections to KeyMaster (bounded by
+    KEYMASTER_WARMUP_TIMEOUT, so an unreachable KeyMaster cannot delay readiness).
+    The cached login page is left to the first real request, because its URLs
+    depend on the proxy headers of that request.
+    """
+    started = time.perf_counter()
+    try:
+        get_persistent_hwid("StreamerPanel")
+        for template in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template)
     except Exception as e:
-        logger.error(f"Authentication error: {str(e)}")
-        return render_template("index.html", 
-                               auth_result=False, 
-                               message="An error occurred during authentication")
+        logger.warning("Worker warm-up failed: %s", e)
+    local_seconds = time.perf_counter() - started
+    
+    client = get_default_client()
+    connections = client.warm_up()
+    client.start_keepalive()
+    logger.info("Worker warm-up took %.0f ms (HWID and templates %.0f ms, %d KeyMaster connections open)",
+                (time.perf_counter() - started) * 1000, local_seconds * 1000, connections)
 
 if __name__ == "__main__":
     app.run(debug=True, port=3000)
@@ -0,0 +1,331 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+# Configure logging
+logger = logging.getLogger("bench_auth")
+
+TARGETS = ("license", "client-user", "flask")
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for_port(port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MiB (Linux /proc only)."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f_in:
+            for line in f_in:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _child_pids(parent_pid: int) -> List[int]:
+    children = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f_in:
+                fields = f_in.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == parent_pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(percentile / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def run_load(call: Callable[[int], bool], concurrency: int, total_requests: int) -> Dict[str, Any]:
+    """
+    Drive ``call`` from ``concurrency`` threads until ``total_requests`` calls have completed.
+    
+    Args:
+        call: Function taking a unique request number and returning True on success
+        concurrency: Number of concurrent callers
+        total_requests: Total number of calls
+    
+    Returns:
+        Latency percentiles (ms), throughput and error count
+    """
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def worker() -> None:
+        local_latencies = []
+        local_errors = 0
+        while True:
+            number = next(counter)
+            if number >= total_requests:
+                break
+            started = time.perf_counter()
+            try:
+                ok = call(number)
+            except Exception as e:
+                logger.debug("Request %s failed: %s", number, e)
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            if not ok:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"bench-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+def bench_library(target: str, levels: List[int], total_requests: int,
+                  hedge: bool = False, transport: str = "requests") -> List[Dict[str, Any]]:
+    """Benchmark authenticate_license_key / authenticate_client_user in this process."""
+    import keymaster_auth
+    
+    results = []
+    for concurrency in levels:
+        # Room for hedges on top of the regular calls
+        slots = concurrency * 2 if hedge else concurrency
+        client = keymaster_auth.KeyMasterClient(
+            pool_maxsize=slots,
+            limiter=keymaster_auth.UpstreamLimiter(max_in_flight=slots, queue_timeout=30),
+            hedging=hedge,
+            hedge_policy=keymaster_auth.HedgePolicy() if hedge else None,
+            transport=keymaster_auth.create_transport(transport, keymaster_auth.DEFAULT_HEADERS, pool_maxsize=slots)
+        )
+        run_id = f"{target}-{concurrency}-{time.time_ns()}"
+        
+        if target == "license":
+            def call(number: int) -> bool:
+                # Unique keys so neither the cache nor coalescing hide upstream cost
+                result = keymaster_auth.authenticate_license_key(
+                    "bench-master", f"BENCH-{run_id}-{number}", "BENCH-HWID", "1.0.0",
+                    client=client, use_cache=False
+                )
+                return result.get("success") is True
+        else:
+            def call(number: int) -> bool:
+                result = keymaster_auth.authenticate_client_user(
+                    "bench-master", f"user{number}", "secret", "1.0.0", client=client
+                )
+                return result.get("success") is True
+        
+        stats = run_load(call, concurrency, total_requests)
+        stats["target"] = target
+        stats["rss_mb_per_worker"] = _rss_mb(os.getpid())
+        stats["pool"] = client.stats()
+        if hedge:
+            stats["hedge"] = client.hedge_policy.stats()
+        client.close()
+        results.append(stats)
+        logger.info(_format_row(stats))
+    return results
+
+def bench_flask(levels: List[int], total_requests: int, api_base: str, workers: int,
+                worker_class: str) -> List[Dict[str, Any]]:
+    """Benchmark POST /auth on the Flask app under gunicorn."""
+    import requests
+    
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "KEYMASTER_API_BASE": api_base,
+        "KEYMASTER_ACCOUNT_UID": env.get("KEYMASTER_ACCOUNT_UID", "bench-master"),
+        "SECRET_KEY": env.get("SECRET_KEY", "bench-secret"),
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "PORT": str(port),
+    })
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "--config", "gunicorn.conf.py",
+        "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}",
+        "--access-logfile", os.devnull,
+        "--error-logfile", "-",
+        "--pid", os.path.join(BENCH_DIR, f".gunicorn-bench-{port}.pid"),
+        "app:app",
+    ]
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    results = []
+    try:
+        _wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/auth"
+        local = threading.local()
+        
+        def call(number: int) -> bool:
+            session = getattr(local, "session", None)
+            if session is None:
+                session = local.session = requests.Session()
+            response = session.post(url, data={"username": f"user{number}", "password": "secret"}, timeout=60)
+            return response.status_code == 200
+        
+        for concurrency in levels:
+            stats = run_load(call, concurrency, total_requests)
+            worker_rss = [rss for rss in (_rss_mb(pid) for pid in _child_pids(server.pid)) if rss is not None]
+            stats["target"] = "flask"
+            stats["workers"] = workers
+            stats["worker_class"] = worker_class
+            stats["rss_mb_per_worker"] = round(sum(worker_rss) / len(worker_rss), 2) if worker_rss else None
+            results.append(stats)
+            logger.info(_format_row(stats))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return results
+
+def _format_row(stats: Dict[str, Any]) -> str:
+    rss = stats.get("rss_mb_per_worker")
+    return (f"{stats['target']:<12} c={stats['concurrency']:<4} n={stats['requests']:<6} "
+            f"rps={stats['rps']:<9} p50={stats['p50_ms']:<9} p95={stats['p95_ms']:<9} "
+            f"p99={stats['p99_ms']:<9} errors={stats['errors']:<5} rss/worker={rss if rss is not None else 'n/a'}MB")
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """Print throughput and latency changes against a previous results file."""
+    with open(baseline_path, "r") as f_in:
+        baseline = json.load(f_in)
+    previous = {(row["target"], row["concurrency"]): row for row in baseline.get("results", [])}
+    for row in results:
+        old = previous.get((row["target"], row["concurrency"]))
+        if not old:
+            continue
+        deltas = []
+        for field in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if old.get(field):
+                deltas.append(f"{field} {((row[field] - old[field]) / old[field]) * 100:+.1f}%")
+        print(f"{row['target']:<12} c={row['concurrency']:<4} " + "  ".join(deltas))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the KeyMaster client and Flask app against a local mock server.")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma-separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("-n", "--requests", type=int, default=500, help="Requests per concurrency level")
+    parser.add_argument("--mock-url", help="Use an already running mock/real server instead of starting one")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock base latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Mock latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock 503 rate")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Mock fraction of slow responses")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="Mock extra latency of a slow response in seconds")
+    parser.add_argument("--hedge", action="store_true", help="Enable hedged requests for the library targets")
+    parser.add_argument("--transport", default="requests", choices=("requests", "http2"),
+                        help="KeyMaster client transport for the library targets")
+    parser.add_argument("--workers", type=int, default=4, help="Gunicorn workers for the flask target")
+    parser.add_argument("--worker-class", default="sync", help="Gunicorn worker class for the flask target")
+    parser.add_argument("-o", "--output", help="Write machine-readable results (JSON) to this file")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    
+    mock = None
+    api_base = args.mock_url
+    if not api_base:
+        port = _free_port()
+        mock = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, "mock_keymaster.py"),
+            "--port", str(port), "--latency", str(args.latency),
+            "--jitter", str(args.jitter), "--error-rate", str(args.error_rate), "--seed", "1",
+            "--tail-rate", str(args.tail_rate), "--tail-latency", str(args.tail_latency)
+        ])
+        _wait_for_port(port)
+        api_base = f"http://127.0.0.1:{port}"
+    
+    # Must be set before keymaster_auth is imported
+    os.environ["KEYMASTER_API_BASE"] = api_base
+    sys.path.insert(0, APP_DIR)
+    
+    results: List[Dict[str, Any]] = []
+    try:
+        for target in targets:
+            if target == "flask":
+                results.extend(bench_flask(levels, args.requests, api_base, args.workers, args.worker_class))
+            else:
+                results.extend(bench_library(target, levels, args.requests, args.hedge, args.transport))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait(timeout=10)
+    
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "api_base": api_base,
+            "mock": None if args.mock_url else {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                                                "tail_rate": args.tail_rate, "tail_latency": args.tail_latency},
+            "hedge": args.hedge,
+            "transport": args.transport,
+            "requests_per_level": args.requests,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+        logger.info("Results written to %s", args.output)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
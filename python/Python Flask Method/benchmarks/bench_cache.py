@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import logging
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from keymaster_cache import AuthResultCache, SQLiteAuthResultCache, make_license_cache_key
+from bench_auth import _percentile
+
+# Configure logging
+logger = logging.getLogger("bench_cache")
+
+RESULT = {
+    "success": True,
+    "message": "License key authenticated successfully",
+    "userStatus": "active",
+    "expiresAt": "2099-12-31T23:59:59Z"
+}
+
+def _keys(count: int) -> List[Any]:
+    return [make_license_cache_key("bench-master", f"BENCH-{i:08d}", "BENCH-HWID", "1.0.0") for i in range(count)]
+
+def _summarize(name: str, latencies: List[float], **extra: Any) -> Dict[str, Any]:
+    latencies.sort()
+    row = {
+        "backend": name,
+        "lookups": len(latencies),
+        "mean_us": round(sum(latencies) / len(latencies) * 1e6, 2),
+        "p50_us": round(_percentile(latencies, 50) * 1e6, 2),
+        "p99_us": round(_percentile(latencies, 99) * 1e6, 2),
+    }
+    row.update(extra)
+    return row
+
+def time_lookups(cache, keys: List[Any], rounds: int) -> List[float]:
+    latencies = []
+    for _ in range(rounds):
+        for key in keys:
+            started = time.perf_counter()
+            cache.get(key)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+def _worker_lookups(path: str, entries: int, rounds: int) -> List[float]:
+    return time_lookups(SQLiteAuthResultCache(path, maxsize=entries), _keys(entries), rounds)
+
+def bench_remote(api_base: str, count: int) -> List[float]:
+    """Time uncached license calls against a (mock) KeyMaster server."""
+    os.environ["KEYMASTER_API_BASE"] = api_base
+    import keymaster_auth
+    logging.getLogger("keymaster_auth").setLevel(logging.WARNING)
+    
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        keymaster_auth.authenticate_license_key("bench-master", f"REMOTE-{i}", "BENCH-HWID", "1.0.0", use_cache=False)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare result cache lookup latency with a remote KeyMaster call.")
+    parser.add_argument("--entries", type=int, default=1000, help="Cached entries")
+    parser.add_argument("--rounds", type=int, default=20, help="Lookups per entry")
+    parser.add_argument("--processes", type=int, default=4, help="Concurrent reader processes for the shared backend")
+    parser.add_argument("--remote", type=int, default=50, help="Remote calls to time (0 skips)")
+    parser.add_argument("--mock-url", help="KeyMaster base URL (default: start a local mock with --latency)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock base latency in seconds")
+    parser.add_argument("-o", "--output", help="Write machine-readable results (JSON) to this file")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    keys = _keys(args.entries)
+    results = []
+    
+    memory = AuthResultCache(maxsize=args.entries)
+    for key in keys:
+        memory.put(key, RESULT)
+    results.append(_summarize("memory", time_lookups(memory, keys, args.rounds)))
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.db")
+        shared = SQLiteAuthResultCache(path, maxsize=args.entries)
+        started = time.perf_counter()
+        for key in keys:
+            shared.put(key, RESULT)
+        put_us = round((time.perf_counter() - started) / len(keys) * 1e6, 2)
+        results.append(_summarize("sqlite", time_lookups(shared, keys, args.rounds), put_mean_us=put_us))
+        
+        with get_context("spawn").Pool(args.processes) as pool:
+            per_process = pool.starmap(_worker_lookups, [(path, args.entries, args.rounds)] * args.processes)
+        results.append(_summarize("sqlite", [value for chunk in per_process for value in chunk],
+                                  processes=args.processes))
+    
+    if args.remote:
+        mock = None
+        api_base = args.mock_url
+        if not api_base:
+            from mock_keymaster import start_mock_server, MockSettings
+            mock = start_mock_server(settings=MockSettings(latency=args.latency, jitter=0))
+            api_base = mock.base_url
+        try:
+            results.append(_summarize("remote", bench_remote(api_base, args.remote), api_base=api_base))
+        finally:
+            if mock is not None:
+                mock.shutdown()
+    
+    for row in results:
+        extra = f" processes={row['processes']}" if "processes" in row else ""
+        logger.info("%-7s mean=%sus p50=%sus p99=%sus%s", row['backend'], row['mean_us'], row['p50_us'], row['p99_us'], extra)
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump({"results": results}, f_out, indent=2)
+        logger.info("Results written to %s", args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import logging
+from typing import Callable, Dict, List, Optional, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+
+from keymaster_auth import parse_response
+from keymaster_codec import StdlibJsonCodec, OrjsonCodec, orjson, set_codec
+
+# Configure logging
+logger = logging.getLogger("bench_results")
+
+def _bodies(count: int) -> List[bytes]:
+    # Distinct bodies, shaped like mock_keymaster responses
+    return [json.dumps({
+        "success": True,
+        "message": "License key authenticated successfully",
+        "userStatus": "active",
+        "expiresAt": f"2099-12-{1 + i % 28:02d}T23:59:59Z"
+    }).encode("utf-8") for i in range(count)]
+
+def _dict_path(body: bytes) -> Dict[str, Any]:
+    # What _send_request did before: decode to text, json.loads, keep the dict
+    return json.loads(body.decode("utf-8"))
+
+def measure(name: str, parse: Callable[[bytes], Any], bodies: List[bytes]) -> Dict[str, Any]:
+    """Time parsing every body and measure the memory retained by the results."""
+    started = time.perf_counter()
+    for body in bodies:
+        parse(body)
+    elapsed = time.perf_counter() - started
+    
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [parse(body) for body in bodies]
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del results
+    return {
+        "path": name,
+        "results": len(bodies),
+        "parse_us": round(elapsed / len(bodies) * 1e6, 3),
+        "bytes_per_result": round(retained / len(bodies), 1),
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare parse time and memory of dict vs AuthResult results.")
+    parser.add_argument("--count", type=int, default=100000, help="Responses to parse")
+    parser.add_argument("-o", "--output", help="Write machine-readable results (JSON) to this file")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("keymaster_auth").setLevel(logging.WARNING)
+    bodies = _bodies(args.count)
+    
+    results = [measure("dict+json", _dict_path, bodies)]
+    codecs = [StdlibJsonCodec()] + ([OrjsonCodec()] if orjson is not None else [])
+    for codec in codecs:
+        set_codec(codec)
+        results.append(measure(f"AuthResult+{codec.name}", lambda body: parse_response(200, body), bodies))
+    
+    for row in results:
+        logger.info("%-18s parse=%sus memory=%sB/result", row['path'], row['parse_us'], row['bytes_per_result'])
+    if orjson is None:
+        logger.info("orjson not installed; only the stdlib codec was measured")
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump({"results": results}, f_out, indent=2)
+        logger.info("Results written to %s", args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import argparse
+import json
+import random
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Any, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class MockSettings:
+    """
+    Behaviour of the mock KeyMaster server.
+    
+    Args:
+        latency: Base response latency in seconds
+        jitter: Uniform random +/- variation added to latency in seconds
+        error_rate: Fraction of requests answered with HTTP 503 (0.0 - 1.0)
+        seed: Random seed for reproducible runs
+        tail_rate: Fraction of requests that are slow (0.0 - 1.0)
+        tail_latency: Extra latency of a slow request in seconds
+    """
+    
+    def __init__(self, latency: float = 0.05, jitter: float = 0.01, error_rate: float = 0.0,
+                 seed: Optional[int] = None, tail_rate: float = 0.0, tail_latency: float = 1.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+    
+    def next_delay_and_failure(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                delay += self.tail_latency
+            return delay, self._random.random() < self.error_rate
+
+def _license_response(payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    license_key = str(payload.get("licenseKey", ""))
+    if not all(payload.get(field) for field in ("masterUserId", "licenseKey", "hwid", "appVersion")):
+        return 400, {"success": False, "message": "Missing required fields", "errorCode": "MISSING_FIELDS"}
+    if license_key.startswith("INVALID"):
+        return 403, {"success": False, "message": "Invalid license key", "errorCode": "INVALID_LICENSE_KEY"}
+    return 200, {
+        "success": True,
+        "message": "License key authenticated successfully",
+        "userStatus": "active",
+        "expiresAt": "2099-12-31T23:59:59Z"
+    }
+
+def _client_user_response(payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    if not all(payload.get(field) for field in ("masterUserId", "username", "passwordPlainText", "appVersion")):
+        return 400, {"success": False, "message": "Missing required fields", "errorCode": "MISSING_FIELDS"}
+    if payload.get("passwordPlainText") == "wrong":
+        return 401, {"success": False, "message": "Invalid username or password", "errorCode": "INVALID_CREDENTIALS"}
+    return 200, {
+        "success": True,
+        "message": f"Welcome back, {payload.get('username')}",
+        "userStatus": "active",
+        "expiresAt": "2099-12-31T23:59:59Z"
+    }
+
+ROUTES = {
+    "/api/authenticate-key": _license_response,
+    "/api/authenticate-client-user": _client_user_response,
+}
+
+class MockKeyMasterHandler(BaseHTTPRequestHandler):
+    """Implements the two KeyMaster authentication endpoints with keep-alive."""
+    
+    protocol_version = "HTTP/1.1"
+    server_version = "MockKeyMaster/1.0"
+    disable_nagle_algorithm = True  # headers and body are separate writes
+    
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients that cancel a request (e.g. the losing hedge) hang up early
+            self.close_connection = True
+    
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        
+        route = ROUTES.get(self.path.split("?", 1)[0])
+        if route is None:
+            self._send_json(404, {"success": False, "message": "Not found"})
+            return
+        
+        delay, fail = self.server.settings.next_delay_and_failure()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self._send_json(503, {"success": False, "message": "Service temporarily unavailable"})
+            return
+        
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"success": False, "message": "Invalid JSON", "errorCode": "INVALID_JSON"})
+            return
+        
+        status, body = route(payload)
+        self._send_json(status, body)
+    
+    def do_HEAD(self) -> None:
+        # Connection warm-up (KeyMasterClient.warm_up) probes the base URL
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+class MockKeyMasterServer(ThreadingHTTPServer):
+    """Threaded HTTP server carrying its MockSettings."""
+    
+    daemon_threads = True
+    
+    def __init__(self, address: Tuple[str, int], settings: MockSettings):
+        super().__init__(address, MockKeyMasterHandler)
+        self.settings = settings
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0,
+                      settings: Optional[MockSettings] = None) -> MockKeyMasterServer:
+    """
+    Start the mock server on a background thread.
+    
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        settings: Latency/jitter/error settings
+    
+    Returns:
+        Running server; use ``base_url`` as KEYMASTER_API_BASE and ``shutdown()`` to stop
+    """
+    server = MockKeyMasterServer((host, port), settings or MockSettings())
+    thread = threading.Thread(target=server.serve_forever, name="mock-keymaster", daemon=True)
+    thread.start()
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the KeyMaster authentication API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Base latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Random +/- latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Fraction of requests that are slow")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="Extra latency of a slow request in seconds")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    settings = MockSettings(args.latency, args.jitter, args.error_rate, args.seed, args.tail_rate, args.tail_latency)
+    server = MockKeyMasterServer((args.host, args.port), settings)
+    logger.info("Mock KeyMaster listening on %s (set KEYMASTER_API_BASE=%s)", server.base_url, server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import secrets
 import multiprocessing
 
 # Server socket
@@ -6,9 +7,33 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
+# GUNICORN_WORKER_CLASS selects the concurrency model:
+#   sync    - one request per process (default)
+#   gthread - GUNICORN_THREADS concurrent requests per process, no extra dependencies
+#   gevent  - up to worker_connections greenlets per process (pip install gevent)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", "8" if worker_class == "gthread" else "1"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+if worker_class == "sync":
+    workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    workers = multiprocessing.cpu_count() + 1
+
+# Upstream KeyMaster limits per worker: keep-alive pool size and the number of calls
+# allowed in flight before /auth sheds load with 503 + Retry-After
+if worker_class == "gevent":
+    _upstream_limit = os.environ.get("KEYMASTER_MAX_IN_FLIGHT", "50")
+else:
+    _upstream_limit = os.environ.get("KEYMASTER_MAX_IN_FLIGHT", str(threads))
+os.environ.setdefault("KEYMASTER_POOL_MAXSIZE", _upstream_limit)
+os.environ.setdefault("KEYMASTER_MAX_IN_FLIGHT", _upstream_limit)
+# ...and across all workers on this host, so bursts (and their retries) cannot
+# multiply upstream load by the number of workers. The slot lock files live in the
+# user's private cache directory (0700): other users must not be able to hold them
+_cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                          "keymaster")
+os.environ.setdefault("KEYMASTER_HOST_MAX_IN_FLIGHT", "32")
+os.environ.setdefault("KEYMASTER_HOST_SLOTS_DIR", os.path.join(_cache_dir, "upstream_slots"))
 timeout = 30
 keepalive = 2
 max_requests = 1000
@@ -20,15 +45,83 @@ limit_request_fields = 100
 limit_request_field_size = 8190
 
 # Application
-preload_app = True
+# keymaster_auth rebuilds its pooled HTTP session in each forked worker.
+# gevent must monkey-patch before the app imports requests/ssl, so no preloading there.
+preload_app = worker_class != "gevent"
 reload = False
 
+# Flask sessions and session tokens must be signed with the same key in every worker.
+# Without SECRET_KEY, app.py picks a random key per import, which (without preload_app)
+# means one per worker: generate it once here so forked workers inherit it.
+generated_secret_key = "SECRET_KEY" not in os.environ
+if generated_secret_key:
+    os.environ["SECRET_KEY"] = secrets.token_hex(32)
+
 # Logging
+# App records from all workers go through one queue to a single writer thread in the
+# master (see keymaster_logging.py), so workers never block on app.log.
+# Caveat: the queue is a pipe guarded by one lock shared by all workers. A worker
+# SIGKILLed in the middle of a put (e.g. on timeout) can leave a half-written record,
+# which breaks the reader, or die holding the lock, which stalls every other worker's
+# forwarder and thus the master's writer. Set KEYMASTER_LOG_SHARED_QUEUE=0 where
+# workers get killed often; each worker then writes through its own handler.
+os.environ.setdefault("KEYMASTER_LOG_SHARED_QUEUE", "1")
 accesslog = "access.log"
 errorlog = "error.log"
 loglevel = "info"
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
 
+# Metrics: workers share snapshots through this directory so /metrics
+# aggregates all of them (see keymaster_metrics.py)
+metrics_dir = os.environ.setdefault("KEYMASTER_METRICS_DIR", "/tmp/keymaster_metrics")
+
+# License results are cached in a SQLite file shared by all workers, so a result fetched
+# by one worker is a hit for the others and survives max_requests recycling and restarts
+os.environ.setdefault("KEYMASTER_CACHE_BACKEND", "sqlite")
+
+# Rate limiting: per-IP/per-username token buckets shared by all workers (see keymaster_ratelimit.py)
+ratelimit_db = os.environ.setdefault("KEYMASTER_RATELIMIT_DB", "/tmp/keymaster_ratelimit.db")
+
+# Session revocations (logout, revoke_user, revoke_all) are shared by all workers through
+# this file, kept in the user's private cache directory like the result cache; it is
+# not cleared on start, so revoked sessions stay revoked across restarts
+os.environ.setdefault("SESSION_REVOCATION_FILE", os.path.join(_cache_dir, "session_revocations.json"))
+
+def on_starting(server):
+    """Start each server with empty metrics and rate limit buckets"""
+    if generated_secret_key:
+        server.log.warning("SECRET_KEY is not set: using a random key, so sessions end when the server restarts")
+    import shutil
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(ratelimit_db + suffix)
+        except OSError:
+            pass
+    if os.environ.get("KEYMASTER_LOG_SHARED_QUEUE") == "1":
+        import keymaster_logging
+        keymaster_logging.start_log_listener()
+
+# Warm-up: each new worker resolves the HWID, compiles templates and opens KeyMaster
+# connections before it accepts requests (see warm_up_worker in app.py). Network
+# warm-up gives up after KEYMASTER_WARMUP_TIMEOUT seconds; idle connections are
+# refreshed every KEYMASTER_KEEPALIVE_INTERVAL seconds.
+worker_warmup = os.environ.get("WORKER_WARMUP", "1") == "1"
+os.environ.setdefault("KEYMASTER_KEEPALIVE_INTERVAL", "30")
+
+def post_worker_init(worker):
+    """Warm the worker up once the app is loaded (in the worker even with preload_app)"""
+    if worker_warmup:
+        from app import warm_up_worker
+        warm_up_worker()
+
+def on_exit(server):
+    """Write out records still queued by the workers"""
+    if os.environ.get("KEYMASTER_LOG_SHARED_QUEUE") == "1":
+        import keymaster_logging
+        keymaster_logging.stop_log_listener()
+
 # Process naming
 proc_name = 'keymaster_auth'
 
@@ -0,0 +1,600 @@
+import asyncio
+import os
+import time
+import weakref
+import logging
+from typing import Dict, Optional, Any, Tuple
+
+import httpx
+
+from keymaster_auth import (
+    LICENSE_AUTH_API_URL,
+    CLIENT_USER_AUTH_API_URL,
+    REQUEST_TIMEOUT,
+    DEFAULT_HEADERS,
+    MAX_IN_FLIGHT,
+    QUEUE_TIMEOUT,
+    UpstreamBusyError,
+    CircuitBreaker,
+    RetryPolicy,
+    HedgePolicy,
+    HEDGE_ENABLED,
+    circuit_breaker,
+    shared_hedge_policy,
+    host_upstream_limit,
+    build_license_payload,
+    build_user_payload,
+    license_cache,
+    record_result_metrics,
+    SingleFlight,
+    UpstreamCall,
+)
+from keymaster_cache import AuthResultCache, make_license_cache_key
+from keymaster_codec import dumps
+from keymaster_ratelimit import HostConcurrencyLimit
+from keymaster_result import AuthResult
+from keymaster_logging import SAMPLED
+from keymaster_transport import AsyncPhaseTracer, transport_error_from_httpx
+from keymaster_metrics import (
+    endpoint_name,
+    UPSTREAM_REQUEST_SECONDS,
+    CALL_SECONDS,
+    ERRORS_TOTAL,
+    CACHE_LOOKUPS_TOTAL,
+    COALESCED_TOTAL,
+    HEDGES_TOTAL,
+    HEDGE_SAVED_SECONDS,
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Async connection pool settings
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("KEYMASTER_ASYNC_MAX_CONNECTIONS", "100"))
+ASYNC_MAX_KEEPALIVE = int(os.environ.get("KEYMASTER_ASYNC_MAX_KEEPALIVE", "20"))
+
+class AsyncUpstreamLimiter:
+    """
+    Asyncio counterpart of ``keymaster_auth.UpstreamLimiter``.
+    
+    Caps the number of concurrent upstream calls per event loop. Tasks
+    beyond the limit wait up to ``queue_timeout`` seconds without blocking
+    the loop and are then rejected with UpstreamBusyError. A host limit is
+    shared with the sync clients; its lock files are tried in a worker
+    thread (they are files on disk) and polled with ``asyncio.sleep``
+    instead of blocking.
+    
+    Args:
+        max_in_flight: Maximum concurrent calls (0 disables the limit)
+        queue_timeout: Seconds to wait for a free slot
+        host_limit: Limit shared by all processes on the host
+            (defaults to ``keymaster_auth.host_upstream_limit``)
+    """
+    
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, queue_timeout: float = QUEUE_TIMEOUT,
+                 host_limit: Optional[HostConcurrencyLimit] = None):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.host_limit = host_limit if host_limit is not None else host_upstream_limit
+        # asyncio.Semaphore is bound to the loop it first waits on: keep one per loop
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._in_flight = 0
+        self._peak = 0
+        self._rejected = 0
+    
+    def _semaphore(self) -> Optional[asyncio.Semaphore]:
+        if self.max_in_flight <= 0:
+            return None
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+    
+    async def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Reserve a slot for an upstream call.
+        
+        Args:
+            timeout: Seconds to wait for a free slot (defaults to ``queue_timeout``)
+        
+        Returns:
+            Handle of the host-wide slot taken (None without a host limit);
+            pass it back to ``release``
+        
+        Raises:
+            UpstreamBusyError: If no slot frees up in time
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        semaphore = self._semaphore()
+        if semaphore is not None:
+            if semaphore.locked():
+                try:
+                    await asyncio.wait_for(semaphore.acquire(), timeout)
+                except asyncio.TimeoutError:
+                    self._reject(f"{self.max_in_flight} calls already in flight")
+            else:
+                await semaphore.acquire()
+        host_slot = None
+        if self.host_limit is not None:
+            try:
+                host_slot = await self._acquire_host_slot(deadline)
+            except BaseException:
+                if semaphore is not None:
+                    semaphore.release()
+                raise
+            if host_slot is None:
+                if semaphore is not None:
+                    semaphore.release()
+                self._reject(f"{self.host_limit.slots} calls already in flight on this host")
+        self._in_flight += 1
+        self._peak = max(self._peak, self._in_flight)
+        return host_slot
+    
+    async def _acquire_host_slot(self, deadline: float) -> Optional[int]:
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(self.host_limit.acquire, 0))
+            try:
+                host_slot = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # The attempt still runs to completion: give back a slot it takes
+                attempt.add_done_callback(self._release_abandoned_slot)
+                raise
+            if host_slot is not None or time.monotonic() >= deadline:
+                return host_slot
+            await asyncio.sleep(self.host_limit.poll_interval)
+    
+    def _release_abandoned_slot(self, attempt: "asyncio.Future[Optional[int]]") -> None:
+        if not attempt.cancelled() and attempt.exception() is None and attempt.result() is not None:
+            self.host_limit.release(attempt.result())
+    
+    def _reject(self, reason: str) -> None:
+        self._rejected += 1
+        logger.warning("Rejecting KeyMaster call: %s", reason)
+        raise UpstreamBusyError("Authentication server is busy, please retry shortly")
+    
+    def release(self, host_slot: Optional[int] = None) -> None:
+        """Release a slot reserved with acquire(), given the handle it returned."""
+        self._in_flight -= 1
+        if self.host_limit is not None and host_slot is not None:
+            self.host_limit.release(host_slot)
+        semaphore = self._semaphore()
+        if semaphore is not None:
+            semaphore.release()
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Get limiter statistics.
+        
+        Returns:
+            Dictionary with current/peak in-flight calls and rejections
+        """
+        return {
+            "max_in_flight": self.max_in_flight,
+            "host_max_in_flight": self.host_limit.slots if self.host_limit is not None else 0,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak,
+            "rejected": self._rejected
+        }
+
+class AsyncKeyMasterClient:
+    """
+    Asyncio KeyMaster API client backed by a shared httpx connection pool.
+    
+    The underlying ``httpx.AsyncClient`` is created lazily on first use and is
+    bound to the event loop it was created on; using the client from another
+    loop transparently builds a new pool for that loop.
+    
+    Args:
+        max_connections: Maximum concurrent connections
+        max_keepalive_connections: Idle connections kept open for reuse
+        headers: Default headers sent with every request
+        retry_policy: Retry policy for failed requests (defaults to RetryPolicy())
+        breaker: Circuit breaker (defaults to the shared ``keymaster_auth.circuit_breaker``)
+        hedging: Hedge slow attempts by default (KEYMASTER_HEDGE=1)
+        hedge_policy: Hedge delay and budget (defaults to ``keymaster_auth.shared_hedge_policy``)
+        limiter: Concurrency limiter applied to every request (defaults to
+            a new AsyncUpstreamLimiter)
+    """
+    
+    def __init__(self, max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = ASYNC_MAX_KEEPALIVE,
+                 headers: Optional[Dict[str, str]] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 hedging: bool = HEDGE_ENABLED,
+                 hedge_policy: Optional[HedgePolicy] = None,
+                 limiter: Optional[AsyncUpstreamLimiter] = None):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or circuit_breaker
+        self.hedging = hedging
+        self.hedge_policy = hedge_policy or shared_hedge_policy
+        self.limiter = limiter or AsyncUpstreamLimiter()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._requests = 0
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections
+        )
+        return httpx.AsyncClient(headers=self.headers, limits=limits, verify=True)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """httpx client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            self._client = self._build_client()
+            self._loop = loop
+            logger.debug("Built async KeyMaster HTTP pool (max_connections=%s)", self.max_connections)
+        return self._client
+    
+    async def post(self, api_url: str, body: bytes, timeout: float = REQUEST_TIMEOUT,
+                   queue_timeout: Optional[float] = None) -> httpx.Response:
+        """
+        Send a POST request over the shared connection pool.
+        
+        Args:
+            api_url: API endpoint URL
+            body: Serialized JSON request body
+            timeout: Request timeout in seconds
+            queue_timeout: Seconds to wait for a limiter slot (defaults to the limiter's)
+        
+        Returns:
+            Response object
+        
+        Raises:
+            UpstreamBusyError: If the limiter has no free slot
+            TransportError: If no response was received
+        """
+        endpoint = endpoint_name(api_url)
+        host_slot = await self.limiter.acquire(queue_timeout)
+        try:
+            self._requests += 1
+            started = time.perf_counter()
+            try:
+                return await self.client.post(api_url, content=body, timeout=timeout,
+                                              extensions={"trace": AsyncPhaseTracer(endpoint)})
+            except httpx.HTTPError as e:
+                raise transport_error_from_httpx(e) from e
+            finally:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        finally:
+            self.limiter.release(host_slot)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get request counters and limiter statistics for this client."""
+        return {"requests": self._requests, "limiter": self.limiter.stats()}
+    
+    async def aclose(self) -> None:
+        """Close all pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+    
+    async def __aenter__(self) -> "AsyncKeyMasterClient":
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent identical coroutine calls into a single upstream request.
+    
+    The first task for a key starts the request as its own task; every task
+    with the same key awaits it through ``asyncio.shield``, so cancelling one
+    waiter does not cancel the shared request for the others. The request is
+    cancelled only when every waiter has gone away.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[Any, asyncio.Task] = {}
+        self._waiters: Dict[Any, int] = {}
+        self._leaders = 0
+        self._followers = 0
+    
+    async def do(self, key: str, coro_fn) -> AuthResult:
+        """
+        Await ``coro_fn()`` once per key among concurrent tasks.
+        
+        Args:
+            key: Coalescing key (see SingleFlight.make_key)
+            coro_fn: Zero-argument coroutine function performing the request
+        
+        Returns:
+            Result (a private copy for every caller)
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._calls.get(loop_key)
+        if task is None:
+            self._leaders += 1
+            task = asyncio.ensure_future(coro_fn())
+            self._calls[loop_key] = task
+            self._waiters[loop_key] = 0
+            task.add_done_callback(lambda _: self._forget(loop_key, task))
+        else:
+            self._followers += 1
+            COALESCED_TOTAL.inc(coalescer="async")
+        
+        self._waiters[loop_key] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(loop_key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if loop_key in self._waiters:
+                self._waiters[loop_key] -= 1
+        return result.copy()
+    
+    def _forget(self, loop_key, task: asyncio.Task) -> None:
+        if self._calls.get(loop_key) is task:
+            del self._calls[loop_key]
+            self._waiters.pop(loop_key, None)
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Get coalescing statistics.
+        
+        Returns:
+            Dictionary with upstream calls made, calls saved by coalescing and calls in flight
+        """
+        return {
+            "upstream_calls": self._leaders,
+            "coalesced_calls": self._followers,
+            "in_flight": len(self._calls)
+        }
+
+# Shared coalescer for identical in-flight async KeyMaster requests
+async_request_coalescer = AsyncSingleFlight()
+
+_default_async_client: Optional[AsyncKeyMasterClient] = None
+
+def get_default_async_client() -> AsyncKeyMasterClient:
+    """
+    Get the process-wide async KeyMaster client.
+    
+    Returns:
+        Shared AsyncKeyMasterClient instance
+    """
+    global _default_async_client
+    if _default_async_client is None:
+        _default_async_client = AsyncKeyMasterClient()
+    return _default_async_client
+
+async def _cache_call(method, *args):
+    # The in-process cache is a dict lookup; other caches (SQLite) do disk I/O
+    if isinstance(method.__self__, AuthResultCache):
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+async def authenticate_license_key(master_user_id: str, license_key: str, hwid: str,
+                                   app_version: str, username: Optional[str] = None,
+                                   client: Optional[AsyncKeyMasterClient] = None,
+                                   use_cache: bool = True,
+                                   hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Authenticate a license key using KeyMaster API without blocking the event loop.
+    
+    With the host-wide SQLite result cache, lookups and stores run in a
+    worker thread; the in-process cache is used directly.
+    
+    Args:
+        master_user_id: Master user ID from KeyMaster
+        license_key: License key to authenticate
+        hwid: Hardware ID
+        app_version: Application version
+        username: Optional username
+        client: Async client to use (defaults to the shared async client)
+        use_cache: Serve and store the result in ``keymaster_auth.license_cache``
+        hedge: Hedge slow attempts (see keymaster_auth.HedgePolicy); defaults to ``client.hedging``
+    
+    Returns:
+        AuthResult (also usable as a dictionary) containing the authentication result
+    
+    Raises:
+        AuthenticationError: If authentication fails
+        NetworkError: If network request fails
+    """
+    payload = build_license_payload(master_user_id, license_key, hwid, app_version, username)
+    
+    cache_key = None
+    if use_cache and license_cache.enabled:
+        cache_key = make_license_cache_key(master_user_id, license_key, hwid, app_version, username)
+        cached = await _cache_call(license_cache.get, cache_key)
+        CACHE_LOOKUPS_TOTAL.inc(cache="license", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.debug("License key %s... served from cache", license_key[:8])
+            return cached
+    
+    logger.info("Authenticating license key: %s...", license_key[:8], extra=SAMPLED)
+    result = await _send_request(LICENSE_AUTH_API_URL, payload, client, hedge)
+    
+    if cache_key is not None:
+        await _cache_call(license_cache.put, cache_key, result)
+    return result
+
+async def authenticate_client_user(master_user_id: str, username: str,
+                                   password_plain_text: str, app_version: str,
+                                   client: Optional[AsyncKeyMasterClient] = None,
+                                   hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Authenticate a client user (username/password) without blocking the event loop.
+    
+    Args:
+        master_user_id: Master user ID from KeyMaster
+        username: Username to authenticate
+        password_plain_text: Plain text password
+        app_version: Application version
+        client: Async client to use (defaults to the shared async client)
+    
+    Returns:
+        AuthResult (also usable as a dictionary) containing the authentication result
+    
+    Raises:
+        AuthenticationError: If authentication fails
+        NetworkError: If network request fails
+    """
+    payload = build_user_payload(master_user_id, username, password_plain_text, app_version)
+    
+    logger.info("Authenticating user: %s", username, extra=SAMPLED)
+    return await _send_request(CLIENT_USER_AUTH_API_URL, payload, client, hedge)
+
+async def _timed_post(client: AsyncKeyMasterClient, api_url: str, body: bytes, timeout: float,
+                      queue_timeout: Optional[float] = None) -> Tuple[httpx.Response, float]:
+    started = time.perf_counter()
+    response = await client.post(api_url, body, timeout=timeout, queue_timeout=queue_timeout)
+    return response, time.perf_counter() - started
+
+async def _post_hedged(client: AsyncKeyMasterClient, api_url: str, body: bytes,
+                       timeout: float) -> httpx.Response:
+    """
+    Send one attempt, hedging it with a second request if it is slow.
+    
+    Same policy as keymaster_auth._post_hedged (the hedge is only sent if
+    an upstream slot is free right away), but the losing request is
+    cancelled outright. Its real latency is then unknown, so the time saved
+    is estimated from the recent latencies slower than its elapsed time, and
+    the elapsed time is recorded as a (lower-bound) sample so the percentile
+    is not biased towards fast responses.
+    
+    Returns:
+        The winning response
+    """
+    policy = client.hedge_policy
+    endpoint = endpoint_name(api_url)
+    started = time.perf_counter()
+    
+    def record_latency(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            policy.record_latency(endpoint, task.result()[1])
+    
+    policy.start_call()
+    primary = asyncio.ensure_future(_timed_post(client, api_url, body, timeout))
+    primary.add_done_callback(record_latency)
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=min(policy.delay(endpoint), timeout))
+        if done:
+            return primary.result()[0]
+        
+        if not policy.allow_hedge():
+            HEDGES_TOTAL.inc(endpoint=endpoint, outcome="budget")
+            return (await primary)[0]
+        hedge_started = time.perf_counter()
+        remaining = timeout - (hedge_started - started)
+        hedge = asyncio.ensure_future(_timed_post(client, api_url, body, remaining, 0))
+        hedge.add_done_callback(record_latency)
+        tasks.append(hedge)
+        
+        winner = None
+        pending = {primary, hedge}
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in (primary, hedge):
+                if task in done and task.exception() is None:
+                    winner = task
+                    break
+        
+        if hedge.done() and isinstance(hedge.exception(), UpstreamBusyError):
+            # No free slot for the hedge: nothing was sent
+            policy.refund_hedge()
+            HEDGES_TOTAL.inc(endpoint=endpoint, outcome="busy")
+            return (await primary)[0]
+        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="sent")
+        if winner is None:
+            return primary.result()[0]  # raises the original request's error
+        
+        if winner is hedge:
+            HEDGES_TOTAL.inc(endpoint=endpoint, outcome="won")
+            policy.record_win()
+            if not primary.done():
+                elapsed = time.perf_counter() - started
+                saved = policy.expected_remaining(endpoint, elapsed)
+                policy.record_latency(endpoint, elapsed)
+                HEDGE_SAVED_SECONDS.observe(saved, endpoint=endpoint)
+                policy.record_saved(saved)
+        else:
+            HEDGES_TOTAL.inc(endpoint=endpoint, outcome="lost")
+            if not hedge.done():
+                policy.record_latency(endpoint, time.perf_counter() - hedge_started)
+        return winner.result()[0]
+    finally:
+        # Cancel the loser (or both, if the caller was cancelled)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def _send_request(api_url: str, payload: Dict[str, Any],
+                        client: Optional[AsyncKeyMasterClient] = None,
+                        hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Internal helper to send POST request with retry logic and non-blocking backoff.
+    
+    Concurrent identical requests through the same client are coalesced
+    through ``async_request_coalescer``. Cancelling the calling task stops waiting
+    immediately; the request itself is cancelled once no task waits for it.
+    
+    Args:
+        api_url: API endpoint URL
+        payload: Request payload
+        client: Async client to use (defaults to the shared async client)
+    
+    Returns:
+        AuthResult
+    
+    Raises:
+        NetworkError: If all retry attempts fail
+    """
+    body = dumps(payload)
+    client = client or get_default_async_client()
+    key = SingleFlight.make_key(api_url, body, client)
+    endpoint = endpoint_name(api_url)
+    started = time.perf_counter()
+    try:
+        result = await async_request_coalescer.do(key, lambda: _send_once(api_url, body, client, hedge))
+    except Exception as e:
+        ERRORS_TOTAL.inc(endpoint=endpoint, code=type(e).__name__)
+        CALL_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, outcome="error")
+        raise
+    record_result_metrics(endpoint, result, time.perf_counter() - started)
+    return result
+
+async def _send_once(api_url: str, body: bytes,
+                     client: Optional[AsyncKeyMasterClient],
+                     hedge: Optional[bool] = None) -> AuthResult:
+    """Perform one upstream request for _send_request, retrying per the client's RetryPolicy."""
+    client = client or get_default_async_client()
+    hedge = client.hedging if hedge is None else hedge
+    call = UpstreamCall(api_url, client.retry_policy, client.breaker)
+    
+    for attempt_timeout in call.attempts():
+        try:
+            if hedge:
+                response = await _post_hedged(client, api_url, body, attempt_timeout)
+            else:
+                response = await client.post(api_url, body, timeout=attempt_timeout)
+            
+            # Log response status
+            logger.debug("Response status: %s", response.status_code)
+        except asyncio.CancelledError:
+            call.abandon()
+            raise
+        except Exception as e:
+            delay = call.failed(e)
+        else:
+            result, delay = call.answered(response)
+            if result is not None:
+                return result
+        
+        # Wait before retry without blocking the event loop
+        await asyncio.sleep(delay)
@@ -1,24 +1,116 @@
-import requests
-import json
 import uuid
 import os
 import platform
 import hashlib
 import time
 import logging
-from typing import Dict, Optional, Any
+import threading
+import weakref
+import random
+import tempfile
+import subprocess
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, Optional, Any, Union, Tuple
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+from keymaster_cache import create_result_cache, make_license_cache_key
+from keymaster_ratelimit import HostConcurrencyLimit, default_host_limit
+from keymaster_logging import SAMPLED
+from keymaster_profile import span
+from keymaster_codec import dumps, loads
+from keymaster_result import AuthResult
+from keymaster_transport import (
+    TRANSPORT,
+    Transport,
+    TransportResponse,
+    TransportError,
+    TransportTimeout,
+    TransportConnectTimeout,
+    TransportConnectionError,
+    create_transport,
+)
+from keymaster_metrics import (
+    registry as metrics_registry,
+    endpoint_name,
+    UPSTREAM_REQUEST_SECONDS,
+    CALL_SECONDS,
+    RETRIES_TOTAL,
+    ERRORS_TOTAL,
+    RESULTS_TOTAL,
+    CACHE_LOOKUPS_TOTAL,
+    COALESCED_TOTAL,
+    HEDGES_TOTAL,
+    HEDGE_SAVED_SECONDS,
+    CIRCUIT_STATE,
+    UPSTREAM_IN_FLIGHT,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # --- KeyMaster API Endpoints ---
-LICENSE_AUTH_API_URL = "https://keymaster-agni.vercel.app/api/authenticate-key"
-CLIENT_USER_AUTH_API_URL = "https://keymaster-agni.vercel.app/api/authenticate-client-user"
+# KEYMASTER_API_BASE can point at a local stand-in (see benchmarks/mock_keymaster.py)
+KEYMASTER_API_BASE = os.environ.get("KEYMASTER_API_BASE", "https://keymaster-agni.vercel.app").rstrip("/")
+LICENSE_AUTH_API_URL = f"{KEYMASTER_API_BASE}/api/authenticate-key"
+CLIENT_USER_AUTH_API_URL = f"{KEYMASTER_API_BASE}/api/authenticate-client-user"
 
 # Request timeout and retry settings
 REQUEST_TIMEOUT = 30
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
+RETRY_MAX_DELAY = 8  # seconds, cap for exponential backoff
+REQUEST_DEADLINE = float(os.environ.get("KEYMASTER_REQUEST_DEADLINE", "25"))  # total budget per call, 0 = none
+RETRY_STATUSES = frozenset({408, 425, 429, 502, 503, 504})
+
+# Circuit breaker settings
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("KEYMASTER_CIRCUIT_FAILURES", "5"))  # consecutive failures to open
+CIRCUIT_RECOVERY_TIMEOUT = float(os.environ.get("KEYMASTER_CIRCUIT_RECOVERY", "30"))  # seconds before a trial call
+
+# Connection pool settings (per KeyMasterClient)
+POOL_CONNECTIONS = int(os.environ.get("KEYMASTER_POOL_CONNECTIONS", "4"))  # number of hosts to keep pools for
+POOL_MAXSIZE = int(os.environ.get("KEYMASTER_POOL_MAXSIZE", "10"))  # keep-alive connections per host
+
+# Backpressure: upstream calls allowed in flight per process (0 = unlimited) and
+# how long a caller may wait for a free slot before being rejected
+MAX_IN_FLIGHT = int(os.environ.get("KEYMASTER_MAX_IN_FLIGHT", str(POOL_MAXSIZE)))
+QUEUE_TIMEOUT = float(os.environ.get("KEYMASTER_QUEUE_TIMEOUT", "2"))  # seconds
+
+# Hedged requests (opt-in): if an attempt has not answered after the HEDGE_PERCENTILE
+# latency of recent attempts, a second identical request is sent and the first answer wins
+HEDGE_ENABLED = os.environ.get("KEYMASTER_HEDGE", "") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("KEYMASTER_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("KEYMASTER_HEDGE_MIN_DELAY", "0.05"))  # seconds
+HEDGE_INITIAL_DELAY = float(os.environ.get("KEYMASTER_HEDGE_INITIAL_DELAY", "1"))  # seconds, until enough samples
+HEDGE_BUDGET = float(os.environ.get("KEYMASTER_HEDGE_BUDGET", "0.05"))  # max extra requests per call
+HEDGE_THREADS = int(os.environ.get("KEYMASTER_HEDGE_THREADS", "64"))  # threads running hedged attempts
+
+# Worker warm-up (KeyMasterClient.warm_up): connections opened ahead of the first call,
+# the most time warm-up may take, and how often idle connections are refreshed
+WARMUP_CONNECTIONS = int(os.environ.get("KEYMASTER_WARMUP_CONNECTIONS", "2"))
+WARMUP_TIMEOUT = float(os.environ.get("KEYMASTER_WARMUP_TIMEOUT", "2"))  # seconds
+KEEPALIVE_INTERVAL = float(os.environ.get("KEYMASTER_KEEPALIVE_INTERVAL", "0"))  # seconds, 0 = off
+
+# HWID source: "file" keeps a random UUID in hwid.dat; "hardware" derives new HWIDs
+# from the machine identity (machine-id / DMI UUID / MachineGuid) instead
+HWID_SOURCE = os.environ.get("KEYMASTER_HWID_SOURCE", "file").lower()
+_MACHINE_ID_PATHS = ("/etc/machine-id", "/var/lib/dbus/machine-id", "/sys/class/dmi/id/product_uuid")
+_HWID_NAMESPACE = uuid.UUID("a436493a-3fbf-4087-99fb-81aabe3079a9")
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "KeyMaster-Client/1.0",
+    "Accept": "application/json",
+    "Connection": "keep-alive"
+}
 
 class AuthenticationError(Exception):
     """Custom exception for authentication errors"""
@@ -28,88 +120,1105 @@ class NetworkError(Exception):
     """Custom exception for network-related errors"""
     pass
 
-def get_persistent_hwid(app_name: str = "StreamerPanel") -> str:
+class UpstreamBusyError(NetworkError):
+    """Raised when too many KeyMaster calls are already in flight"""
+    pass
+
+# Host-wide cap shared by all worker processes (KEYMASTER_HOST_MAX_IN_FLIGHT)
+host_upstream_limit = default_host_limit()
+
+class UpstreamLimiter:
     """
-    Generate and persist a unique HWID based on UUID and store it across sessions.
+    Caps the number of concurrent upstream KeyMaster calls in this process.
+    
+    Callers beyond the limit wait up to ``queue_timeout`` seconds for a free
+    slot and are then rejected with UpstreamBusyError, so a slow upstream
+    turns into fast 503s instead of an ever-growing queue of blocked workers.
+    When a host limit is configured, a caller must also get one of the
+    host-wide slots within the same ``queue_timeout``.
     
     Args:
-        app_name: Name of the application for storage directory
+        max_in_flight: Maximum concurrent calls (0 disables the limit)
+        queue_timeout: Seconds to wait for a free slot
+        host_limit: Limit shared by all processes on the host
+            (defaults to ``host_upstream_limit``)
+    """
+    
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, queue_timeout: float = QUEUE_TIMEOUT,
+                 host_limit: Optional[HostConcurrencyLimit] = None):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.host_limit = host_limit if host_limit is not None else host_upstream_limit
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._semaphore = threading.BoundedSemaphore(self.max_in_flight) if self.max_in_flight > 0 else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak = 0
+        self._rejected = 0
+        self._context_slots = threading.local()  # slots taken by ``with limiter:`` blocks
+    
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Reserve a slot for an upstream call.
         
-    Returns:
-        Persistent hardware ID string
+        Args:
+            timeout: Seconds to wait for a free slot (defaults to ``queue_timeout``)
         
-    Raises:
-        OSError: If unable to create directories or files
+        Returns:
+            Handle of the host-wide slot taken (None without a host limit);
+            pass it back to ``release``
+        
+        Raises:
+            UpstreamBusyError: If no slot frees up in time
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+        if self._semaphore is not None and not self._semaphore.acquire(timeout=timeout):
+            self._reject(f"{self.max_in_flight} calls already in flight")
+        host_slot = None
+        if self.host_limit is not None:
+            remaining = max(0.0, timeout - (time.monotonic() - started))
+            host_slot = self.host_limit.acquire(remaining)
+            if host_slot is None:
+                if self._semaphore is not None:
+                    self._semaphore.release()
+                self._reject(f"{self.host_limit.slots} calls already in flight on this host")
+        with self._lock:
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+        return host_slot
+    
+    def _reject(self, reason: str) -> None:
+        with self._lock:
+            self._rejected += 1
+        logger.warning("Rejecting KeyMaster call: %s", reason)
+        raise UpstreamBusyError("Authentication server is busy, please retry shortly")
+    
+    def release(self, host_slot: Optional[int] = None) -> None:
+        """Release a slot reserved with acquire(), given the handle it returned."""
+        with self._lock:
+            self._in_flight -= 1
+        if self.host_limit is not None and host_slot is not None:
+            self.host_limit.release(host_slot)
+        if self._semaphore is not None:
+            self._semaphore.release()
+    
+    def __enter__(self) -> "UpstreamLimiter":
+        slots = self._context_slots.__dict__.setdefault("stack", [])
+        slots.append(self.acquire())
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.release(self._context_slots.stack.pop())
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Get limiter statistics.
+        
+        Returns:
+            Dictionary with current/peak in-flight calls and rejections
+        """
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "host_max_in_flight": self.host_limit.slots if self.host_limit is not None else 0,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak,
+                "rejected": self._rejected
+            }
+
+class CircuitOpenError(UpstreamBusyError):
+    """Raised without contacting KeyMaster while the circuit breaker is open"""
+    pass
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed KeyMaster call is retried.
+    
+    Backoff is exponential with full jitter, every attempt is bounded by the
+    remaining total ``deadline`` budget, and only transient failures are
+    retried: connection errors, timeouts (if ``retry_on_timeout``) and the
+    HTTP statuses in ``retry_statuses``. Definitive answers, malformed
+    responses and other request errors are never retried.
+    
+    Args:
+        max_attempts: Maximum number of attempts including the first
+        base_delay: Backoff before the first retry in seconds
+        max_delay: Upper bound for a single backoff in seconds
+        multiplier: Backoff growth factor per attempt
+        jitter: Randomize each backoff between 0 and its nominal value
+        deadline: Total time budget per call in seconds (0 disables)
+        retry_statuses: HTTP status codes treated as transient
+        retry_on_timeout: Retry after read timeouts (connect failures are always retried)
+    """
+    
+    def __init__(self, max_attempts: int = MAX_RETRIES, base_delay: float = RETRY_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, multiplier: float = 2.0, jitter: bool = True,
+                 deadline: float = REQUEST_DEADLINE, retry_statuses=RETRY_STATUSES,
+                 retry_on_timeout: bool = True):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_on_timeout = retry_on_timeout
+    
+    def start(self, timeout: Optional[float] = None) -> Optional[float]:
+        """
+        Compute the absolute deadline for a call.
+        
+        Args:
+            timeout: Per-call budget overriding the policy deadline
+        
+        Returns:
+            Monotonic deadline, or None if the call is unbounded
+        """
+        budget = timeout if timeout is not None else self.deadline
+        return time.monotonic() + budget if budget else None
+    
+    def attempt_timeout(self, deadline: Optional[float]) -> float:
+        """Timeout for the next attempt, never past the deadline (<= 0 when exhausted)."""
+        if deadline is None:
+            return REQUEST_TIMEOUT
+        return min(REQUEST_TIMEOUT, deadline - time.monotonic())
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Delay before retrying after the given zero-based attempt.
+        
+        Args:
+            attempt: Index of the attempt that just failed
+            retry_after: Server-requested delay (Retry-After), used as a floor
+        """
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+    
+    def can_wait(self, delay: float, deadline: Optional[float]) -> bool:
+        """Whether sleeping ``delay`` seconds still leaves time for another attempt."""
+        return deadline is None or time.monotonic() + delay < deadline
+    
+    def is_retryable_status(self, status_code: int) -> bool:
+        return status_code in self.retry_statuses
+
+class CircuitBreaker:
     """
+    Shared circuit breaker guarding calls to the KeyMaster host.
+    
+    closed:    calls flow normally; consecutive transient failures are counted.
+    open:      after ``failure_threshold`` consecutive failures every call fails
+               fast with CircuitOpenError for ``recovery_timeout`` seconds.
+    half_open: then up to ``half_open_max_calls`` trial calls are let through;
+               a success closes the circuit, a failure opens it again.
+    
+    Only transient failures (timeouts, connection errors, 5xx/429) count;
+    definitive answers such as an invalid license count as successes.
+    
+    Args:
+        failure_threshold: Consecutive failures that open the circuit
+        recovery_timeout: Seconds to stay open before allowing trial calls
+        half_open_max_calls: Concurrent trial calls allowed while half-open
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = CIRCUIT_RECOVERY_TIMEOUT, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._times_opened = 0
+        self._rejected = 0
+    
+    @property
+    def state(self) -> str:
+        """Current state: closed, open or half_open."""
+        with self._lock:
+            return self._current_state()
+    
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+    
+    def before_call(self) -> None:
+        """
+        Reserve permission for a call.
+        
+        Every successful before_call must be followed by record_success,
+        record_failure or release.
+        
+        Raises:
+            CircuitOpenError: If the circuit is open or trial calls are exhausted
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._trial_calls < self.half_open_max_calls:
+                self._trial_calls += 1
+                return
+            self._rejected += 1
+        raise CircuitOpenError("Authentication server unavailable, please retry shortly")
+    
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("KeyMaster circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_calls = 0
+    
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._times_opened += 1
+                logger.warning("KeyMaster circuit breaker opened after %s consecutive failures", self._failures)
+    
+    def release(self) -> None:
+        """Give back a reservation whose call never reached the server."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trial_calls > 0:
+                self._trial_calls -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get circuit breaker statistics.
+        
+        Returns:
+            Dictionary with state, consecutive failures, open count and rejected calls
+        """
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "rejected": self._rejected
+            }
+
+# Shared breaker for the KeyMaster host, used by every client by default
+circuit_breaker = CircuitBreaker()
+
+class HedgePolicy:
+    """
+    Decides when a slow KeyMaster attempt gets a hedged (duplicate) request.
+    
+    The hedge delay is the ``percentile`` latency of the last ``window``
+    answered attempts per endpoint (``initial_delay`` until ``min_samples``
+    are known, never below ``min_delay``), so only the slowest few percent
+    of attempts are hedged. A token bucket caps the extra load: every call
+    earns ``budget`` tokens (up to ``burst``) and every hedge spends one, so
+    hedges never exceed ``budget`` times the call rate, even when the
+    upstream is slow across the board.
+    
+    Args:
+        percentile: Latency percentile after which an attempt is hedged
+        min_delay: Lower bound for the hedge delay in seconds
+        initial_delay: Hedge delay in seconds until ``min_samples`` latencies are known
+        budget: Hedges allowed per call (0.05 = at most 5% extra requests)
+        burst: Hedges that may be sent back to back
+        window: Recent latencies kept per endpoint
+        min_samples: Latencies needed before the percentile is used
+    """
+    
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_delay: float = HEDGE_MIN_DELAY,
+                 initial_delay: float = HEDGE_INITIAL_DELAY, budget: float = HEDGE_BUDGET,
+                 burst: float = 10, window: int = 1000, min_samples: int = 50):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[str, "deque[float]"] = {}
+        self._delays: Dict[str, float] = {}
+        self._stale: Dict[str, int] = {}
+        self._tokens = float(self.burst)
+        self._calls = 0
+        self._hedged = 0
+        self._won = 0
+        self._denied = 0
+        self._saved = 0.0
+    
+    def delay(self, endpoint: str) -> float:
+        """Seconds to wait for an attempt before hedging it."""
+        return self._delays.get(endpoint, self.initial_delay)
+    
+    def record_latency(self, endpoint: str, seconds: float) -> None:
+        """Add the latency of an answered attempt to the endpoint's window."""
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+            stale = self._stale.get(endpoint, 0) + 1
+            # Re-sort only every few samples; the percentile moves slowly
+            if len(samples) >= self.min_samples and stale >= max(1, self.min_samples // 5):
+                ordered = sorted(samples)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delays[endpoint] = max(self.min_delay, ordered[index])
+                stale = 0
+            self._stale[endpoint] = stale
+    
+    def expected_remaining(self, endpoint: str, elapsed: float) -> float:
+        """
+        Estimate how much longer an attempt that has run ``elapsed`` seconds would take.
+        
+        Used to report the latency saved when the slower attempt is cancelled
+        and its real latency is never seen.
+        """
+        with self._lock:
+            slower = [value for value in self._samples.get(endpoint, ()) if value > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else 0.0
+    
+    def start_call(self) -> None:
+        """Earn budget for one call that may be hedged."""
+        with self._lock:
+            self._calls += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+    
+    def allow_hedge(self) -> bool:
+        """Spend budget for one hedge; False when the budget is exhausted."""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._hedged += 1
+                return True
+            self._denied += 1
+            return False
+    
+    def refund_hedge(self) -> None:
+        """Give back the budget of a hedge that could not be sent."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+            self._hedged -= 1
+    
+    def record_win(self) -> None:
+        """Count a call answered by its hedge."""
+        with self._lock:
+            self._won += 1
+    
+    def record_saved(self, seconds: float) -> None:
+        """Add latency saved by a winning hedge."""
+        with self._lock:
+            self._saved += seconds
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics.
+        
+        Returns:
+            Dictionary with calls, hedges sent, hedge rate, hedges that won,
+            hedges denied by the budget, latency saved and current delays
+        """
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "hedged": self._hedged,
+                "hedge_rate": self._hedged / self._calls if self._calls else 0.0,
+                "won": self._won,
+                "budget_denied": self._denied,
+                "saved_seconds": round(self._saved, 6),
+                "delays": dict(self._delays)
+            }
+
+# Shared hedging state (latency windows and budget), used by every client by default
+shared_hedge_policy = HedgePolicy()
+
+_CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+def _collect_gauges() -> None:
+    CIRCUIT_STATE.set(_CIRCUIT_STATE_VALUES[circuit_breaker.state])
+    if _default_client is not None:
+        UPSTREAM_IN_FLIGHT.set(_default_client.limiter.stats()["in_flight"])
+
+metrics_registry.register_collector(_collect_gauges)
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds (HTTP dates are ignored)."""
     try:
-        system = platform.system()
-        
-        # Determine base directory based on OS
-        if system == "Windows":
-            base_dir = os.getenv('APPDATA') or os.path.join(os.path.expanduser("~"), 'AppData', 'Roaming')
-        elif system == "Darwin":
-            base_dir = os.path.join(os.path.expanduser("~"), 'Library', 'Application Support')
-        else:  # Linux and other Unix-like systems
-            base_dir = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser("~"), '.config')
-        
-        # Create safe app name for directory
-        safe_app_name = "".join(c if c.isalnum() else "_" for c in app_name)
-        app_data_dir = os.path.join(base_dir, safe_app_name.lower())
-        hwid_file_path = os.path.join(app_data_dir, "hwid.dat")
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+class _InFlightCall:
+    """Result slot shared by callers coalesced onto one upstream request."""
+    __slots__ = ("event", "result", "error")
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[AuthResult] = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into a single upstream request.
+    
+    The first caller for a key (the leader) runs the request; callers that
+    arrive with the same key while it is in flight wait for it and receive a
+    copy of its result, or the same exception. Keys only live while a call is
+    in flight, so nothing is cached.
+    """
+    
+    def __init__(self, name: str = "sync"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _InFlightCall] = {}
+        self._leaders = 0
+        self._followers = 0
+    
+    @staticmethod
+    def make_key(api_url: str, body: Union[bytes, str], client: Any = None) -> str:
+        """
+        Build a coalescing key; the body is hashed so credentials are not kept around.
         
-        # Try to create directory if it doesn't exist
-        os.makedirs(app_data_dir, exist_ok=True)
+        Calls only coalesce through the same ``client``, since two clients may
+        use different transports, credentials or retry policies. The in-flight
+        call keeps its client alive, so ``id(client)`` cannot be reused while
+        the key exists.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return f"{id(client):x}:{api_url}#{hashlib.sha256(body).hexdigest()}"
+    
+    def do(self, key: str, fn, timeout: Optional[float] = None) -> AuthResult:
+        """
+        Run ``fn`` once per key among concurrent callers.
+        
+        Args:
+            key: Coalescing key
+            fn: Zero-argument callable performing the request
+            timeout: Maximum seconds a follower waits for the leader's result
+        
+        Returns:
+            Result (a private copy for followers)
         
-        # Try to read existing HWID
-        if os.path.exists(hwid_file_path):
+        Raises:
+            NetworkError: If a follower times out waiting for the leader
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self._leaders += 1
+            else:
+                self._followers += 1
+        
+        if not leader:
+            COALESCED_TOTAL.inc(coalescer=self.name)
+            if not call.event.wait(timeout):
+                raise NetworkError("Authentication server timeout")
+            if call.error is not None:
+                raise call.error
+            return call.result.copy()
+        
+        try:
+            result = fn()
+            call.result = result.copy()  # followers copy from a snapshot the leader cannot mutate
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Get coalescing statistics.
+        
+        Returns:
+            Dictionary with upstream calls made, calls saved by coalescing and calls in flight
+        """
+        with self._lock:
+            return {
+                "upstream_calls": self._leaders,
+                "coalesced_calls": self._followers,
+                "in_flight": len(self._calls)
+            }
+    
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+
+# Shared coalescer for identical in-flight KeyMaster requests
+request_coalescer = SingleFlight("sync")
+
+# Clients alive in this process, so their sessions can be dropped after fork()
+_live_clients: "weakref.WeakSet[KeyMasterClient]" = weakref.WeakSet()
+
+class KeyMasterClient:
+    """
+    Reusable KeyMaster API client that sends requests over a pooled transport.
+    
+    Connections to the KeyMaster host are kept open between calls, so only the
+    first request per connection pays for DNS, TCP connect and TLS handshake.
+    The transport's pool is rebuilt automatically in a forked child process
+    (e.g. a gunicorn worker with ``preload_app = True``), so sockets are never
+    shared between processes.
+    
+    Args:
+        pool_maxsize: Maximum number of keep-alive connections per host
+        pool_connections: Number of per-host pools to cache
+        pool_block: Block when the pool is exhausted instead of opening
+            extra, non-pooled connections
+        headers: Default headers sent with every request
+        limiter: Concurrency limiter applied to every request (defaults to
+            one allowing ``MAX_IN_FLIGHT`` calls)
+        retry_policy: Retry policy for failed requests (defaults to RetryPolicy())
+        breaker: Circuit breaker (defaults to the shared ``circuit_breaker``)
+        hedging: Hedge slow attempts by default (KEYMASTER_HEDGE=1)
+        hedge_policy: Hedge delay and budget (defaults to ``shared_hedge_policy``)
+        transport: Transport sending the requests (defaults to the one named
+            by KEYMASTER_TRANSPORT, see keymaster_transport)
+    """
+    
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE, pool_connections: int = POOL_CONNECTIONS,
+                 pool_block: bool = False, headers: Optional[Dict[str, str]] = None,
+                 limiter: Optional[UpstreamLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 hedging: bool = HEDGE_ENABLED,
+                 hedge_policy: Optional[HedgePolicy] = None,
+                 transport: Optional[Transport] = None):
+        self.pool_maxsize = pool_maxsize
+        self.pool_connections = pool_connections
+        self.pool_block = pool_block
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self.limiter = limiter or UpstreamLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or circuit_breaker
+        self.hedging = hedging
+        self.hedge_policy = hedge_policy or shared_hedge_policy
+        self.transport = transport or create_transport(
+            TRANSPORT, self.headers, pool_maxsize=pool_maxsize,
+            pool_connections=pool_connections, pool_block=pool_block
+        )
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._last_used = 0.0
+        self._keepalive_stop: Optional[threading.Event] = None
+        _live_clients.add(self)
+    
+    def post(self, api_url: str, body: bytes, timeout: float = REQUEST_TIMEOUT,
+             queue_timeout: Optional[float] = None) -> TransportResponse:
+        """
+        Send a POST request over the client's transport.
+        
+        Args:
+            api_url: API endpoint URL
+            body: Serialized JSON request body
+            timeout: Request timeout in seconds
+            queue_timeout: Seconds to wait for a limiter slot (defaults to the limiter's)
+        
+        Returns:
+            Response object
+        
+        Raises:
+            UpstreamBusyError: If the limiter has no free slot
+            TransportError: If no response was received
+        """
+        endpoint = endpoint_name(api_url)
+        host_slot = self.limiter.acquire(queue_timeout)
+        try:
+            with self._lock:
+                self._requests += 1
+                self._last_used = time.monotonic()
+            started = time.perf_counter()
             try:
-                with open(hwid_file_path, "r", encoding="utf-8") as f_in:
-                    hwid = f_in.read().strip()
-                    if hwid and len(hwid) == 36:  # Valid UUID length
-                        logger.debug(f"Retrieved existing HWID from {hwid_file_path}")
-                        return hwid
-            except (IOError, OSError) as e:
-                logger.warning(f"Could not read existing HWID file: {e}")
+                return self.transport.post(api_url, body, timeout, endpoint)
+            finally:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        finally:
+            self.limiter.release(host_slot)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get connection statistics for the current process.
+        
+        A pool hit is a request served on an already open keep-alive
+        connection; a pool miss is a request that had to open a new one.
+        
+        Returns:
+            Dictionary with the transport name, request count and the
+            transport's pool hit/miss and rebuild counters
+        """
+        stats = {"transport": self.transport.name, "requests": self._requests}
+        stats.update(self.transport.stats())
+        return stats
+    
+    def warm_up(self, connections: Optional[int] = None, timeout: float = WARMUP_TIMEOUT) -> int:
+        """
+        Open keep-alive connections to KeyMaster ahead of the first call.
+        
+        Each connection is opened by a HEAD request to ``KEYMASTER_API_BASE``,
+        which pays for DNS, TCP connect and the TLS handshake. The requests
+        run concurrently and bypass the limiter and circuit breaker. The call
+        returns within ``timeout`` seconds even if KeyMaster is unreachable;
+        attempts still running then finish in the background.
+        
+        Args:
+            connections: Connections to open (defaults to KEYMASTER_WARMUP_CONNECTIONS,
+                capped by the pool size; one for a multiplexed transport)
+            timeout: Maximum seconds to wait
         
-        # Generate new HWID if not found or invalid
-        new_hwid = str(uuid.uuid4()).upper()
+        Returns:
+            Number of connections confirmed open
+        """
+        if connections is None:
+            connections = 1 if self.transport.multiplexed else min(WARMUP_CONNECTIONS, self.pool_maxsize)
+        url = KEYMASTER_API_BASE + "/"
+        opened = []
+        
+        def open_connection() -> None:
+            opened.append(self.transport.warm_up(url, timeout))
+        
+        deadline = time.monotonic() + timeout
+        threads = [threading.Thread(target=open_connection, name="keymaster-warmup", daemon=True)
+                   for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._last_used = time.monotonic()
+        return sum(1 for ok in list(opened) if ok)
+    
+    def start_keepalive(self, interval: float = KEEPALIVE_INTERVAL) -> bool:
+        """
+        Refresh the warm connections whenever the client has been idle for ``interval`` seconds.
         
-        # Try to save new HWID
+        Servers close idle keep-alive connections, so a worker that saw no
+        logins for a while would pay for a new handshake again. A daemon
+        thread re-runs ``warm_up`` after each idle interval. It stops on
+        ``close()`` and does not survive fork.
+        
+        Returns:
+            True if the thread was started (False if ``interval`` is 0 or it already runs)
+        """
+        if interval <= 0 or self._keepalive_stop is not None:
+            return False
+        stop = self._keepalive_stop = threading.Event()
+        client_ref = weakref.ref(self)
+        
+        def refresh() -> None:
+            while not stop.wait(interval):
+                client = client_ref()
+                if client is None:
+                    return
+                if time.monotonic() - client._last_used >= interval:
+                    client.warm_up()
+                del client
+        
+        threading.Thread(target=refresh, name="keymaster-keepalive", daemon=True).start()
+        return True
+    
+    def close(self) -> None:
+        """Close all pooled connections owned by this process and stop the keep-alive thread."""
+        if self._keepalive_stop is not None:
+            self._keepalive_stop.set()
+            self._keepalive_stop = None
+        self.transport.close()
+    
+    def _reset_after_fork(self) -> None:
+        """Drop inherited connection state in a forked child without closing parent sockets."""
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._keepalive_stop = None  # threads do not survive fork
+        self.transport._reset_after_fork()
+        self.limiter._reset()
+
+def _reset_clients_after_fork() -> None:
+    global _hedge_executor
+    for client in list(_live_clients):
+        client._reset_after_fork()
+    request_coalescer._reset()
+    circuit_breaker._reset()
+    shared_hedge_policy._reset()
+    # Executor threads do not survive fork
+    _hedge_executor = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="keymaster-hedge")
+    return _hedge_executor
+
+def _timed_post(client: KeyMasterClient, api_url: str, body: bytes, timeout: float,
+                queue_timeout: Optional[float] = None) -> Tuple[TransportResponse, float]:
+    started = time.perf_counter()
+    response = client.post(api_url, body, timeout=timeout, queue_timeout=queue_timeout)
+    return response, time.perf_counter() - started
+
+def _post_hedged(client: KeyMasterClient, api_url: str, body: bytes, timeout: float) -> TransportResponse:
+    """
+    Send one attempt, hedging it with a second request if it is slow.
+    
+    The original request runs on the hedge executor while the caller waits up
+    to the policy's delay. If it has not answered by then and the budget
+    allows, an identical request is sent if an upstream slot is free right
+    away; the first response wins. Requests cannot be interrupted mid-flight,
+    so the losing one is abandoned: it is cancelled if it has not started
+    yet, otherwise its response is discarded when it arrives (still bounded
+    by ``timeout``). Its latency still feeds the policy, so the window is not
+    biased towards fast responses. With the HTTP/2 transport the hedge is
+    another stream on the same connection, so it costs no extra handshake.
+    
+    Returns:
+        The winning response
+    
+    Raises:
+        TransportError, UpstreamBusyError: The original request's
+            error if no request produced a response
+    """
+    policy = client.hedge_policy
+    endpoint = endpoint_name(api_url)
+    executor = _get_hedge_executor()
+    started = time.perf_counter()
+    
+    def record_latency(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            policy.record_latency(endpoint, future.result()[1])
+    
+    policy.start_call()
+    primary = executor.submit(_timed_post, client, api_url, body, timeout)
+    primary.add_done_callback(record_latency)
+    done, _ = wait([primary], timeout=min(policy.delay(endpoint), timeout))
+    if done:
+        return primary.result()[0]
+    
+    if not policy.allow_hedge():
+        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="budget")
+        return primary.result()[0]
+    remaining = timeout - (time.perf_counter() - started)
+    hedge = executor.submit(_timed_post, client, api_url, body, remaining, 0)
+    hedge.add_done_callback(record_latency)
+    
+    winner = None
+    pending = {primary, hedge}
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in (primary, hedge):
+            if future in done and future.exception() is None:
+                winner = future
+                break
+    
+    if hedge.done() and isinstance(hedge.exception(), UpstreamBusyError):
+        # No free slot for the hedge: nothing was sent
+        policy.refund_hedge()
+        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="busy")
+        return primary.result()[0]
+    HEDGES_TOTAL.inc(endpoint=endpoint, outcome="sent")
+    if winner is None:
+        return primary.result()[0]  # raises the original request's error
+    
+    won_at = time.perf_counter() - started
+    if winner is hedge:
+        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="won")
+        policy.record_win()
+    else:
+        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="lost")
+    
+    def abandon(future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        if future is primary:
+            # The hedge answered first: the saved time is exact once the original arrives
+            saved = time.perf_counter() - started - won_at
+            HEDGE_SAVED_SECONDS.observe(saved, endpoint=endpoint)
+            policy.record_saved(saved)
+    
+    for future in pending:
+        if not future.cancel():
+            future.add_done_callback(abandon)
+    return winner.result()[0]
+
+# Process-wide memo of resolved HWIDs, keyed by (app_name, source)
+_hwid_cache: Dict[Any, str] = {}
+_hwid_lock = threading.Lock()
+
+_default_client: Optional[KeyMasterClient] = None
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> KeyMasterClient:
+    """
+    Get the process-wide KeyMaster client used by the module-level functions.
+    
+    Returns:
+        Shared KeyMasterClient instance
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = KeyMasterClient()
+    return _default_client
+
+# Shared cache of license authentication results (see keymaster_cache)
+license_cache = create_result_cache()
+
+def set_default_client(client: KeyMasterClient) -> None:
+    """
+    Replace the process-wide KeyMaster client (e.g. to change pool size).
+    
+    Args:
+        client: Client to use for subsequent module-level calls
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+def _hwid_data_dir(app_name: str) -> str:
+    """Per-user application data directory used to store hwid.dat."""
+    system = platform.system()
+    
+    # Determine base directory based on OS
+    if system == "Windows":
+        base_dir = os.getenv('APPDATA') or os.path.join(os.path.expanduser("~"), 'AppData', 'Roaming')
+    elif system == "Darwin":
+        base_dir = os.path.join(os.path.expanduser("~"), 'Library', 'Application Support')
+    else:  # Linux and other Unix-like systems
+        base_dir = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser("~"), '.config')
+    
+    # Create safe app name for directory
+    safe_app_name = "".join(c if c.isalnum() else "_" for c in app_name)
+    return os.path.join(base_dir, safe_app_name.lower())
+
+def _read_machine_identity() -> Optional[str]:
+    """
+    Read a stable machine identifier from the OS, if one is available.
+    
+    Returns:
+        machine-id / DMI product UUID on Linux, MachineGuid on Windows,
+        IOPlatformUUID on macOS, or None
+    """
+    system = platform.system()
+    if system == "Windows":
+        try:
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Cryptography") as key:
+                value, _ = winreg.QueryValueEx(key, "MachineGuid")
+                return str(value).strip() or None
+        except (ImportError, OSError):
+            return None
+    if system == "Darwin":
         try:
-            with open(hwid_file_path, "w", encoding="utf-8") as f_out:
-                f_out.write(new_hwid)
-            logger.info(f"Generated and saved new HWID to {hwid_file_path}")
-        except (IOError, OSError) as e:
-            logger.warning(f"Could not save HWID to file: {e}")
+            output = subprocess.run(
+                ["ioreg", "-rd1", "-c", "IOPlatformExpertDevice"],
+                capture_output=True, text=True, timeout=5
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            return None
+        for line in output.splitlines():
+            if "IOPlatformUUID" in line:
+                return line.split("=", 1)[-1].strip().strip('"') or None
+        return None
+    for path in _MACHINE_ID_PATHS:
+        try:
+            with open(path, "r", encoding="utf-8") as f_in:
+                value = f_in.read().strip()
+        except (IOError, OSError):
+            continue
+        if value:
+            return value
+    return None
+
+def _hardware_hwid(app_name: str) -> Optional[str]:
+    """
+    Derive an HWID from the machine identity.
+    
+    The raw identifier is never sent upstream: it is hashed together with the
+    app name, so different apps on the same machine get unrelated HWIDs.
+    """
+    identity = _read_machine_identity()
+    if not identity:
+        return None
+    return str(uuid.uuid5(_HWID_NAMESPACE, f"{app_name.lower()}:{identity.lower()}")).upper()
+
+@contextlib.contextmanager
+def _hwid_file_lock(lock_path: str):
+    """Exclusive cross-process lock on ``lock_path`` (no-op where unsupported)."""
+    with open(lock_path, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_hwid_file(hwid_file_path: str) -> Optional[str]:
+    try:
+        with open(hwid_file_path, "r", encoding="utf-8") as f_in:
+            hwid = f_in.read().strip()
+    except FileNotFoundError:
+        return None
+    except (IOError, OSError) as e:
+        logger.warning("Could not read existing HWID file: %s", e)
+        return None
+    if hwid and len(hwid) == 36:  # Valid UUID length
+        return hwid
+    return None
+
+def _write_hwid_file(hwid_file_path: str, hwid: str) -> None:
+    """Atomically replace hwid.dat so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".hwid-", dir=os.path.dirname(hwid_file_path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f_out:
+            f_out.write(hwid)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(tmp_path, hwid_file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _resolve_hwid(app_name: str, source: str) -> str:
+    try:
+        app_data_dir = _hwid_data_dir(app_name)
+        hwid_file_path = os.path.join(app_data_dir, "hwid.dat")
         
-        return new_hwid
+        # Try to create directory if it doesn't exist
+        os.makedirs(app_data_dir, exist_ok=True)
         
+        # Lock-free read for the common case where the file already exists
+        hwid = _read_hwid_file(hwid_file_path)
+        if hwid:
+            logger.debug("Retrieved existing HWID from %s", hwid_file_path)
+            return hwid
+        
+        # Serialize creation across processes; re-check in case another worker won the race
+        with _hwid_file_lock(hwid_file_path + ".lock"):
+            hwid = _read_hwid_file(hwid_file_path)
+            if hwid:
+                logger.debug("Retrieved HWID created by another process from %s", hwid_file_path)
+                return hwid
+            
+            # Generate new HWID if not found or invalid
+            new_hwid = (_hardware_hwid(app_name) if source == "hardware" else None) or str(uuid.uuid4()).upper()
+            
+            # Try to save new HWID
+            try:
+                _write_hwid_file(hwid_file_path, new_hwid)
+                logger.info("Generated and saved new HWID to %s", hwid_file_path)
+            except (IOError, OSError) as e:
+                logger.warning("Could not save HWID to file: %s", e)
+            
+            return new_hwid
+    
     except Exception as e:
-        logger.error(f"Error generating HWID: {e}")
-        # Fallback: generate UUID based on system info
-        system_info = f"{platform.system()}-{platform.node()}-{os.getlogin() if hasattr(os, 'getlogin') else 'unknown'}"
-        fallback_hwid = str(uuid.uuid5(uuid.NAMESPACE_DNS, system_info)).upper()
-        logger.warning(f"Using fallback HWID generation: {fallback_hwid}")
+        logger.error("Error generating HWID: %s", e)
+        fallback_hwid = _hardware_hwid(app_name)
+        if fallback_hwid is None:
+            # Fallback: generate UUID based on system info
+            try:
+                login = os.getlogin()
+            except (AttributeError, OSError):
+                login = os.getenv("USER") or os.getenv("USERNAME") or "unknown"
+            system_info = f"{platform.system()}-{platform.node()}-{login}"
+            fallback_hwid = str(uuid.uuid5(uuid.NAMESPACE_DNS, system_info)).upper()
+        logger.warning("Using fallback HWID generation: %s", fallback_hwid)
         return fallback_hwid
 
-def authenticate_license_key(master_user_id: str, license_key: str, hwid: str, 
-                           app_version: str, username: Optional[str] = None) -> Dict[str, Any]:
+def get_persistent_hwid(app_name: str = "StreamerPanel", source: Optional[str] = None) -> str:
     """
-    Authenticate a license key using KeyMaster API.
+    Generate and persist a unique HWID based on UUID and store it across sessions.
+    
+    The HWID is resolved once per process and then served from memory. The
+    first resolution reads ``hwid.dat``; if it is missing, creation is guarded
+    by a file lock and written via temp file + rename, so concurrent workers
+    agree on a single value.
     
     Args:
-        master_user_id: Master user ID from KeyMaster
-        license_key: License key to authenticate
-        hwid: Hardware ID
-        app_version: Application version
-        username: Optional username
-        
+        app_name: Name of the application for storage directory
+        source: "file" for a random UUID, or "hardware" to derive new HWIDs from
+            the machine identity so they survive a wiped config directory
+            (default: KEYMASTER_HWID_SOURCE)
+    
     Returns:
-        Dictionary containing authentication result
-        
+        Persistent hardware ID string
+    """
+    source = (source or HWID_SOURCE).lower()
+    cache_key = (app_name, source)
+    hwid = _hwid_cache.get(cache_key)
+    if hwid is not None:
+        return hwid
+    
+    with _hwid_lock:
+        hwid = _hwid_cache.get(cache_key)
+        if hwid is None:
+            hwid = _resolve_hwid(app_name, source)
+            _hwid_cache[cache_key] = hwid
+    return hwid
+
+def _reset_hwid_lock_after_fork() -> None:
+    # The memoized HWIDs stay valid in the child; only the lock may be stuck
+    global _hwid_lock
+    _hwid_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_hwid_lock_after_fork)
+
+def build_license_payload(master_user_id: str, license_key: str, hwid: str,
+                          app_version: str, username: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Validate and build the request payload for license key authentication.
+    
+    Returns:
+        Request payload dictionary
+    
     Raises:
-        AuthenticationError: If authentication fails
-        NetworkError: If network request fails
+        AuthenticationError: If required parameters are missing
     """
     if not all([master_user_id, license_key, hwid, app_version]):
         raise AuthenticationError("Missing required parameters for license authentication")
@@ -124,26 +1233,18 @@ def authenticate_license_key(master_user_id: str, license_key: str, hwid: str,
     if username:
         payload["username"] = username.strip()
     
-    logger.info(f"Authenticating license key: {license_key[:8]}...")
-    return _send_request(LICENSE_AUTH_API_URL, payload)
+    return payload
 
-def authenticate_client_user(master_user_id: str, username: str, 
-                           password_plain_text: str, app_version: str) -> Dict[str, Any]:
+def build_user_payload(master_user_id: str, username: str,
+                       password_plain_text: str, app_version: str) -> Dict[str, Any]:
     """
-    Authenticate a client user (username/password) using KeyMaster API.
+    Validate and build the request payload for client user authentication.
     
-    Args:
-        master_user_id: Master user ID from KeyMaster
-        username: Username to authenticate
-        password_plain_text: Plain text password
-        app_version: Application version
-        
     Returns:
-        Dictionary containing authentication result
-        
+        Request payload dictionary
+    
     Raises:
-        AuthenticationError: If authentication fails
-        NetworkError: If network request fails
+        AuthenticationError: If required parameters are missing or too long
     """
     if not all([master_user_id, username, password_plain_text, app_version]):
         raise AuthenticationError("Missing required parameters for user authentication")
@@ -155,91 +1256,352 @@ def authenticate_client_user(master_user_id: str, username: str,
     if len(password_plain_text) > 100:
         raise AuthenticationError("Password too long")
     
-    payload = {
+    return {
         "masterUserId": master_user_id.strip(),
         "username": username.strip(),
         "passwordPlainText": password_plain_text,
         "appVersion": app_version.strip()
     }
+
+def _body_preview(body: Union[bytes, str], limit: int = 200) -> str:
+    """Decode the start of a response body for log messages (error paths only)."""
+    if isinstance(body, bytes):
+        body = body[:limit * 4].decode("utf-8", errors="replace")
+    return body[:limit]
+
+def parse_response(status_code: int, body: Union[bytes, str]) -> AuthResult:
+    """
+    Turn a KeyMaster HTTP response into an AuthResult.
+    
+    The raw body is parsed once by the configured codec (see keymaster_codec);
+    it is only decoded to text for logging when it is not valid JSON.
+    
+    Args:
+        status_code: HTTP status code
+        body: Response body (``response.content``; text is accepted too)
+    
+    Returns:
+        AuthResult; HTTP errors become ``success: False`` results
+    
+    Raises:
+        NetworkError: If a successful response body is not valid JSON
+    """
+    # Check if response is JSON
+    try:
+        result = loads(body)
+    except ValueError:
+        if status_code >= 400:
+            # Error pages from proxies/load balancers are often HTML
+            result = {}
+        else:
+            logger.error("Invalid JSON response from API: %s", _body_preview(body))
+            raise NetworkError("Invalid response format from authentication server")
+    
+    if not isinstance(result, dict):
+        logger.error("Unexpected JSON response from API: %s", _body_preview(body))
+        raise NetworkError("Invalid response format from authentication server")
+    
+    # Check for HTTP errors
+    if status_code >= 400:
+        error_msg = result.get('message', f'HTTP {status_code} error')
+        logger.warning("API returned error: %s", error_msg)
+        return AuthResult(False, error_msg, result.get('errorCode') or f"HTTP_{status_code}")
+    
+    return AuthResult.from_dict(result)
+
+def authenticate_license_key(master_user_id: str, license_key: str, hwid: str, 
+                           app_version: str, username: Optional[str] = None,
+                           client: Optional[KeyMasterClient] = None,
+                           use_cache: bool = True,
+                           timeout: Optional[float] = None,
+                           hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Authenticate a license key using KeyMaster API.
+    
+    Successful results and definitive rejections are served from
+    ``license_cache`` while they are fresh; transient errors are never cached.
+    
+    Args:
+        master_user_id: Master user ID from KeyMaster
+        license_key: License key to authenticate
+        hwid: Hardware ID
+        app_version: Application version
+        username: Optional username
+        client: Client to send the request with (defaults to the shared pooled client)
+        use_cache: Serve and store the result in ``license_cache``
+        timeout: Total time budget in seconds across all attempts
+            (defaults to ``REQUEST_TIMEOUT`` per attempt)
+        hedge: Hedge slow attempts (see HedgePolicy); defaults to ``client.hedging``
+    
+    Returns:
+        AuthResult (also usable as a dictionary) containing the authentication result
+    
+    Raises:
+        AuthenticationError: If authentication fails
+        NetworkError: If network request fails
+    """
+    payload = build_license_payload(master_user_id, license_key, hwid, app_version, username)
+    
+    cache_key = None
+    if use_cache and license_cache.enabled:
+        cache_key = make_license_cache_key(master_user_id, license_key, hwid, app_version, username)
+        cached = license_cache.get(cache_key)
+        CACHE_LOOKUPS_TOTAL.inc(cache="license", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.debug("License key %s... served from cache", license_key[:8])
+            return cached
+    
+    logger.info("Authenticating license key: %s...", license_key[:8], extra=SAMPLED)
+    result = _send_request(LICENSE_AUTH_API_URL, payload, client, timeout, hedge)
+    
+    if cache_key is not None:
+        license_cache.put(cache_key, result)
+    return result
+
+def authenticate_client_user(master_user_id: str, username: str, 
+                           password_plain_text: str, app_version: str,
+                           client: Optional[KeyMasterClient] = None,
+                           timeout: Optional[float] = None,
+                           hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Authenticate a client user (username/password) using KeyMaster API.
+    
+    Args:
+        master_user_id: Master user ID from KeyMaster
+        username: Username to authenticate
+        password_plain_text: Plain text password
+        app_version: Application version
+        client: Client to send the request with (defaults to the shared pooled client)
+        timeout: Total time budget in seconds across all attempts
+            (defaults to ``REQUEST_TIMEOUT`` per attempt)
+        hedge: Hedge slow attempts (see HedgePolicy); defaults to ``client.hedging``
+    
+    Returns:
+        AuthResult (also usable as a dictionary) containing the authentication result
+    
+    Raises:
+        AuthenticationError: If authentication fails
+        NetworkError: If network request fails
+    """
+    payload = build_user_payload(master_user_id, username, password_plain_text, app_version)
     
-    logger.info(f"Authenticating user: {username}")
-    return _send_request(CLIENT_USER_AUTH_API_URL, payload)
+    logger.info("Authenticating user: %s", username, extra=SAMPLED)
+    return _send_request(CLIENT_USER_AUTH_API_URL, payload, client, timeout, hedge)
 
-def _send_request(api_url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+def _send_request(api_url: str, payload: Dict[str, Any],
+                  client: Optional[KeyMasterClient] = None,
+                  timeout: Optional[float] = None,
+                  hedge: Optional[bool] = None) -> AuthResult:
     """
     Internal helper to send POST request with proper headers and retry logic.
     
+    Concurrent identical requests (same client, endpoint and payload) are
+    coalesced through ``request_coalescer`` into a single upstream call.
+    
     Args:
         api_url: API endpoint URL
         payload: Request payload
-        
+        client: Client whose transport is used (defaults to the shared client)
+        timeout: Total time budget in seconds; attempts and backoff are cut
+            short so the call never runs past it
+        hedge: Hedge slow attempts; defaults to ``client.hedging``
+    
     Returns:
-        Response dictionary
+        AuthResult
+    
+    Raises:
+        NetworkError: If all retry attempts fail or the time budget runs out
+    """
+    with span("encode_json"):
+        body = dumps(payload)
+    client = client or get_default_client()
+    key = SingleFlight.make_key(api_url, body, client)
+    endpoint = endpoint_name(api_url)
+    started = time.perf_counter()
+    try:
+        with span("upstream"):
+            result = request_coalescer.do(key, lambda: _send_once(api_url, body, client, timeout, hedge), timeout)
+    except Exception as e:
+        ERRORS_TOTAL.inc(endpoint=endpoint, code=type(e).__name__)
+        CALL_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, outcome="error")
+        raise
+    record_result_metrics(endpoint, result, time.perf_counter() - started)
+    return result
+
+def record_result_metrics(endpoint: str, result: AuthResult, elapsed: float) -> None:
+    """Record the outcome of a completed KeyMaster call."""
+    success = result.get("success") is True
+    RESULTS_TOTAL.inc(endpoint=endpoint, success="true" if success else "false")
+    if not success and result.get("errorCode"):
+        ERRORS_TOTAL.inc(endpoint=endpoint, code=str(result.get("errorCode")))
+    CALL_SECONDS.observe(elapsed, endpoint=endpoint, outcome="success" if success else "rejected")
+
+class UpstreamCall:
+    """
+    Retry, circuit-breaker and response handling for one KeyMaster call.
+    
+    Shared by the sync (``_send_once``) and async
+    (``keymaster_async._send_once``) clients, which only differ in how an
+    attempt is sent and how they wait between attempts:
         
+        call = UpstreamCall(api_url, client.retry_policy, client.breaker, timeout)
+        for attempt_timeout in call.attempts():
+            try:
+                response = client.post(api_url, body, timeout=attempt_timeout)
+            except Exception as e:
+                delay = call.failed(e)
+            else:
+                result, delay = call.answered(response)
+                if result is not None:
+                    return result
+            time.sleep(delay)
+    
+    Args:
+        api_url: API endpoint URL
+        policy: Retry policy
+        breaker: Circuit breaker consulted before every attempt
+        timeout: Total time budget in seconds (defaults to the policy's)
+    """
+    
+    def __init__(self, api_url: str, policy: RetryPolicy, breaker: CircuitBreaker,
+                 timeout: Optional[float] = None):
+        self.api_url = api_url
+        self.endpoint = endpoint_name(api_url)
+        self.policy = policy
+        self.breaker = breaker
+        self.deadline = policy.start(timeout)
+        self.attempt = 0
+    
+    def attempts(self):
+        """
+        Yield the timeout of each attempt, checking the circuit breaker before each one.
+        
+        Raises:
+            CircuitOpenError: If the circuit breaker is open
+            NetworkError: If the time budget runs out
+        """
+        policy = self.policy
+        for attempt in range(policy.max_attempts):
+            attempt_timeout = policy.attempt_timeout(self.deadline)
+            if attempt_timeout <= 0:
+                raise NetworkError("Authentication server timeout")
+            self.breaker.before_call()
+            self.attempt = attempt
+            logger.debug("Sending request to %s (attempt %d/%d)", self.api_url, attempt + 1, policy.max_attempts)
+            yield attempt_timeout
+        raise NetworkError("All retry attempts failed")
+    
+    def abandon(self) -> None:
+        """Give back the circuit breaker slot of an attempt that was cancelled."""
+        self.breaker.release()
+    
+    def failed(self, error: Exception) -> float:
+        """
+        Handle an attempt that raised instead of returning a response.
+        
+        Returns:
+            Seconds to wait before the next attempt
+        
+        Raises:
+            UpstreamBusyError: Re-raised as is, without retrying
+            NetworkError: If the error may not (or can no longer) be retried
+        """
+        policy = self.policy
+        if isinstance(error, UpstreamBusyError):
+            # Backpressure: fail fast instead of queueing more retries
+            self.breaker.release()
+            raise error
+        if isinstance(error, TransportTimeout):
+            self.breaker.record_failure()
+            logger.warning("Request timeout (attempt %d/%d)", self.attempt + 1, policy.max_attempts)
+            failure = NetworkError("Authentication server timeout")
+            # A connect timeout never reached the server, so it is always safe to retry
+            retryable = policy.retry_on_timeout or isinstance(error, TransportConnectTimeout)
+            reason = "timeout"
+        elif isinstance(error, TransportConnectionError):
+            self.breaker.record_failure()
+            logger.warning("Connection error (attempt %d/%d)", self.attempt + 1, policy.max_attempts)
+            failure = NetworkError("Cannot connect to authentication server")
+            retryable = True
+            reason = "connection"
+        elif isinstance(error, TransportError):
+            self.breaker.record_failure()
+            logger.error("Request failed: %s", error)
+            raise NetworkError(f"Request failed: {error}")
+        else:
+            self.breaker.release()
+            logger.error("Unexpected error during request: %s", error)
+            raise NetworkError(f"Unexpected error: {error}")
+        
+        if not retryable or self.attempt == policy.max_attempts - 1:
+            raise failure
+        # Wait before retry, but never past the deadline
+        delay = policy.backoff(self.attempt)
+        if not policy.can_wait(delay, self.deadline):
+            raise failure
+        RETRIES_TOTAL.inc(endpoint=self.endpoint, reason=reason)
+        return delay
+    
+    def answered(self, response) -> Tuple[Optional[AuthResult], float]:
+        """
+        Handle an HTTP response.
+        
+        Args:
+            response: Response with ``status_code``, ``content`` and ``headers``
+        
+        Returns:
+            (result, 0) when the call is done, or (None, seconds to wait) to
+            retry a transient status
+        """
+        policy = self.policy
+        status_code = response.status_code
+        if status_code >= 500 or status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        
+        if policy.is_retryable_status(status_code) and self.attempt < policy.max_attempts - 1:
+            logger.warning("Transient HTTP %s (attempt %d/%d)", status_code, self.attempt + 1, policy.max_attempts)
+            delay = policy.backoff(self.attempt, retry_after_seconds(response.headers.get("Retry-After")))
+            if policy.can_wait(delay, self.deadline):
+                RETRIES_TOTAL.inc(endpoint=self.endpoint, reason=f"http_{status_code}")
+                return None, delay
+        with span("decode_json"):
+            return parse_response(status_code, response.content), 0.0
+
+def _send_once(api_url: str, body: bytes, client: Optional[KeyMasterClient],
+               timeout: Optional[float], hedge: Optional[bool] = None) -> AuthResult:
+    """
+    Perform one upstream request for _send_request, retrying per the client's RetryPolicy.
+    
     Raises:
-        NetworkError: If all retry attempts fail
+        CircuitOpenError: If the circuit breaker is open
+        UpstreamBusyError: If no upstream slot is free
+        NetworkError: If the request fails and may not (or can no longer) be retried
     """
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "KeyMaster-Client/1.0",
-        "Accept": "application/json"
-    }
+    client = client or get_default_client()
+    hedge = client.hedging if hedge is None else hedge
+    call = UpstreamCall(api_url, client.retry_policy, client.breaker, timeout)
     
-    for attempt in range(MAX_RETRIES):
+    for attempt_timeout in call.attempts():
         try:
-            logger.debug(f"Sending request to {api_url} (attempt {attempt + 1}/{MAX_RETRIES})")
-            
-            response = requests.post(
-                api_url, 
-                data=json.dumps(payload), 
-                headers=headers, 
-                timeout=REQUEST_TIMEOUT,
-                verify=True  # Verify SSL certificates
-            )
+            with span("post_hedged" if hedge else "post"):
+                if hedge:
+                    response = _post_hedged(client, api_url, body, attempt_timeout)
+                else:
+                    response = client.post(api_url, body, timeout=attempt_timeout)
             
             # Log response status
-            logger.debug(f"Response status: {response.status_code}")
-            
-            # Check if response is JSON
-            try:
-                result = response.json()
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON response from API: {response.text}")
-                raise NetworkError("Invalid response format from authentication server")
-            
-            # Check for HTTP errors
-            if response.status_code >= 400:
-                error_msg = result.get('message', f'HTTP {response.status_code} error')
-                logger.warning(f"API returned error: {error_msg}")
-                return {"success": False, "message": error_msg}
-            
-            return result
-            
-        except requests.exceptions.Timeout:
-            logger.warning(f"Request timeout (attempt {attempt + 1}/{MAX_RETRIES})")
-            if attempt == MAX_RETRIES - 1:
-                raise NetworkError("Authentication server timeout")
-                
-        except requests.exceptions.ConnectionError:
-            logger.warning(f"Connection error (attempt {attempt + 1}/{MAX_RETRIES})")
-            if attempt == MAX_RETRIES - 1:
-                raise NetworkError("Cannot connect to authentication server")
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                raise NetworkError(f"Request failed: {str(e)}")
-                
+            logger.debug("Response status: %s", response.status_code)
         except Exception as e:
-            logger.error(f"Unexpected error during request: {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                raise NetworkError(f"Unexpected error: {str(e)}")
+            delay = call.failed(e)
+        else:
+            result, delay = call.answered(response)
+            if result is not None:
+                return result
         
-        # Wait before retry
-        if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAY * (attempt + 1))  # Exponential backoff
-    
-    raise NetworkError("All retry attempts failed")
+        with span("backoff"):
+            time.sleep(delay)
 
 def get_system_info() -> Dict[str, str]:
     """
@@ -0,0 +1,254 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional, Any, Iterable, Iterator, List, Tuple, Union
+
+from keymaster_auth import (
+    KeyMasterClient,
+    UpstreamLimiter,
+    AuthenticationError,
+    NetworkError,
+    authenticate_license_key,
+)
+from keymaster_cache import make_license_cache_key
+from keymaster_codec import dumps
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Batch defaults
+BATCH_MAX_CONCURRENCY = 16
+BATCH_ITEM_TIMEOUT = 15  # seconds per license, including retries
+
+RECORD_FIELDS = ("license_key", "hwid", "app_version", "username")
+
+Record = Union[Dict[str, Any], Tuple[Any, ...], List[Any]]
+
+def _normalize_record(record: Record, default_app_version: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    Turn a (license_key, hwid, app_version, username) tuple or a mapping into a dict.
+    
+    Mappings may use either snake_case or the KeyMaster camelCase field names.
+    """
+    if isinstance(record, dict):
+        normalized = {
+            "license_key": record.get("license_key") or record.get("licenseKey"),
+            "hwid": record.get("hwid"),
+            "app_version": record.get("app_version") or record.get("appVersion"),
+            "username": record.get("username"),
+        }
+    else:
+        values = list(record) + [None] * (len(RECORD_FIELDS) - len(record))
+        normalized = dict(zip(RECORD_FIELDS, values))
+    
+    for field, value in normalized.items():
+        normalized[field] = str(value).strip() if value not in (None, "") else None
+    
+    if not normalized["app_version"]:
+        normalized["app_version"] = default_app_version
+    return normalized
+
+def _validate_one(master_user_id: str, record: Dict[str, Optional[str]], client: KeyMasterClient,
+                  item_timeout: float, use_cache: bool) -> Dict[str, Any]:
+    """Validate a single license and capture the outcome instead of raising."""
+    started = time.monotonic()
+    outcome: Dict[str, Any] = {"result": None, "error": None, "error_type": None}
+    try:
+        outcome["result"] = authenticate_license_key(
+            master_user_id,
+            record["license_key"] or "",
+            record["hwid"] or "",
+            record["app_version"] or "",
+            record["username"],
+            client=client,
+            use_cache=use_cache,
+            timeout=item_timeout
+        )
+    except (AuthenticationError, NetworkError) as e:
+        outcome["error"] = str(e)
+        outcome["error_type"] = type(e).__name__
+    except Exception as e:
+        logger.error("Unexpected error validating license: %s", e)
+        outcome["error"] = str(e)
+        outcome["error_type"] = type(e).__name__
+    outcome["elapsed_ms"] = round((time.monotonic() - started) * 1000, 2)
+    return outcome
+
+def _result_row(index: int, record: Dict[str, Optional[str]], outcome: Dict[str, Any],
+                deduplicated: bool) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"index": index}
+    row.update(record)
+    row.update(outcome)
+    row["deduplicated"] = deduplicated
+    return row
+
+def validate_licenses(records: Iterable[Record], master_user_id: str,
+                      max_concurrency: int = BATCH_MAX_CONCURRENCY,
+                      item_timeout: float = BATCH_ITEM_TIMEOUT,
+                      default_app_version: Optional[str] = None,
+                      client: Optional[KeyMasterClient] = None,
+                      use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Validate many license keys with bounded parallelism, streaming results as they complete.
+    
+    Records are read lazily, so arbitrarily large inputs use constant memory
+    apart from the dedupe table. Identical requests are sent once; every input
+    record still gets its own result row (``deduplicated`` is True for the
+    copies). A failing record never stops the batch: its row carries
+    ``error``/``error_type`` instead of ``result``.
+    
+    Args:
+        records: Iterable of (license_key, hwid, app_version, username) tuples or dicts
+        master_user_id: Master user ID from KeyMaster
+        max_concurrency: Maximum number of requests in flight
+        item_timeout: Time budget per license in seconds, including retries
+        default_app_version: App version for records that do not specify one
+        client: Client to use (defaults to a dedicated client sized to max_concurrency)
+        use_cache: Serve and store results in ``keymaster_auth.license_cache``
+    
+    Yields:
+        Result rows with index, record fields, result, error, error_type,
+        elapsed_ms and deduplicated
+    """
+    own_client = client is None
+    if own_client:
+        client = KeyMasterClient(
+            pool_maxsize=max_concurrency,
+            limiter=UpstreamLimiter(max_in_flight=max_concurrency, queue_timeout=item_timeout)
+        )
+    
+    # key -> finished outcome, or list of (index, record) waiting on the in-flight request
+    completed: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    waiting: Dict[Tuple[str, ...], List[Tuple[int, Dict[str, Optional[str]]]]] = {}
+    pending = {}
+    source = enumerate(records)
+    exhausted = False
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="keymaster-batch") as executor:
+            while True:
+                # Keep a bounded window of requests in flight
+                while not exhausted and len(pending) < max_concurrency * 2:
+                    try:
+                        index, raw = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    
+                    record = _normalize_record(raw, default_app_version)
+                    key = make_license_cache_key(
+                        master_user_id,
+                        record["license_key"] or "",
+                        record["hwid"] or "",
+                        record["app_version"] or "",
+                        record["username"]
+                    )
+                    if key in completed:
+                        yield _result_row(index, record, completed[key], True)
+                    elif key in waiting:
+                        waiting[key].append((index, record))
+                    else:
+                        waiting[key] = [(index, record)]
+                        future = executor.submit(_validate_one, master_user_id, record, client,
+                                                 item_timeout, use_cache)
+                        pending[future] = key
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    outcome = future.result()
+                    completed[key] = outcome
+                    for position, (index, record) in enumerate(waiting.pop(key)):
+                        yield _result_row(index, record, outcome, position > 0)
+    finally:
+        if own_client:
+            client.close()
+
+def _read_records(stream, input_format: str) -> Iterator[Dict[str, Any]]:
+    if input_format == "csv":
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping invalid JSON on line %s", line_number)
+                continue
+            # Records are objects or [license_key, hwid, app_version, username] arrays
+            if not isinstance(record, (dict, list)):
+                logger.warning("Skipping line %s: expected a JSON object or array, got %s",
+                               line_number, type(record).__name__)
+                continue
+            yield record
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: read records from CSV/JSONL and write JSONL results.
+    
+    Returns:
+        Process exit code (0 if every record validated, 1 if any failed, 2 on usage errors)
+    """
+    parser = argparse.ArgumentParser(description="Validate KeyMaster license keys in bulk.")
+    parser.add_argument("input", help="CSV or JSONL file with license_key, hwid, app_version, username ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from file extension)")
+    parser.add_argument("--master-uid", default=os.environ.get("KEYMASTER_ACCOUNT_UID"),
+                        help="KeyMaster account UID (default: $KEYMASTER_ACCOUNT_UID)")
+    parser.add_argument("--app-version", default=os.environ.get("APP_VERSION"),
+                        help="App version for records without one (default: $APP_VERSION)")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_MAX_CONCURRENCY, help="Maximum requests in flight")
+    parser.add_argument("-t", "--timeout", type=float, default=BATCH_ITEM_TIMEOUT, help="Time budget per license in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="Always ask KeyMaster, ignoring cached results")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    if not args.master_uid:
+        parser.error("--master-uid or KEYMASTER_ACCOUNT_UID is required")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    in_stream = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8", newline="")
+    out_stream = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    
+    total = failed = 0
+    started = time.monotonic()
+    try:
+        results = validate_licenses(
+            _read_records(in_stream, input_format),
+            args.master_uid,
+            max_concurrency=args.concurrency,
+            item_timeout=args.timeout,
+            default_app_version=args.app_version,
+            use_cache=not args.no_cache
+        )
+        for row in results:
+            total += 1
+            if row["error"] or not (row["result"] or {}).get("success"):
+                failed += 1
+            out_stream.write(dumps(row).decode("utf-8") + "\n")
+            out_stream.flush()
+    finally:
+        if in_stream is not sys.stdin:
+            in_stream.close()
+        if out_stream is not sys.stdout:
+            out_stream.close()
+    
+    logger.info("Validated %s licenses in %.1fs (%s failed or rejected)", total, time.monotonic() - started, failed)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,561 @@
+import os
+import json
+import time
+import hmac
+import stat
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Optional, Any, Tuple, Union
+
+from keymaster_codec import dumps
+from keymaster_result import AuthResult
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cache settings
+CACHE_MAXSIZE = int(os.environ.get("KEYMASTER_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.environ.get("KEYMASTER_CACHE_TTL", "300"))  # seconds, 0 disables caching
+CACHE_NEGATIVE_TTL = float(os.environ.get("KEYMASTER_CACHE_NEGATIVE_TTL", "30"))  # seconds
+
+# Backend: "memory" (per process) or "sqlite" (shared by all workers on the host, survives restarts)
+CACHE_BACKEND = os.environ.get("KEYMASTER_CACHE_BACKEND", "memory").lower()
+_CACHE_HOME = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+CACHE_PATH = os.environ.get("KEYMASTER_CACHE_PATH", os.path.join(_CACHE_HOME, "keymaster", "auth_cache.db"))
+# HMAC key for the shared cache rows (default: random key kept next to the database in <path>.key)
+CACHE_SECRET = os.environ.get("KEYMASTER_CACHE_SECRET")
+
+# Error codes that describe a transient failure rather than a definitive answer
+TRANSIENT_ERROR_CODES = frozenset({
+    "TIMEOUT_ERROR",
+    "JSON_DECODE_ERROR",
+    "CLIENT_REQUEST_EXCEPTION",
+    "NETWORK_ERROR",
+    "SERVER_ERROR",
+    "RATE_LIMITED",
+    "HTTP_408",
+    "HTTP_429",
+})
+
+CacheKey = Tuple[str, str, str, str, str]
+
+class InsecureCacheFileError(OSError):
+    """Raised when a shared cache file could be read or replaced by another user"""
+    pass
+
+def _check_owner(path: str, st: os.stat_result) -> None:
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise InsecureCacheFileError(f"{path} is owned by another user")
+
+def _prepare_private_dir(directory: str) -> None:
+    """Create ``directory`` with mode 0700 and refuse one that others could write to."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not st.st_mode & stat.S_ISVTX:
+        raise InsecureCacheFileError(f"{directory} is writable by other users")
+
+def _open_private_file(path: str, flags: int = os.O_RDWR | os.O_CREAT) -> int:
+    """
+    Open (or create) ``path`` with mode 0600 and return the file descriptor.
+    
+    Raises:
+        InsecureCacheFileError: If the file belongs to another user
+    """
+    fd = os.open(path, flags | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        st = os.fstat(fd)
+        _check_owner(path, st)
+        if stat.S_IMODE(st.st_mode) & 0o077 and hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o600)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+def _load_secret(path: str) -> bytes:
+    """Read the HMAC key at ``path``, creating a random one atomically on first use."""
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(prefix=".cache-key-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f_out:
+                f_out.write(os.urandom(32))
+            try:
+                os.link(tmp_path, path)  # never replaces a key another worker created first
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(tmp_path)
+    with os.fdopen(_open_private_file(path, os.O_RDONLY), "rb") as f_in:
+        secret = f_in.read()
+    if len(secret) < 32:
+        raise InsecureCacheFileError(f"{path} does not hold a valid cache key")
+    return secret
+
+def make_license_cache_key(master_user_id: str, license_key: str, hwid: str,
+                           app_version: str, username: Optional[str] = None) -> CacheKey:
+    """
+    Build the cache key for a license authentication request.
+    
+    Values are normalized the same way the request payload is, so equivalent
+    requests map to the same entry.
+    
+    Returns:
+        Tuple of (masterUserId, licenseKey, hwid, appVersion, username)
+    """
+    return (
+        master_user_id.strip(),
+        license_key.upper().strip(),
+        hwid.strip(),
+        app_version.strip(),
+        (username or "").strip()
+    )
+
+def is_cacheable_rejection(result: Mapping) -> bool:
+    """
+    Check whether a failed result is a definitive rejection that may be cached.
+    
+    Only rejections that carry an error code from the server qualify;
+    transient codes (timeouts, 5xx, rate limits) never do.
+    """
+    error_code = result.get("errorCode")
+    if not error_code:
+        return False
+    error_code = str(error_code)
+    return error_code not in TRANSIENT_ERROR_CODES and not error_code.startswith("HTTP_5")
+
+def cacheable_ttl(result: Any, ttl: float, negative_ttl: float) -> float:
+    """
+    Decide how long a result may be cached.
+    
+    Returns:
+        ``ttl`` for successes, ``negative_ttl`` for definitive rejections,
+        0 for anything that must not be cached
+    """
+    if not isinstance(result, Mapping):
+        return 0
+    if result.get("success") is True:
+        return ttl
+    if result.get("success") is False and is_cacheable_rejection(result):
+        return negative_ttl
+    return 0
+
+class AuthResultCache:
+    """
+    Thread-safe in-process TTL + LRU cache for authentication results.
+    
+    Successful results are kept for ``ttl`` seconds, definitive rejections for
+    ``negative_ttl`` seconds. Anything else (transient errors, malformed
+    results) is never stored. The least recently used entry is evicted once
+    ``maxsize`` entries are held.
+    
+    Args:
+        maxsize: Maximum number of entries
+        ttl: Lifetime of successful results in seconds (0 disables caching)
+        negative_ttl: Lifetime of definitive rejections in seconds (0 disables)
+    """
+    
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL,
+                 negative_ttl: float = CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, AuthResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and (self.ttl > 0 or self.negative_ttl > 0)
+    
+    def get(self, key: CacheKey) -> Optional[AuthResult]:
+        """
+        Look up a cached result.
+        
+        Args:
+            key: Cache key from make_license_cache_key
+        
+        Returns:
+            Copy of the cached result, or None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, result = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        return result.copy()
+    
+    def put(self, key: CacheKey, result: Mapping) -> bool:
+        """
+        Store a result if it is cacheable.
+        
+        Args:
+            key: Cache key from make_license_cache_key
+            result: AuthResult (or result dictionary)
+        
+        Returns:
+            True if the result was stored
+        """
+        if self.maxsize <= 0:
+            return False
+        
+        ttl = cacheable_ttl(result, self.ttl, self.negative_ttl)
+        if ttl <= 0:
+            return False
+        
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, AuthResult.from_dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return True
+    
+    def invalidate(self, key: CacheKey) -> bool:
+        """
+        Remove a single entry.
+        
+        Returns:
+            True if an entry was removed
+        """
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+    
+    def invalidate_license_key(self, license_key: str) -> int:
+        """
+        Remove every entry for a license key (e.g. after it was revoked).
+        
+        Returns:
+            Number of entries removed
+        """
+        normalized = license_key.upper().strip()
+        with self._lock:
+            stale = [key for key in self._entries if key[1] == normalized]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with hit/miss/eviction counters, hit ratio and size
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_ratio": (self._hits / lookups) if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize
+            }
+    
+    def reset_stats(self) -> None:
+        """Reset hit/miss/eviction counters."""
+        with self._lock:
+            self._hits = self._misses = self._evictions = self._expirations = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteAuthResultCache:
+    """
+    Authentication result cache shared by every worker process on a host.
+    
+    Drop-in replacement for AuthResultCache (same methods and stats keys)
+    backed by a SQLite file in WAL mode, so all gunicorn workers see each
+    other's results and entries survive worker recycling and restarts.
+    Lookups are a single indexed read; expired rows are ignored on read and
+    removed on write. When more than ``maxsize`` entries are held, the ones
+    closest to expiry are evicted. Errors from SQLite are logged and treated
+    as misses, so a broken cache file never fails authentication.
+    
+    The database and its key are created with mode 0600 in a directory only
+    the current user can write to; files owned by another user are refused.
+    Rows are keyed by an HMAC of the request (so license keys and HWIDs are
+    not stored) and every row is signed; rows with a bad signature are
+    discarded as misses.
+    
+    Any object with the same get/put/invalidate/invalidate_license_key/clear/
+    stats interface (e.g. a client for a local Redis-compatible server) can
+    be assigned to ``keymaster_auth.license_cache`` in the same way.
+    
+    Args:
+        path: Database file
+        maxsize: Maximum number of entries
+        ttl: Lifetime of successful results in seconds (0 disables caching)
+        negative_ttl: Lifetime of definitive rejections in seconds (0 disables)
+        busy_timeout: Milliseconds to wait for another process's write lock
+        secret: HMAC key for rows (defaults to KEYMASTER_CACHE_SECRET, else a
+            random key stored in ``<path>.key``)
+    
+    Raises:
+        InsecureCacheFileError: If the database, its key or its directory
+            could be tampered with by another user
+    """
+    
+    def __init__(self, path: str = CACHE_PATH, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL,
+                 negative_ttl: float = CACHE_NEGATIVE_TTL, busy_timeout: int = 200,
+                 secret: Optional[Union[str, bytes]] = CACHE_SECRET):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._secret = b""
+        if self.enabled:
+            _prepare_private_dir(os.path.dirname(os.path.abspath(path)))
+            if isinstance(secret, str):
+                secret = secret.encode("utf-8")
+            self._secret = secret or _load_secret(path + ".key")
+            self._connection()  # create the schema up front
+    
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and (self.ttl > 0 or self.negative_ttl > 0)
+    
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; never share one across fork
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.close(_open_private_file(self.path))  # SQLite creates -wal/-shm with the same mode
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS signed_results ("
+            "cache_key TEXT PRIMARY KEY, license_key TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, result BLOB NOT NULL, signature TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS signed_results_expires ON signed_results (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS signed_results_license ON signed_results (license_key)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    def _digest(self, *parts: Union[str, bytes]) -> str:
+        mac = hmac.new(self._secret, digestmod=hashlib.sha256)
+        for part in parts:
+            mac.update(part.encode("utf-8") if isinstance(part, str) else part)
+            mac.update(b"\x1f")
+        return mac.hexdigest()
+    
+    def _encode_key(self, key: CacheKey) -> str:
+        return self._digest("key", json.dumps(key, separators=(",", ":")))
+    
+    def _encode_license_key(self, license_key: str) -> str:
+        return self._digest("license", license_key.upper().strip())
+    
+    def _sign(self, cache_key: str, expires_at: float, result: bytes) -> str:
+        return self._digest("row", cache_key, repr(expires_at), result)
+    
+    def _count(self, **counters: int) -> None:
+        with self._lock:
+            for name, amount in counters.items():
+                setattr(self, name, getattr(self, name) + amount)
+    
+    def get(self, key: CacheKey) -> Optional[AuthResult]:
+        """
+        Look up a cached result.
+        
+        Args:
+            key: Cache key from make_license_cache_key
+        
+        Returns:
+            Copy of the cached result, or None on a miss
+        """
+        cache_key = self._encode_key(key)
+        try:
+            row = self._connection().execute(
+                "SELECT expires_at, result, signature FROM signed_results WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Shared cache read failed: %s", e)
+            self._count(_misses=1)
+            return None
+        if row is None:
+            self._count(_misses=1)
+            return None
+        if row[0] <= time.time():
+            self._count(_misses=1, _expirations=1)
+            return None
+        if not hmac.compare_digest(self._sign(cache_key, row[0], bytes(row[1])), row[2]):
+            logger.warning("Discarding shared cache entry with an invalid signature")
+            self._count(_misses=1)
+            return None
+        try:
+            result = AuthResult.from_json(row[1])
+        except ValueError as e:
+            logger.warning("Discarding unreadable shared cache entry: %s", e)
+            self._count(_misses=1)
+            return None
+        self._count(_hits=1)
+        return result
+    
+    def put(self, key: CacheKey, result: Mapping) -> bool:
+        """
+        Store a result if it is cacheable.
+        
+        Args:
+            key: Cache key from make_license_cache_key
+            result: AuthResult (or result dictionary)
+        
+        Returns:
+            True if the result was stored
+        """
+        if self.maxsize <= 0:
+            return False
+        
+        ttl = cacheable_ttl(result, self.ttl, self.negative_ttl)
+        if ttl <= 0:
+            return False
+        
+        now = time.time()
+        cache_key = self._encode_key(key)
+        expires_at = now + ttl
+        body = dumps(result)
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO signed_results (cache_key, license_key, expires_at, result, signature) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (cache_key, self._encode_license_key(key[1]), expires_at, body,
+                     self._sign(cache_key, expires_at, body))
+                )
+                expired = conn.execute("DELETE FROM signed_results WHERE expires_at <= ?", (now,)).rowcount
+                evicted = conn.execute(
+                    "DELETE FROM signed_results WHERE cache_key IN ("
+                    "SELECT cache_key FROM signed_results ORDER BY expires_at "
+                    "LIMIT max(0, (SELECT COUNT(*) FROM signed_results) - ?))",
+                    (self.maxsize,)
+                ).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Shared cache write failed: %s", e)
+            return False
+        self._count(_expirations=max(0, expired), _evictions=max(0, evicted))
+        return True
+    
+    def _delete(self, where: str, params: Tuple[Any, ...]) -> int:
+        try:
+            return self._connection().execute(f"DELETE FROM signed_results WHERE {where}", params).rowcount
+        except sqlite3.Error as e:
+            logger.warning("Shared cache delete failed: %s", e)
+            return 0
+    
+    def invalidate(self, key: CacheKey) -> bool:
+        """
+        Remove a single entry.
+        
+        Returns:
+            True if an entry was removed
+        """
+        return self._delete("cache_key = ?", (self._encode_key(key),)) > 0
+    
+    def invalidate_license_key(self, license_key: str) -> int:
+        """
+        Remove every entry for a license key (e.g. after it was revoked).
+        
+        Returns:
+            Number of entries removed
+        """
+        return self._delete("license_key = ?", (self._encode_license_key(license_key),))
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._delete("1 = 1", ())
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+        
+        Hit/miss counters are per process; size is shared by all processes.
+        
+        Returns:
+            Dictionary with hit/miss/eviction counters, hit ratio and size
+        """
+        size = len(self)
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_ratio": (self._hits / lookups) if lookups else 0.0,
+                "size": size,
+                "maxsize": self.maxsize
+            }
+    
+    def reset_stats(self) -> None:
+        """Reset hit/miss/eviction counters."""
+        with self._lock:
+            self._hits = self._misses = self._evictions = self._expirations = 0
+    
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM signed_results WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+def create_result_cache(backend: str = CACHE_BACKEND):
+    """
+    Build the authentication result cache selected by KEYMASTER_CACHE_BACKEND.
+    
+    Args:
+        backend: "memory" for a per-process cache, "sqlite" for a host-wide one
+    
+    Returns:
+        AuthResultCache or SQLiteAuthResultCache
+    """
+    if backend == "sqlite":
+        try:
+            return SQLiteAuthResultCache()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Shared cache unavailable at %s, using in-process cache: %s", CACHE_PATH, e)
+    elif backend != "memory":
+        logger.warning("Unknown KEYMASTER_CACHE_BACKEND %r, using in-process cache", backend)
+    return AuthResultCache()
@@ -0,0 +1,92 @@
+import os
+import json
+import logging
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# JSON codec for KeyMaster requests, responses and cached results:
+# "auto" (orjson when installed, else stdlib), "orjson" or "json"
+JSON_CODEC = os.environ.get("KEYMASTER_JSON_CODEC", "auto").lower()
+
+CODEC_NAMES = ("auto", "orjson", "json")
+
+def _default(obj: Any) -> Any:
+    # Typed results (e.g. AuthResult) serialize as their dict form
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class StdlibJsonCodec:
+    """Codec backed by the standard library ``json`` module."""
+    
+    name = "json"
+    
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=_default).encode("utf-8")
+    
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+class OrjsonCodec:
+    """Codec backed by orjson, which parses bytes directly without decoding to str first."""
+    
+    name = "orjson"
+    
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+    
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+def create_codec(name: str = JSON_CODEC):
+    """
+    Build a codec by name.
+    
+    Args:
+        name: "auto", "orjson" or "json"
+    
+    Returns:
+        Codec with ``dumps(obj) -> bytes`` and ``loads(bytes | str)``; both
+        raise ValueError on invalid input
+    """
+    if name not in CODEC_NAMES:
+        raise ValueError(f"JSON codec must be one of {', '.join(CODEC_NAMES)}")
+    if name != "json" and orjson is not None:
+        return OrjsonCodec()
+    if name == "orjson":
+        logger.warning("KEYMASTER_JSON_CODEC=orjson but orjson is not installed; using stdlib json")
+    return StdlibJsonCodec()
+
+# Codec used by the module-level dumps/loads
+codec = create_codec()
+
+def set_codec(new_codec) -> None:
+    """
+    Replace the process-wide codec (any object with ``dumps`` and ``loads``).
+    
+    Args:
+        new_codec: Codec to use for subsequent calls
+    """
+    global codec
+    codec = new_codec
+
+def dumps(obj: Any) -> bytes:
+    """Serialize ``obj`` to compact UTF-8 JSON bytes."""
+    return codec.dumps(obj)
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Parse JSON from bytes or str.
+    
+    Raises:
+        ValueError: If ``data`` is not valid JSON
+    """
+    return codec.loads(data)
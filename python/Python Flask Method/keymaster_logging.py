@@ -0,0 +1,259 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Any
+
+# Logging settings
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")  # "" = console only
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()  # "json" or "text"
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))  # share of sampled records kept
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # records buffered before dropping
+
+# Set by gunicorn.conf.py: workers hand records to one writer in the master process
+LOG_SHARED_QUEUE = os.environ.get("KEYMASTER_LOG_SHARED_QUEUE", "") == "1"
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Pass as ``extra=SAMPLED`` for high-volume records (e.g. successful logins)
+# that only need to be kept at LOG_SAMPLE_RATE
+SAMPLED = {"sampled": True}
+
+_RESERVED_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_queue = None  # drained by the listener (shared with forked workers in shared mode)
+_listener: Optional[QueueListener] = None
+_forwarder: Optional[QueueListener] = None  # shared mode: moves this process's records to _queue
+_handler: Optional["NonBlockingQueueHandler"] = None
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including ``extra`` fields."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str, separators=(",", ":"))
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only ``rate`` of the records marked with ``extra=SAMPLED``.
+    
+    Kept records get a ``sample_rate`` field so counts can be scaled back up.
+    Unmarked records always pass.
+    """
+    
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        if self.rate < 1 and random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+    
+    The message is rendered once here (so the record pickles cleanly) and the
+    rest of the formatting and all disk I/O happen in the listener. When the
+    queue is full the record is dropped and counted instead of waiting.
+    """
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class SharedQueueListener(QueueListener):
+    """
+    QueueListener draining the ``multiprocessing.SimpleQueue`` shared with forked workers.
+    
+    SimpleQueue has no feeder thread, so it stays usable in a plain
+    ``os.fork()`` child; its ``get`` and ``put`` take no block/timeout.
+    """
+    
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        return self.queue.get()
+    
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(None)  # QueueListener's stop sentinel
+
+class _ForwardingHandler(logging.Handler):
+    """Puts prepared records on the shared queue; runs on the forwarder thread, never the caller's."""
+    
+    def __init__(self, shared_queue):
+        super().__init__()
+        self.shared_queue = shared_queue
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.shared_queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+def _writer_handlers(log_file: Optional[str] = LOG_FILE, log_format: str = LOG_FORMAT) -> List[logging.Handler]:
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def get_log_queue():
+    """
+    Get the queue the listener drains, creating it on first use.
+    
+    Returns:
+        A multiprocessing.SimpleQueue shared with forked workers when
+        KEYMASTER_LOG_SHARED_QUEUE is set, otherwise an in-process queue
+    """
+    global _queue
+    if _queue is None:
+        _queue = multiprocessing.SimpleQueue() if LOG_SHARED_QUEUE else queue.Queue(LOG_QUEUE_SIZE)
+    return _queue
+
+def _start_forwarder() -> "queue.Queue":
+    """
+    Start this process's thread moving records from a bounded private queue to the shared one.
+    
+    Writing to the shared pipe can block, so only the forwarder does it;
+    callers drop records when the private queue is full.
+    
+    Returns:
+        The private queue to hand records to
+    """
+    global _forwarder
+    local_queue: "queue.Queue" = queue.Queue(LOG_QUEUE_SIZE)
+    _forwarder = QueueListener(local_queue, _ForwardingHandler(get_log_queue()))
+    _forwarder.start()
+    return local_queue
+
+def _stop_forwarder() -> None:
+    """Hand records still queued in this process to the shared queue and stop the forwarder."""
+    global _forwarder
+    forwarder, _forwarder = _forwarder, None
+    if forwarder is not None:
+        forwarder.stop()
+
+atexit.register(_stop_forwarder)
+
+def _rebuild_after_fork() -> None:
+    # Threads do not survive fork: the listener stays with the parent, and a
+    # child gets a new handler, private queue and forwarder of its own
+    global _listener, _forwarder, _handler
+    _listener = None
+    _forwarder = None
+    if LOG_SHARED_QUEUE and _handler is not None:
+        stale = _handler
+        _handler = NonBlockingQueueHandler(_start_forwarder())
+        for log_filter in stale.filters:
+            _handler.addFilter(log_filter)
+        root = logging.getLogger()
+        root.removeHandler(stale)
+        root.addHandler(_handler)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_rebuild_after_fork)
+
+def start_log_listener(log_file: Optional[str] = LOG_FILE, log_format: str = LOG_FORMAT) -> QueueListener:
+    """
+    Start the thread that drains the queue and writes records.
+    
+    Under gunicorn this runs once in the master, making it the only process
+    on the host that writes the application log.
+    
+    Returns:
+        The running listener
+    """
+    global _listener
+    if _listener is None:
+        listener_class = SharedQueueListener if LOG_SHARED_QUEUE else QueueListener
+        _listener = listener_class(get_log_queue(), *_writer_handlers(log_file, log_format),
+                                   respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_log_listener)
+    return _listener
+
+def stop_log_listener() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+def configure_logging(level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE) -> NonBlockingQueueHandler:
+    """
+    Route all logging through a non-blocking queue.
+    
+    In shared mode (set by gunicorn.conf.py) the listener is started by the
+    gunicorn master, and each process forwards its records to it from a
+    private queue (rebuilt after fork); otherwise the listener is started
+    here, in this process.
+    
+    Args:
+        level: Root log level
+        sample_rate: Share of ``extra=SAMPLED`` records to keep
+    
+    Returns:
+        The queue handler installed on the root logger
+    """
+    global _handler
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _handler is not None:
+        root.removeHandler(_handler)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    
+    _stop_forwarder()
+    _handler = NonBlockingQueueHandler(_start_forwarder() if LOG_SHARED_QUEUE else get_log_queue())
+    _handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(_handler)
+    
+    if not LOG_SHARED_QUEUE:
+        start_log_listener()
+    return _handler
+
+def dropped_records() -> int:
+    """Number of records dropped in this process because the queue was full."""
+    return _handler.dropped if _handler is not None else 0
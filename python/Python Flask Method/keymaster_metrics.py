@@ -0,0 +1,467 @@
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+import logging
+from typing import Dict, Optional, Any, Callable, List, Tuple, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process compaction
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Directory shared by all worker processes of one server (unset = single-process mode)
+METRICS_DIR = os.environ.get("KEYMASTER_METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("KEYMASTER_METRICS_FLUSH_INTERVAL", "1"))  # seconds
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_ARCHIVE_FILE = "archive.json"
+_LOCK_FILE = ".lock"
+_KEY_SEP = "\x1f"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    """Base class: a named metric with a fixed set of label names."""
+    
+    type_name = ""
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[str, Any] = {}
+    
+    def _key(self, labels: Dict[str, Any]) -> str:
+        return _KEY_SEP.join(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            "type": self.type_name,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": {key: (dict(value) if isinstance(value, dict) else value) for key, value in self._values.items()}
+        }
+
+class Counter(_Metric):
+    """Monotonic counter; summed across processes, kept after a worker exits."""
+    
+    type_name = "counter"
+    
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry._changed()
+
+class Gauge(_Metric):
+    """
+    Point-in-time value. Across processes only live workers are reported,
+    combined by ``mode`` ('max' or 'sum').
+    """
+    
+    type_name = "gauge"
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str,
+                 labelnames: Sequence[str], mode: str = "max"):
+        super().__init__(registry, name, help_text, labelnames)
+        self.mode = mode
+    
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.registry._lock:
+            self._values[key] = value
+        self.registry._changed()
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        snapshot = super()._snapshot()
+        snapshot["mode"] = self.mode
+        return snapshot
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets; summed across processes."""
+    
+    type_name = "histogram"
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str,
+                 labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.registry._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][index] += 1
+                    break
+            sample["sum"] += value
+            sample["count"] += 1
+        self.registry._changed()
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        snapshot = super()._snapshot()
+        snapshot["bucket_bounds"] = list(self.buckets)
+        snapshot["samples"] = {
+            key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+            for key, value in self._values.items()
+        }
+        return snapshot
+
+class MetricsRegistry:
+    """
+    Process-local metrics that aggregate correctly across gunicorn workers.
+    
+    Every process keeps its metrics in memory and, when ``directory`` is set,
+    a daemon thread writes a snapshot to ``<directory>/<pid>.json`` every
+    ``flush_interval`` seconds while values change (and at exit), so
+    recording a value never touches the disk. ``render()`` merges all
+    snapshots: counters and histograms are summed, including those of workers
+    that have exited (their files are folded into an archive), while gauges
+    only include live processes.
+    
+    Args:
+        directory: Shared snapshot directory, or None for single-process mode
+        flush_interval: Seconds between snapshot writes
+    """
+    
+    def __init__(self, directory: Optional[str] = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._flusher: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))
+    
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = (), mode: str = "max") -> Gauge:
+        return self._register(Gauge(self, name, help_text, labelnames, mode))
+    
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+    
+    def register_collector(self, collector: Callable[[], None]) -> None:
+        """Register a callable that updates gauges right before a snapshot is taken."""
+        self._collectors.append(collector)
+    
+    def _run_collectors(self) -> None:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.debug("Metrics collector failed: %s", e)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Snapshot of this process's metrics."""
+        self._run_collectors()
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "metrics": {name: metric._snapshot() for name, metric in self._metrics.items()}
+            }
+    
+    def _changed(self) -> None:
+        self._dirty = True
+        if self._flusher is None and self.directory:
+            self._start_flusher()
+    
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True,
+                                             name="keymaster-metrics-flush")
+        self._flusher.start()
+    
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+    
+    def flush(self) -> None:
+        """Write this process's snapshot to the shared directory."""
+        if not self.directory or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._dirty = False
+            self._write_json(os.path.join(self.directory, f"{os.getpid()}.json"), self.snapshot())
+        except OSError as e:
+            logger.debug("Could not write metrics snapshot: %s", e)
+        finally:
+            self._flush_lock.release()
+    
+    def _write_json(self, path: str, data: Dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as f_out:
+                json.dump(data, f_out, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def reset(self) -> None:
+        """Drop all recorded values (used in forked children)."""
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._values = {}
+        self._dirty = False
+        self._flusher = None  # threads do not survive fork; restarted on first use
+        self._pid = os.getpid()
+    
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        if os.name == "nt":
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+    
+    def _read_json(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r") as f_in:
+                return json.load(f_in)
+        except (OSError, ValueError):
+            return None
+    
+    def _collect_snapshots(self) -> List[Tuple[Dict[str, Any], bool]]:
+        """Return (snapshot, alive) pairs for every process, compacting dead workers."""
+        own = self.snapshot()
+        if not self.directory:
+            return [(own, True)]
+        
+        snapshots = [(own, True)]
+        lock_file = None
+        try:
+            if fcntl is not None:
+                lock_file = open(os.path.join(self.directory, _LOCK_FILE), "a")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            
+            archive_path = os.path.join(self.directory, _ARCHIVE_FILE)
+            archive = self._read_json(archive_path)
+            dead = []
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith(".json") or file_name == _ARCHIVE_FILE:
+                    continue
+                try:
+                    pid = int(file_name[:-5])
+                except ValueError:
+                    continue
+                if pid == own["pid"]:
+                    continue
+                data = self._read_json(os.path.join(self.directory, file_name))
+                if data is None:
+                    continue
+                if self._pid_alive(pid):
+                    snapshots.append((data, True))
+                else:
+                    dead.append((file_name, data))
+            
+            if dead and lock_file is not None:
+                # Fold exited workers into the archive so their counters survive
+                merged = [archive] if archive else []
+                merged.extend(data for _, data in dead)
+                archive = {"pid": 0, "metrics": _merge_metrics([(data, False) for data in merged])}
+                self._write_json(archive_path, archive)
+                for file_name, _ in dead:
+                    try:
+                        os.remove(os.path.join(self.directory, file_name))
+                    except OSError:
+                        pass
+            else:
+                snapshots.extend((data, False) for _, data in dead)
+            
+            if archive:
+                snapshots.append((archive, False))
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+        return snapshots
+    
+    def render(self) -> str:
+        """
+        Render metrics of all processes in Prometheus text exposition format.
+        
+        Returns:
+            Exposition text
+        """
+        merged = _merge_metrics(self._collect_snapshots())
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            labelnames = metric["labelnames"]
+            lines.append(f"# HELP {name} {_escape(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key in sorted(metric["samples"]):
+                value = metric["samples"][key]
+                labelvalues = key.split(_KEY_SEP) if labelnames else []
+                if metric["type"] == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric["bucket_bounds"], value["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labelnames, labelvalues, ('le', _format_value(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, labelvalues, ('le', '+Inf'))} {value['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, labelvalues)} {_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, labelvalues)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _merge_metrics(snapshots: List[Tuple[Dict[str, Any], bool]]) -> Dict[str, Dict[str, Any]]:
+    """Merge per-process snapshots: sum counters/histograms, combine live gauges by mode."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot, alive in snapshots:
+        for name, metric in snapshot.get("metrics", {}).items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {key: value for key, value in metric.items() if key != "samples"}
+                target["samples"] = {}
+            samples = target["samples"]
+            for key, value in metric["samples"].items():
+                current = samples.get(key)
+                if metric["type"] == "histogram":
+                    if current is None or len(current["buckets"]) != len(value["buckets"]):
+                        samples[key] = {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                    else:
+                        current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                        current["sum"] += value["sum"]
+                        current["count"] += value["count"]
+                elif metric["type"] == "gauge" and metric.get("mode") == "max":
+                    samples[key] = value if current is None else max(current, value)
+                else:
+                    samples[key] = value + (current or 0)
+    return merged
+
+# Process-wide registry used by keymaster_auth, keymaster_async and app.py
+registry = MetricsRegistry()
+
+def _reset_after_fork() -> None:
+    registry.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(registry.flush)
+
+def render_metrics() -> str:
+    """Render all KeyMaster metrics in Prometheus text format."""
+    return registry.render()
+
+# --- KeyMaster client metrics ---
+UPSTREAM_PHASE_SECONDS = registry.histogram(
+    "keymaster_upstream_phase_seconds",
+    "Time spent opening upstream connections, by phase (dns, connect, tls)",
+    ("endpoint", "phase")
+)
+UPSTREAM_REQUEST_SECONDS = registry.histogram(
+    "keymaster_upstream_request_seconds",
+    "Duration of a single HTTP attempt to KeyMaster",
+    ("endpoint",)
+)
+CALL_SECONDS = registry.histogram(
+    "keymaster_call_seconds",
+    "Total duration of a KeyMaster call including retries and coalescing",
+    ("endpoint", "outcome")
+)
+RETRIES_TOTAL = registry.counter(
+    "keymaster_retries_total",
+    "Retried KeyMaster attempts, by reason",
+    ("endpoint", "reason")
+)
+ERRORS_TOTAL = registry.counter(
+    "keymaster_errors_total",
+    "Failed KeyMaster calls, by error code or exception type",
+    ("endpoint", "code")
+)
+RESULTS_TOTAL = registry.counter(
+    "keymaster_results_total",
+    "Completed KeyMaster calls, by success flag",
+    ("endpoint", "success")
+)
+CACHE_LOOKUPS_TOTAL = registry.counter(
+    "keymaster_cache_lookups_total",
+    "Authentication result cache lookups, by result (hit, miss)",
+    ("cache", "result")
+)
+COALESCED_TOTAL = registry.counter(
+    "keymaster_coalesced_calls_total",
+    "Calls served by joining an identical in-flight request",
+    ("coalescer",)
+)
+HEDGES_TOTAL = registry.counter(
+    "keymaster_hedges_total",
+    "Hedged KeyMaster attempts, by outcome (sent, won, lost, budget, busy)",
+    ("endpoint", "outcome")
+)
+HEDGE_SAVED_SECONDS = registry.histogram(
+    "keymaster_hedge_saved_seconds",
+    "Latency saved when a hedged attempt answered before the original one",
+    ("endpoint",)
+)
+CIRCUIT_STATE = registry.gauge(
+    "keymaster_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open), worst across workers",
+    mode="max"
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "keymaster_upstream_in_flight",
+    "KeyMaster calls currently in flight, summed across workers",
+    mode="sum"
+)
+
+def endpoint_name(api_url: str) -> str:
+    """Short endpoint label for an API URL (last path segment)."""
+    return api_url.rstrip("/").rsplit("/", 1)[-1] or api_url
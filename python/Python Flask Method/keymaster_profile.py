@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+import itertools
+import logging
+from typing import Dict, List, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Per-request profiling (see app.py): off unless a sample rate or token is set
+PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", "0"))  # profile 1 in N requests, 0 = none
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")  # requests sending "X-Profile: <token>" are always profiled
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")  # where .folded files are written
+PROFILE_MIN_MS = float(os.environ.get("PROFILE_MIN_MS", "0"))  # only keep profiles at least this slow
+
+# Profile being recorded on this thread (one per request)
+_local = threading.local()
+_sequence = itertools.count(1)
+_sample_counter = itertools.count()
+
+class Profile:
+    """
+    Timing spans recorded for one request.
+    
+    Spans nest; each finished span adds its self time (its duration minus
+    that of its child spans) to the stack ``root;parent;name``, which is the
+    folded format read by flamegraph.pl, speedscope and inferno.
+    
+    Args:
+        root: Name of the outermost frame (e.g. the Flask endpoint)
+    """
+    
+    __slots__ = ("root", "id", "duration", "stacks", "_frames")
+    
+    def __init__(self, root: str):
+        self.root = root
+        self.id = f"{os.getpid()}-{next(_sequence)}"
+        self.duration: Optional[float] = None
+        self.stacks: Dict[str, float] = {}
+        self._frames: List[list] = []  # [name, started, child seconds]
+        self.push(root)
+    
+    def push(self, name: str) -> None:
+        self._frames.append([name, time.perf_counter(), 0.0])
+    
+    def pop(self) -> float:
+        ended = time.perf_counter()
+        path = ";".join(frame[0] for frame in self._frames)
+        name, started, child_seconds = self._frames.pop()
+        elapsed = ended - started
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - child_seconds
+        if self._frames:
+            self._frames[-1][2] += elapsed
+        return elapsed
+    
+    def finish(self) -> float:
+        """Close any open spans and the root frame; returns the total duration in seconds."""
+        elapsed = 0.0
+        while self._frames:
+            elapsed = self.pop()
+        if self.duration is None:
+            self.duration = elapsed
+        return self.duration
+    
+    def folded(self) -> str:
+        """Folded stacks, one ``frames microseconds`` line per stack."""
+        return "".join(f"{path} {max(round(seconds * 1e6), 0)}\n" for path, seconds in self.stacks.items())
+
+class _Span:
+    __slots__ = ("profile", "name")
+    
+    def __init__(self, profile: Profile, name: str):
+        self.profile = profile
+        self.name = name
+    
+    def __enter__(self) -> "_Span":
+        self.profile.push(self.name)
+        return self
+    
+    def __exit__(self, *exc_info) -> bool:
+        self.profile.pop()
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self) -> "_NullSpan":
+        return self
+    
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str):
+    """
+    Time a block as a child of the current span.
+    
+    Costs one thread-local lookup when the current request is not being
+    profiled.
+    
+    Example:
+        with span("hwid"):
+            hwid = get_persistent_hwid()
+    """
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return _NULL_SPAN
+    return _Span(profile, name)
+
+def sampled(rate: int = PROFILE_SAMPLE_RATE) -> bool:
+    """True for 1 in ``rate`` calls in this process (never when ``rate`` is 0)."""
+    return rate > 0 and next(_sample_counter) % rate == 0
+
+def start_profile(root: str) -> Optional[Profile]:
+    """
+    Start profiling on this thread.
+    
+    Returns:
+        The new Profile, or None if one is already being recorded
+    """
+    if getattr(_local, "profile", None) is not None:
+        return None
+    profile = _local.profile = Profile(root)
+    return profile
+
+def current_profile() -> Optional[Profile]:
+    return getattr(_local, "profile", None)
+
+def finish_profile() -> Optional[Profile]:
+    """Stop profiling on this thread and return the finished Profile (None if none was running)."""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return None
+    _local.profile = None
+    profile.finish()
+    return profile
+
+def write_profile(profile: Profile, directory: str = PROFILE_DIR) -> str:
+    """
+    Write a finished profile as ``<directory>/<time>-<root>-<id>.folded``.
+    
+    Files from many requests can be merged, e.g.
+    ``cat profiles/*.folded | flamegraph.pl > auth.svg``.
+    
+    Returns:
+        Path of the written file
+    """
+    os.makedirs(directory, exist_ok=True)
+    root = "".join(c if c.isalnum() or c in "-_" else "_" for c in profile.root)
+    path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{root}-{profile.id}.folded")
+    with open(path, "w", encoding="utf-8") as f_out:
+        f_out.write(profile.folded())
+    return path
@@ -0,0 +1,319 @@
+import os
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no host-wide upstream cap
+    fcntl = None
+
+from keymaster_cache import _check_owner, _open_private_file, _prepare_private_dir
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Token-bucket limits for /auth as "<requests>/<seconds>" ("" or "0" disables)
+RATE_LIMIT_IP = os.environ.get("RATE_LIMIT_IP", "20/60")
+RATE_LIMIT_USERNAME = os.environ.get("RATE_LIMIT_USERNAME", "5/60")
+
+# SQLite file shared by all workers on the host (unset = per-process buckets)
+RATE_LIMIT_DB = os.environ.get("KEYMASTER_RATELIMIT_DB")
+
+# Host-wide cap on concurrent KeyMaster calls across all workers (0 disables)
+HOST_MAX_IN_FLIGHT = int(os.environ.get("KEYMASTER_HOST_MAX_IN_FLIGHT", "0"))
+HOST_SLOTS_DIR = os.environ.get("KEYMASTER_HOST_SLOTS_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "keymaster", "upstream_slots")  # private to the user running the workers
+
+_PRUNE_EVERY = 1000  # bucket updates between removals of idle buckets
+
+def parse_limit(spec: Optional[str]) -> Optional[Tuple[float, float]]:
+    """
+    Parse a "<requests>/<seconds>" limit.
+    
+    Returns:
+        (burst, refill rate per second), or None if the limit is disabled
+    """
+    if not spec or spec.strip() in ("0", "off", "none"):
+        return None
+    count, _, period = spec.partition("/")
+    burst = float(count)
+    seconds = float(period or "1")
+    if burst <= 0 or seconds <= 0:
+        return None
+    return burst, burst / seconds
+
+def _refill(tokens: float, updated: float, now: float, burst: float, rate: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+class MemoryBucketStore:
+    """Per-process token buckets, used when no shared database is configured."""
+    
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+    
+    def take(self, key: str, burst: float, rate: float, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from a bucket.
+        
+        Returns:
+            0 if allowed, otherwise seconds until enough tokens are available
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._buckets.get(key)
+            tokens = burst if entry is None else _refill(entry[0], entry[1], now, burst, rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+        return wait
+    
+    def _prune(self, now: float) -> None:
+        # A bucket that has refilled completely is the same as no bucket
+        for key in [key for key, entry in self._buckets.items() if entry[2] <= now]:
+            del self._buckets[key]
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+class SQLiteBucketStore:
+    """
+    Token buckets in a SQLite database shared by every worker on the host.
+    
+    Each update is one short IMMEDIATE transaction in WAL mode, so workers
+    serialize on the database lock for microseconds. Fully refilled buckets
+    are deleted periodically, which keeps the table bounded by the number of
+    recently active clients. If the database is unavailable, requests are
+    allowed (fail open) rather than turning a local fault into an outage.
+    
+    Args:
+        path: Database file
+        busy_timeout: Milliseconds to wait for the database lock
+    """
+    
+    def __init__(self, path: str, busy_timeout: int = 200):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._updates = 0
+        self._connection()  # create the schema up front
+    
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")  # buckets are disposable
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    def take(self, key: str, burst: float, rate: float, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from a bucket.
+        
+        Returns:
+            0 if allowed, otherwise seconds until enough tokens are available
+        """
+        try:
+            conn = self._connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else _refill(row[0], row[1], now, burst, rate)
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, now + (burst - tokens) / rate)
+                )
+                self._updates += 1
+                if self._updates % _PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return wait
+        except sqlite3.Error as e:
+            logger.warning("Rate limit store unavailable, allowing request: %s", e)
+            return 0.0
+    
+    def clear(self) -> None:
+        try:
+            self._connection().execute("DELETE FROM buckets")
+        except sqlite3.Error as e:
+            logger.warning("Could not clear rate limit store: %s", e)
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter with one bucket per (scope, identity).
+    
+    Args:
+        limits: Mapping of scope name (e.g. "ip", "username") to (burst, rate)
+            as returned by parse_limit; None entries are skipped
+        store: Bucket store (defaults to SQLite at RATE_LIMIT_DB, or in-memory)
+    """
+    
+    def __init__(self, limits: Dict[str, Optional[Tuple[float, float]]], store=None):
+        self.limits = {scope: limit for scope, limit in limits.items() if limit}
+        if store is None:
+            store = SQLiteBucketStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryBucketStore()
+        self.store = store
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits)
+    
+    def check(self, **identities: Optional[str]) -> Tuple[Optional[str], float]:
+        """
+        Spend one token per configured scope, stopping at the first empty bucket.
+        
+        Args:
+            identities: Identity per scope, e.g. ip="1.2.3.4", username="bob";
+                missing or empty identities are not limited
+        
+        Returns:
+            (None, 0) if allowed, otherwise (rejecting scope, seconds to wait)
+        """
+        for scope, (burst, rate) in self.limits.items():
+            identity = identities.get(scope)
+            if not identity:
+                continue
+            # Hash identities so usernames and addresses are not stored in clear text
+            digest = hashlib.sha256(identity.strip().lower().encode("utf-8")).hexdigest()[:32]
+            wait = self.store.take(f"{scope}:{digest}", burst, rate)
+            if wait:
+                return scope, wait
+        return None, 0.0
+
+class HostConcurrencyLimit:
+    """
+    Host-wide cap on concurrent upstream calls, shared by all worker processes.
+    
+    Each of the ``slots`` slots is a lock file; a call holds an exclusive
+    flock on one of them. The kernel drops the lock when a process dies, so
+    crashed or recycled workers never leak slots. ``acquire`` returns the
+    slot it took and ``release`` frees exactly that slot, so a thread can
+    hold several slots at once (e.g. a hedged call).
+    
+    The directory is created with mode 0700 and, like the result cache,
+    refused if another user owns it or could write to it: anyone able to
+    lock the slot files could stall every upstream call on the host.
+    
+    Args:
+        slots: Maximum concurrent calls on this host
+        directory: Directory holding the slot lock files
+        poll_interval: Seconds between attempts while all slots are taken
+    
+    Raises:
+        InsecureCacheFileError: (from ``acquire``) If the directory or a slot
+            file could be locked or replaced by another user
+    """
+    
+    def __init__(self, slots: int, directory: str = HOST_SLOTS_DIR, poll_interval: float = 0.005):
+        self.slots = slots
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._files = []
+        self._held: Set[int] = set()  # slot indexes held by this process
+    
+    def _open_files(self) -> None:
+        # Lock files inherited across fork share the parent's lock: reopen per process
+        if self._pid == os.getpid():
+            return
+        _prepare_slots_dir(self.directory)
+        files = []
+        try:
+            for index in range(self.slots):
+                path = os.path.join(self.directory, f"slot-{index}.lock")
+                files.append(os.fdopen(_open_private_file(path), "r+"))
+        except BaseException:
+            for f in files:
+                f.close()
+            raise
+        self._files = files
+        self._held = set()
+        self._pid = os.getpid()
+    
+    def acquire(self, timeout: float) -> Optional[int]:
+        """
+        Take a free slot.
+        
+        Returns:
+            Index of the slot taken (pass it to ``release``), or None if no
+            slot freed up within ``timeout`` seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._open_files()
+                start = random.randrange(self.slots)
+                for offset in range(self.slots):
+                    index = (start + offset) % self.slots
+                    if index in self._held:
+                        continue
+                    try:
+                        fcntl.flock(self._files[index], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    self._held.add(index)
+                    return index
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+    
+    def release(self, slot: int) -> None:
+        """Release a slot returned by ``acquire`` (a no-op in a forked child)."""
+        with self._lock:
+            if self._pid == os.getpid() and slot in self._held:
+                self._held.discard(slot)
+                fcntl.flock(self._files[slot], fcntl.LOCK_UN)
+
+def _prepare_slots_dir(directory: str) -> None:
+    """
+    Create the slot directory with mode 0700.
+    
+    Raises:
+        InsecureCacheFileError: If another user owns it or can write to it
+    """
+    _prepare_private_dir(directory)
+    _check_owner(directory, os.stat(directory))
+
+def default_host_limit() -> Optional[HostConcurrencyLimit]:
+    """Host-wide upstream limit from the environment, or None if disabled/unsupported."""
+    if HOST_MAX_IN_FLIGHT <= 0:
+        return None
+    if fcntl is None:
+        logger.warning("KEYMASTER_HOST_MAX_IN_FLIGHT needs fcntl; host-wide limit disabled")
+        return None
+    try:
+        _prepare_slots_dir(HOST_SLOTS_DIR)
+    except OSError as e:
+        logger.error("Host slot directory %s unusable, host-wide limit disabled: %s", HOST_SLOTS_DIR, e)
+        return None
+    return HostConcurrencyLimit(HOST_MAX_IN_FLIGHT)
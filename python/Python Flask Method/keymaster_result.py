@@ -0,0 +1,172 @@
+import logging
+from datetime import datetime
+from collections.abc import Mapping, MutableMapping
+from typing import Dict, Iterator, Optional, Any, Union
+
+from keymaster_codec import loads
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Fields of a KeyMaster response that may carry the entitlement expiry
+EXPIRY_FIELDS = ("expiresAt", "expiryDate", "expires_at")
+
+# Response field -> AuthResult attribute
+_ATTRIBUTES = {
+    "success": "success",
+    "message": "message",
+    "errorCode": "error_code",
+    "userStatus": "user_status",
+    "expiresAt": "expires_at",
+}
+_FIELDS = frozenset(_ATTRIBUTES)
+
+def parse_expiry(value: Any) -> Optional[float]:
+    """Parse an ISO 8601 timestamp or epoch seconds into epoch seconds."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        logger.debug("Ignoring unparseable entitlement expiry: %r", value)
+        return None
+
+class AuthResult(MutableMapping):
+    """
+    Result of a KeyMaster authentication call.
+    
+    The well-known response fields are stored in slots, so a result costs a
+    fraction of the equivalent dict; any other fields the server returns are
+    kept in ``extra`` (None when there are none). The object also behaves as
+    a dict keyed by the response field names, so ``result.get("message")``,
+    ``result["success"]`` and ``dict(result)`` keep working. A field whose
+    value is None is treated as absent.
+    
+    Args:
+        success: Whether authentication succeeded
+        message: Human-readable message
+        error_code: KeyMaster error code (errorCode)
+        user_status: Status of the authenticated user (userStatus)
+        expires_at: Entitlement expiry as returned by the server (expiresAt)
+        extra: Any other response fields
+    """
+    
+    __slots__ = ("success", "message", "error_code", "user_status", "expires_at", "extra")
+    
+    def __init__(self, success: Optional[bool] = None, message: Optional[str] = None,
+                 error_code: Optional[str] = None, user_status: Optional[str] = None,
+                 expires_at: Any = None, extra: Optional[Dict[str, Any]] = None):
+        self.success = success
+        self.message = message
+        self.error_code = error_code
+        self.user_status = user_status
+        self.expires_at = expires_at
+        self.extra = extra or None
+    
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "AuthResult":
+        """Build a result from a decoded response or cached dict."""
+        if isinstance(data, AuthResult):
+            return data.copy()
+        get = data.get
+        extra = None
+        if not data.keys() <= _FIELDS:
+            extra = {key: value for key, value in data.items() if key not in _FIELDS}
+        return cls(get("success"), get("message"), get("errorCode"), get("userStatus"),
+                   get("expiresAt"), extra)
+    
+    @classmethod
+    def from_json(cls, data: Union[bytes, str]) -> "AuthResult":
+        """
+        Decode a JSON object into a result.
+        
+        Raises:
+            ValueError: If ``data`` is not a JSON object
+        """
+        decoded = loads(data)
+        if not isinstance(decoded, dict):
+            raise ValueError("Expected a JSON object")
+        return cls.from_dict(decoded)
+    
+    @property
+    def expiry(self) -> Optional[float]:
+        """Entitlement expiry in epoch seconds, or None if the result has none."""
+        for field in EXPIRY_FIELDS:
+            value = parse_expiry(self.get(field))
+            if value is not None:
+                return value
+        return None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+    
+    def copy(self) -> "AuthResult":
+        return AuthResult(self.success, self.message, self.error_code, self.user_status,
+                          self.expires_at, dict(self.extra) if self.extra else None)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            return default if value is None else value
+        extra = self.extra
+        return extra.get(key, default) if extra else default
+    
+    def __getitem__(self, key: str) -> Any:
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if not self.extra:
+            raise KeyError(key)
+        return self.extra[key]
+    
+    def __setitem__(self, key: str, value: Any) -> None:
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            setattr(self, attribute, value)
+        elif self.extra is None:
+            self.extra = {key: value}
+        else:
+            self.extra[key] = value
+    
+    def __delitem__(self, key: str) -> None:
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            if getattr(self, attribute) is None:
+                raise KeyError(key)
+            setattr(self, attribute, None)
+            return
+        if not self.extra:
+            raise KeyError(key)
+        del self.extra[key]
+    
+    def __contains__(self, key: object) -> bool:
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            return getattr(self, attribute) is not None
+        return bool(self.extra) and key in self.extra
+    
+    def __iter__(self) -> Iterator[str]:
+        for key, attribute in _ATTRIBUTES.items():
+            if getattr(self, attribute) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+    
+    def __len__(self) -> int:
+        count = sum(1 for attribute in _ATTRIBUTES.values() if getattr(self, attribute) is not None)
+        return count + (len(self.extra) if self.extra else 0)
+    
+    def __repr__(self) -> str:
+        return f"AuthResult({self.to_dict()!r})"
+    
+    def __getstate__(self):
+        return (self.success, self.message, self.error_code, self.user_status, self.expires_at, self.extra)
+    
+    def __setstate__(self, state) -> None:
+        (self.success, self.message, self.error_code, self.user_status, self.expires_at, self.extra) = state
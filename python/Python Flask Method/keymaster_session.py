@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import hashlib
+import secrets
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from collections.abc import Mapping
+from typing import Dict, Optional, Any
+from itsdangerous import URLSafeSerializer, BadSignature
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within a process
+    fcntl = None
+
+from keymaster_result import EXPIRY_FIELDS, parse_expiry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Session token settings
+SESSION_TOKEN_TTL = int(os.environ.get("SESSION_TOKEN_TTL", "900"))  # seconds a token stays valid
+SESSION_TOKEN_REFRESH = int(os.environ.get("SESSION_TOKEN_REFRESH", "300"))  # reissue tokens older than this
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", "43200"))  # hard limit since the KeyMaster login
+SESSION_TOKEN_SALT = "keymaster-session-token"
+
+# Revocation granularity: "none" (tokens live until they expire), "global" (one
+# epoch invalidates every token, plus logged-out sessions) or "user" (also
+# per-user cut-off times)
+SESSION_REVOCATION = os.environ.get("SESSION_REVOCATION", "global").lower()
+SESSION_REVOCATION_FILE = os.environ.get("SESSION_REVOCATION_FILE")  # shared by all workers (unset = in-process only)
+SESSION_REVOCATION_RELOAD = float(os.environ.get("SESSION_REVOCATION_RELOAD", "5"))  # seconds between file checks
+
+REVOCATION_MODES = ("none", "global", "user")
+
+class InvalidSessionToken(Exception):
+    """Raised when a session token is malformed, tampered with, expired or revoked"""
+    pass
+
+class SessionRevocations:
+    """
+    Revocation state checked on every token verification.
+    
+    State is held in memory. When ``path`` is set, it is a small JSON file
+    shared by all workers; its mtime is polled at most every
+    ``reload_interval`` seconds and the file is re-read only when it changed.
+    Updates hold an exclusive flock on ``<path>.lock`` while they re-read,
+    change and rewrite the file, so concurrent revocations from different
+    workers are never lost.
+    
+    Args:
+        path: JSON file holding {"epoch": int, "users": {username: not_before},
+            "tokens": {jti: expires_at}}
+        reload_interval: Minimum seconds between file checks
+    """
+    
+    def __init__(self, path: Optional[str] = SESSION_REVOCATION_FILE,
+                 reload_interval: float = SESSION_REVOCATION_RELOAD):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._users: Dict[str, float] = {}
+        self._tokens: Dict[str, float] = {}  # revoked session id -> when its last token expires
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        if self.path:
+            self._load()
+    
+    @property
+    def epoch(self) -> int:
+        self._maybe_reload()
+        return self._epoch
+    
+    def not_before(self, username: str) -> float:
+        """Tokens for ``username`` issued before this time (epoch seconds) are revoked."""
+        self._maybe_reload()
+        return self._users.get(username, 0.0)
+    
+    def is_revoked(self, jti: str) -> bool:
+        """Check whether the session ``jti`` was revoked with ``revoke``."""
+        self._maybe_reload()
+        return jti in self._tokens
+    
+    def revoke_all(self) -> int:
+        """
+        Invalidate every outstanding token.
+        
+        Returns:
+            The new epoch
+        """
+        with self._update():
+            self._epoch += 1
+            self._users.clear()  # older cut-offs are covered by the new epoch
+            self._tokens.clear()
+            return self._epoch
+    
+    def revoke_user(self, username: str) -> None:
+        """Invalidate all tokens issued to ``username`` so far."""
+        with self._update():
+            self._users[username] = time.time()
+    
+    def revoke(self, jti: str, expires_at: float) -> None:
+        """
+        Invalidate one session (e.g. on logout).
+        
+        Args:
+            jti: Session id carried by the session's tokens
+            expires_at: Time after which no token of the session can be valid;
+                the entry is dropped once it has passed
+        """
+        with self._update():
+            now = time.time()
+            self._tokens = {key: until for key, until in self._tokens.items() if until > now}
+            self._tokens[jti] = float(expires_at)
+    
+    @contextmanager
+    def _update(self):
+        # Re-read, change and rewrite the state as one step, also across processes
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+            with open(self.path + ".lock", "a+") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load()
+                    yield
+                    self._save()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _maybe_reload(self) -> None:
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._load()
+    
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f_in:
+                mtime = os.fstat(f_in.fileno()).st_mtime
+                data = json.load(f_in)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read session revocation file %s: %s", self.path, e)
+            return
+        self._mtime = mtime
+        self._epoch = int(data.get("epoch", 0))
+        self._users = {str(name): float(cutoff) for name, cutoff in (data.get("users") or {}).items()}
+        self._tokens = {str(jti): float(until) for jti, until in (data.get("tokens") or {}).items()}
+    
+    def _save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".revocations-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f_out:
+                json.dump({"epoch": self._epoch, "users": self._users, "tokens": self._tokens}, f_out)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._mtime = os.stat(self.path).st_mtime
+
+class SessionTokenManager:
+    """
+    Issues and verifies short-lived signed session tokens.
+    
+    A token carries the username, the KeyMaster user status, a session id
+    (``jti``, kept when the token is refreshed) and its own expiry, signed
+    with HMAC-SHA256. Verification is local, so protected routes never call
+    KeyMaster. Tokens older than ``refresh_after``
+    are reissued (sliding window) until ``max_age`` has passed since the
+    original KeyMaster login, after which the user must log in again.
+    
+    Args:
+        secret_key: Signing key (the Flask SECRET_KEY; must be shared by all workers)
+        ttl: Lifetime of a token in seconds
+        refresh_after: Token age in seconds after which a fresh token is issued
+        max_age: Seconds since the KeyMaster login after which refresh stops
+        revocation: "none", "global" or "user"
+        revocations: Revocation state (defaults to SESSION_REVOCATION_FILE)
+    """
+    
+    def __init__(self, secret_key: str, ttl: int = SESSION_TOKEN_TTL,
+                 refresh_after: int = SESSION_TOKEN_REFRESH, max_age: int = SESSION_MAX_AGE,
+                 revocation: str = SESSION_REVOCATION,
+                 revocations: Optional[SessionRevocations] = None):
+        if revocation not in REVOCATION_MODES:
+            raise ValueError(f"revocation must be one of {', '.join(REVOCATION_MODES)}")
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.revocation = revocation
+        self.revocations = revocations or SessionRevocations()
+        self._serializer = URLSafeSerializer(
+            secret_key,
+            salt=SESSION_TOKEN_SALT,
+            signer_kwargs={"digest_method": hashlib.sha256}
+        )
+    
+    def issue(self, username: str, auth_response: Optional[Mapping] = None,
+              login_time: Optional[float] = None) -> str:
+        """
+        Create a token after a successful KeyMaster authentication.
+        
+        Args:
+            username: Authenticated username
+            auth_response: KeyMaster result; userStatus and the entitlement
+                expiry are copied into the token
+            login_time: Time of the KeyMaster login (defaults to now)
+        
+        Returns:
+            Signed, URL-safe token string
+        """
+        auth_response = auth_response or {}
+        now = time.time()
+        entitlement_expiry = None
+        for field in EXPIRY_FIELDS:
+            entitlement_expiry = parse_expiry(auth_response.get(field))
+            if entitlement_expiry is not None:
+                break
+        return self._sign({
+            "sub": username,
+            "st": auth_response.get("userStatus") or auth_response.get("status"),
+            "ent": int(entitlement_expiry) if entitlement_expiry is not None else None,
+            "auth": int(login_time if login_time is not None else now),
+            "jti": secrets.token_urlsafe(12),
+        }, now)
+    
+    def verify(self, token: Optional[str]) -> Dict[str, Any]:
+        """
+        Verify a token without calling KeyMaster.
+        
+        Revocation state is checked in memory; with a revocation file, at
+        most one call every ``SESSION_REVOCATION_RELOAD`` seconds stats the
+        file and re-reads it if it changed.
+        
+        Args:
+            token: Token string from the cookie or Authorization header
+        
+        Returns:
+            Claims dict with sub (username), st (status), ent (entitlement
+            expiry), auth (login time), jti (session id), iat and exp
+        
+        Raises:
+            InvalidSessionToken: If the token is missing, invalid, expired or revoked
+        """
+        if not token:
+            raise InvalidSessionToken("Missing session token")
+        try:
+            claims = self._serializer.loads(token)
+        except BadSignature:
+            raise InvalidSessionToken("Invalid session token")
+        if not isinstance(claims, dict) or "sub" not in claims:
+            raise InvalidSessionToken("Malformed session token")
+        
+        now = time.time()
+        if claims.get("exp", 0) <= now:
+            raise InvalidSessionToken("Session token expired")
+        if self.revocation != "none":
+            if claims.get("ep", 0) != self.revocations.epoch:
+                raise InvalidSessionToken("Session token revoked")
+            if "jti" in claims and self.revocations.is_revoked(claims["jti"]):
+                raise InvalidSessionToken("Session token revoked")
+            # iat and the cut-off are both float epoch seconds, so a token issued
+            # in the same second as (but after) a revocation stays valid
+            if self.revocation == "user" and claims.get("iat", 0) < self.revocations.not_before(claims["sub"]):
+                raise InvalidSessionToken("Session token revoked")
+        return claims
+    
+    def needs_refresh(self, claims: Dict[str, Any]) -> bool:
+        """Check whether a verified token should be replaced by a fresh one."""
+        now = time.time()
+        if now - claims.get("iat", 0) < self.refresh_after:
+            return False
+        if now - claims.get("auth", 0) >= self.max_age:
+            return False
+        entitlement_expiry = claims.get("ent")
+        return entitlement_expiry is None or entitlement_expiry > now
+    
+    def refresh(self, claims: Dict[str, Any]) -> str:
+        """
+        Reissue a verified token with a new expiry, keeping its login time and session id.
+        
+        Returns:
+            New signed token string
+        """
+        return self._sign({
+            "sub": claims["sub"],
+            "st": claims.get("st"),
+            "ent": claims.get("ent"),
+            "auth": claims.get("auth"),
+            "jti": claims.get("jti") or secrets.token_urlsafe(12),
+        }, time.time())
+    
+    def revoke(self, claims: Dict[str, Any]) -> bool:
+        """
+        Revoke the session a verified token belongs to, including tokens it was refreshed into.
+        
+        Tokens issued before session ids existed fall back to revoking the
+        user in "user" mode.
+        
+        Returns:
+            False if revocation is disabled or the token cannot be revoked
+        """
+        if self.revocation == "none":
+            return False
+        if claims.get("jti"):
+            self.revocations.revoke(claims["jti"], self._session_end(claims))
+            return True
+        if self.revocation == "user":
+            self.revocations.revoke_user(claims["sub"])
+            return True
+        return False
+    
+    def _session_end(self, claims: Dict[str, Any]) -> float:
+        # No token of the session can be valid after this time
+        expires = claims["auth"] + self.max_age
+        if claims.get("ent") is not None:
+            expires = min(expires, claims["ent"])
+        return expires
+    
+    def _sign(self, claims: Dict[str, Any], now: float) -> str:
+        expires = min(now + self.ttl, self._session_end(claims))
+        claims["iat"] = now
+        claims["exp"] = expires
+        if self.revocation != "none":
+            claims["ep"] = self.revocations.epoch
+        return self._serializer.dumps(claims)
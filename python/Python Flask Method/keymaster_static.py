@@ -0,0 +1,265 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import mimetypes
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from flask import request, abort, url_for, current_app
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Static asset settings
+STATIC_MAX_AGE = 31536000  # seconds; fingerprinted URLs never change content
+STATIC_UNHASHED_MAX_AGE = int(os.environ.get("STATIC_UNHASHED_MAX_AGE", "300"))  # plain /static/style.css
+PAGE_MAX_AGE = int(os.environ.get("PAGE_MAX_AGE", "60"))  # anonymous login page
+PAGE_VARIANTS = 8  # URL prefixes (SCRIPT_NAME) a cached page is kept for
+HASH_LENGTH = 12
+MIN_COMPRESS_SIZE = 256  # bytes
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MANIFEST_NAME = "manifest.json"
+ETAG_SUFFIXES = {"gzip": "-gz", "br": "-br"}  # compressed variants are different representations
+
+class Asset:
+    """One static file with its fingerprint and precompressed variants."""
+    
+    __slots__ = ("name", "hashed_name", "etag", "mimetype", "body", "encodings")
+    
+    def __init__(self, name: str, body: bytes, mimetype: Optional[str] = None):
+        digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.hashed_name = f"{stem}.{digest}{ext}"
+        self.etag = digest
+        self.mimetype = mimetype or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.body = body
+        self.encodings: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            self.encodings = compress_variants(body)
+    
+    def negotiate(self, accept_encoding: str) -> Tuple[Optional[str], bytes]:
+        """
+        Pick the smallest variant the client accepts.
+        
+        Returns:
+            (Content-Encoding or None, body)
+        """
+        accepted = {token.split(";", 1)[0].strip().lower() for token in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encodings:
+                return encoding, self.encodings[encoding]
+        return None, self.body
+    
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Strong ETag of the variant sent with ``encoding`` (None for the identity body)."""
+        return self.etag + ETAG_SUFFIXES.get(encoding, "") if encoding else self.etag
+
+def compress_variants(body: bytes) -> Dict[str, bytes]:
+    """
+    Precompress a body with gzip (and brotli when installed).
+    
+    Variants that are not smaller than the original are dropped.
+    """
+    variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+
+def _walk(static_dir: str, exclude: Optional[str] = None) -> List[str]:
+    names = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != exclude]
+        for file_name in files:
+            names.append(os.path.relpath(os.path.join(root, file_name), static_dir).replace(os.sep, "/"))
+    return sorted(names)
+
+class AssetTable:
+    """
+    Fingerprinted, precompressed copies of every file in a static folder.
+    
+    Built once at startup (once per server with ``preload_app``), then
+    served from memory.
+    
+    Args:
+        static_dir: Folder to load
+        exclude: Sub-folder to skip (the build output)
+    """
+    
+    def __init__(self, static_dir: str, exclude: Optional[str] = None):
+        self.static_dir = static_dir
+        self._by_name: Dict[str, Asset] = {}
+        self._by_hashed: Dict[str, Asset] = {}
+        if os.path.isdir(static_dir):
+            for name in _walk(static_dir, exclude):
+                with open(os.path.join(static_dir, name), "rb") as f_in:
+                    asset = Asset(name, f_in.read())
+                self._by_name[name] = asset
+                self._by_hashed[asset.hashed_name] = asset
+    
+    def url_name(self, name: str) -> str:
+        """Fingerprinted file name for ``name`` (unchanged if unknown)."""
+        asset = self._by_name.get(name)
+        return asset.hashed_name if asset else name
+    
+    def lookup(self, name: str) -> Tuple[Optional[Asset], bool]:
+        """
+        Find an asset by fingerprinted or plain name.
+        
+        Returns:
+            (asset or None, True if ``name`` was fingerprinted)
+        """
+        asset = self._by_hashed.get(name)
+        if asset is not None:
+            return asset, True
+        return self._by_name.get(name), False
+    
+    def manifest(self) -> Dict[str, str]:
+        return {name: asset.hashed_name for name, asset in self._by_name.items()}
+    
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+def build_static(static_dir: str, output_dir: str) -> Dict[str, str]:
+    """
+    Write fingerprinted and precompressed assets for a web server or CDN.
+    
+    For every file, ``<name>.<hash>.<ext>`` is written along with ``.gz``
+    (and ``.br``) variants, e.g. for nginx ``gzip_static``/``brotli_static``,
+    plus ``manifest.json`` mapping original to fingerprinted names.
+    
+    Returns:
+        The manifest
+    """
+    table = AssetTable(static_dir, exclude=os.path.abspath(output_dir))
+    for name in table.manifest():
+        asset, _ = table.lookup(name)
+        target = os.path.join(output_dir, asset.hashed_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f_out:
+            f_out.write(asset.body)
+        for encoding, data in asset.encodings.items():
+            with open(target + (".gz" if encoding == "gzip" else ".br"), "wb") as f_out:
+                f_out.write(data)
+    manifest = table.manifest()
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f_out:
+        json.dump(manifest, f_out, indent=2, sort_keys=True)
+    return manifest
+
+def _respond(response_class, etag: str, cache_control: str, mimetype: str,
+             encoding: Optional[str], body: bytes, vary: bool):
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+    if vary:
+        headers["Vary"] = "Accept-Encoding"
+    if etag in request.if_none_match:
+        return response_class(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return response_class(body, mimetype=mimetype, headers=headers)
+
+class StaticAssets:
+    """
+    Serves a Flask app's static folder from an AssetTable.
+    
+    Replaces the built-in ``static`` view: fingerprinted URLs are served
+    with ``Cache-Control: immutable`` and a one-year lifetime, plain URLs
+    with a short lifetime; both support ETag/304 and gzip/brotli. Templates
+    get ``asset_url(name)`` for fingerprinted URLs.
+    
+    Args:
+        app: Flask application
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        output_dir = os.path.join(app.static_folder, "dist")
+        self.table = AssetTable(app.static_folder, exclude=os.path.abspath(output_dir))
+        app.view_functions["static"] = self.send
+        app.jinja_env.globals["asset_url"] = self.asset_url
+        logger.debug("Loaded %d static assets", len(self.table))
+    
+    def asset_url(self, name: str) -> str:
+        return url_for("static", filename=self.table.url_name(name))
+    
+    def send(self, filename: str):
+        asset, fingerprinted = self.table.lookup(filename)
+        if asset is None:
+            abort(404)
+        max_age = STATIC_MAX_AGE if fingerprinted else STATIC_UNHASHED_MAX_AGE
+        cache_control = f"public, max-age={max_age}" + (", immutable" if fingerprinted else "")
+        encoding, body = asset.negotiate(request.headers.get("Accept-Encoding", ""))
+        return _respond(self.app.response_class, asset.etag_for(encoding), cache_control,
+                        asset.mimetype, encoding, body, bool(asset.encodings))
+
+class CachedPage:
+    """
+    A page that is the same for every anonymous visitor, rendered once.
+    
+    The rendered HTML and its compressed variants are kept in memory and
+    served with an ETag, so repeat visitors get 304s and shared caches may
+    keep it for ``max_age`` seconds. Its URLs depend on the prefix the app
+    is mounted under (SCRIPT_NAME or X-Forwarded-Prefix), so it is
+    rendered once per ``request.script_root``, for up to ``PAGE_VARIANTS``
+    prefixes.
+    
+    Args:
+        render: Function returning the page HTML (called inside a request)
+        max_age: Cache-Control max-age in seconds
+    """
+    
+    def __init__(self, render: Callable[[], str], max_age: int = PAGE_MAX_AGE):
+        self.render = render
+        self.max_age = max_age
+        self._assets: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+    
+    def _asset(self) -> Asset:
+        script_root = request.script_root
+        asset = self._assets.get(script_root)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.get(script_root)
+                if asset is None:
+                    asset = Asset("page.html", self.render().encode("utf-8"), "text/html")
+                    if len(self._assets) >= PAGE_VARIANTS:
+                        # Prefixes can come from a proxy header: drop the oldest instead of growing
+                        self._assets.pop(next(iter(self._assets)))
+                    self._assets[script_root] = asset
+        return asset
+    
+    def response(self):
+        asset = self._asset()
+        encoding, body = asset.negotiate(request.headers.get("Accept-Encoding", ""))
+        return _respond(current_app.response_class, asset.etag_for(encoding),
+                        f"public, max-age={self.max_age}", "text/html", encoding, body,
+                        bool(asset.encodings))
+    
+    def clear(self) -> None:
+        """Drop the rendered pages (e.g. after a template change)."""
+        self._assets = {}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets.")
+    parser.add_argument("static_dir", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    parser.add_argument("-o", "--output", help="Output directory (default: <static_dir>/dist)")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output_dir = args.output or os.path.join(args.static_dir, "dist")
+    manifest = build_static(args.static_dir, output_dir)
+    for name, hashed_name in manifest.items():
+        logger.info("%s -> %s", name, hashed_name)
+    if brotli is None:
+        logger.info("brotli not installed; wrote gzip variants only")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
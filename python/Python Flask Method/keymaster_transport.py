@@ -0,0 +1,560 @@
+import os
+import time
+import socket
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+try:
+    import httpx
+except ImportError:  # optional: only the http2 transport and the async client need it
+    httpx = None
+
+try:
+    import h2
+except ImportError:  # optional: pip install "httpx[http2]"
+    h2 = None
+
+from keymaster_codec import dumps, loads
+from keymaster_metrics import endpoint_name, UPSTREAM_PHASE_SECONDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Transport used by KeyMasterClient: "requests" (HTTP/1.1, one connection per
+# in-flight call) or "http2" (httpx, concurrent calls multiplexed over one connection)
+TRANSPORT = os.environ.get("KEYMASTER_TRANSPORT", "requests").lower()
+
+TRANSPORT_NAMES = ("requests", "http2")
+
+class TransportError(Exception):
+    """Request failed below HTTP (raised by every transport)"""
+    pass
+
+class TransportTimeout(TransportError):
+    """Request timed out"""
+    pass
+
+class TransportConnectTimeout(TransportTimeout):
+    """Timed out before a connection was established, so the server never saw the request"""
+    pass
+
+class TransportConnectionError(TransportError):
+    """Connection could not be opened or was lost"""
+    pass
+
+class TransportResponse:
+    """
+    Fully read HTTP response returned by a transport.
+    
+    Args:
+        status_code: HTTP status code
+        content: Response body
+        headers: Case-insensitive response headers
+        http_version: Protocol the response arrived over (e.g. "HTTP/2")
+    """
+    
+    __slots__ = ("status_code", "content", "headers", "http_version")
+    
+    def __init__(self, status_code: int, content: bytes, headers, http_version: str = "HTTP/1.1"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.http_version = http_version
+
+class Transport:
+    """
+    Sends serialized KeyMaster requests; KeyMasterClient layers limiting,
+    retries, hedging and the circuit breaker on top.
+    
+    Subclasses implement ``post`` and raise the ``Transport*`` errors above,
+    so the client never sees library-specific exceptions.
+    """
+    
+    name = "base"
+    multiplexed = False  # True if one connection carries any number of concurrent calls
+    
+    def post(self, url: str, body: bytes, timeout: float, endpoint: Optional[str] = None) -> TransportResponse:
+        """
+        Send a POST request.
+        
+        Args:
+            url: API endpoint URL
+            body: Serialized JSON request body
+            timeout: Request timeout in seconds
+            endpoint: Endpoint label for metrics (defaults to the URL's last segment)
+        
+        Returns:
+            TransportResponse
+        
+        Raises:
+            TransportError: If no response was received
+        """
+        raise NotImplementedError
+    
+    def warm_up(self, url: str, timeout: float) -> bool:
+        """
+        Open (or refresh) a keep-alive connection to ``url``'s host with a HEAD request.
+        
+        Returns:
+            True if the server answered, False on any error or if the
+            transport has nothing to warm up
+        """
+        return False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {}
+    
+    def close(self) -> None:
+        pass
+    
+    def _reset_after_fork(self) -> None:
+        pass
+
+class _PooledTransport(Transport):
+    """
+    Transport owning a connection pool that is built lazily per process.
+    
+    The pool is rebuilt automatically in a forked child process (e.g. a
+    gunicorn worker with ``preload_app = True``), so sockets are never
+    shared between processes.
+    """
+    
+    def __init__(self, headers: Optional[Dict[str, str]] = None):
+        self.headers = dict(headers or {})
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid: Optional[int] = None
+        self._rebuilds = 0
+    
+    def _build(self):
+        raise NotImplementedError
+    
+    def _close_pool(self, pool) -> None:
+        pool.close()
+    
+    @property
+    def pool(self):
+        """Connection pool for the current process, rebuilt after fork."""
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    if self._pool is not None:
+                        self._rebuilds += 1
+                    self._pool = self._build()
+                    self._pid = os.getpid()
+        return self._pool
+    
+    def close(self) -> None:
+        """Close all pooled connections owned by this process."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._close_pool(self._pool)
+            self._pool = None
+    
+    def _reset_after_fork(self) -> None:
+        """Drop inherited pool state in a forked child without closing parent sockets."""
+        self._lock = threading.Lock()
+        self._pool = None
+
+# Endpoint label for connection-phase metrics, set by RequestsTransport.post
+_request_context = threading.local()
+
+class _PhaseTimingMixin:
+    """Records DNS, TCP connect and TLS handshake time for new upstream connections."""
+    
+    def _new_conn(self):
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            addresses = []  # let urllib3 resolve and raise its own error
+        resolved = time.perf_counter()
+        
+        # Try each address we just resolved in order, as urllib3 would, so DNS is
+        # only paid once and a dual-stack host still falls back from an unreachable
+        # IPv6 address to IPv4; TLS still uses self.host for SNI and certificates
+        candidates = list(dict.fromkeys(address[4][0] for address in addresses)) or [host]
+        try:
+            for index, candidate in enumerate(candidates):
+                self._dns_host = candidate
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if index == len(candidates) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        connected = time.perf_counter()
+        
+        endpoint = getattr(_request_context, "endpoint", host)
+        UPSTREAM_PHASE_SECONDS.observe(resolved - started, endpoint=endpoint, phase="dns")
+        UPSTREAM_PHASE_SECONDS.observe(connected - resolved, endpoint=endpoint, phase="connect")
+        self._socket_ready_seconds = connected - started
+        return sock
+    
+    def connect(self):
+        self._socket_ready_seconds = None
+        started = time.perf_counter()
+        super().connect()
+        if self._socket_ready_seconds is not None and isinstance(self, HTTPSConnection):
+            tls_seconds = time.perf_counter() - started - self._socket_ready_seconds
+            endpoint = getattr(_request_context, "endpoint", self.host)
+            UPSTREAM_PHASE_SECONDS.observe(max(tls_seconds, 0.0), endpoint=endpoint, phase="tls")
+
+class _TimedHTTPConnection(_PhaseTimingMixin, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_PhaseTimingMixin, HTTPSConnection):
+    pass
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report DNS/connect/TLS timings to keymaster_metrics."""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+class RequestsTransport(_PooledTransport):
+    """
+    HTTP/1.1 transport over a pooled, keep-alive ``requests`` session.
+    
+    Each in-flight call needs its own connection, so concurrent calls open
+    up to ``pool_maxsize`` connections (and TLS handshakes) per host.
+    
+    Args:
+        headers: Default headers sent with every request
+        pool_maxsize: Maximum number of keep-alive connections per host
+        pool_connections: Number of per-host pools to cache
+        pool_block: Block when the pool is exhausted instead of opening
+            extra, non-pooled connections
+    """
+    
+    name = "requests"
+    
+    def __init__(self, headers: Optional[Dict[str, str]] = None, pool_maxsize: int = 10,
+                 pool_connections: int = 4, pool_block: bool = False):
+        super().__init__(headers)
+        self.pool_maxsize = pool_maxsize
+        self.pool_connections = pool_connections
+        self.pool_block = pool_block
+        self._adapter: Optional[HTTPAdapter] = None
+    
+    def _build(self) -> requests.Session:
+        """Create a fresh session and connection pool for the current process."""
+        session = requests.Session()
+        adapter = InstrumentedHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=0  # retries are handled by keymaster_auth._send_request
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        self._adapter = adapter
+        logger.debug("Built KeyMaster HTTP session (pool_maxsize=%s, pid=%s)", self.pool_maxsize, os.getpid())
+        return session
+    
+    @property
+    def session(self) -> requests.Session:
+        """Pooled session for the current process, rebuilt after fork."""
+        return self.pool
+    
+    def post(self, url: str, body: bytes, timeout: float, endpoint: Optional[str] = None) -> TransportResponse:
+        session = self.pool
+        _request_context.endpoint = endpoint or endpoint_name(url)
+        try:
+            response = session.post(url, data=body, timeout=timeout, verify=True)
+        except requests.exceptions.ConnectTimeout as e:
+            raise TransportConnectTimeout(str(e)) from e
+        except requests.exceptions.Timeout as e:
+            raise TransportTimeout(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            raise TransportConnectionError(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise TransportError(str(e)) from e
+        return TransportResponse(response.status_code, response.content, response.headers)
+    
+    def warm_up(self, url: str, timeout: float) -> bool:
+        _request_context.endpoint = "warmup"
+        try:
+            self.pool.head(url, timeout=timeout, allow_redirects=False, verify=True)
+        except requests.exceptions.RequestException as e:
+            logger.debug("KeyMaster warm-up request failed: %s", e)
+            return False
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics for the current process.
+        
+        A pool hit is a request served on an already open keep-alive
+        connection; a pool miss is a request that had to open a new one.
+        """
+        misses = 0
+        pooled_requests = 0
+        if self._pool is not None and self._adapter is not None and self._pid == os.getpid():
+            pools = self._adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    continue
+                misses += getattr(pool, "num_connections", 0)
+                pooled_requests += getattr(pool, "num_requests", 0)
+        return {
+            "pool_hits": max(pooled_requests - misses, 0),
+            "pool_misses": misses,
+            "session_rebuilds": self._rebuilds
+        }
+    
+    def _reset_after_fork(self) -> None:
+        super()._reset_after_fork()
+        self._adapter = None
+
+class PhaseTracer:
+    """
+    httpcore trace hook recording connect (DNS + TCP) and TLS handshake time.
+    
+    Pass it as ``extensions={"trace": tracer}`` to a sync httpx request; use
+    AsyncPhaseTracer with ``httpx.AsyncClient``.
+    
+    Args:
+        endpoint: Endpoint label for metrics
+        on_connect: Called after each new connection is opened
+    """
+    
+    _PHASES = {"connection.connect_tcp": "connect", "connection.start_tls": "tls"}
+    
+    def __init__(self, endpoint: str, on_connect: Optional[Callable[[], None]] = None):
+        self.endpoint = endpoint
+        self.on_connect = on_connect
+        self._started: Dict[str, float] = {}
+    
+    def _record(self, event_name: str) -> None:
+        prefix, _, stage = event_name.rpartition(".")
+        phase = self._PHASES.get(prefix)
+        if phase is None:
+            return
+        if stage == "started":
+            self._started[phase] = time.perf_counter()
+        elif stage == "complete" and phase in self._started:
+            UPSTREAM_PHASE_SECONDS.observe(time.perf_counter() - self._started.pop(phase),
+                                           endpoint=self.endpoint, phase=phase)
+            if phase == "connect" and self.on_connect is not None:
+                self.on_connect()
+    
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._record(event_name)
+
+class AsyncPhaseTracer(PhaseTracer):
+    """PhaseTracer for ``httpx.AsyncClient``, whose trace hooks are awaited."""
+    
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._record(event_name)
+
+def transport_error_from_httpx(error: Exception) -> TransportError:
+    """
+    Map an httpx exception to the matching ``Transport*`` error.
+    
+    Used by HTTP2Transport and the async client, so both report failures
+    the same way.
+    """
+    if isinstance(error, httpx.ConnectTimeout):
+        return TransportConnectTimeout(str(error))
+    if isinstance(error, httpx.TimeoutException):
+        return TransportTimeout(str(error))
+    if isinstance(error, (httpx.NetworkError, httpx.RemoteProtocolError)):
+        # RemoteProtocolError covers an HTTP/2 connection closed by GOAWAY
+        return TransportConnectionError(str(error))
+    return TransportError(str(error))
+
+class HTTP2Transport(_PooledTransport):
+    """
+    HTTP/2 transport over a shared ``httpx.Client``.
+    
+    Concurrent calls to the same host are multiplexed as streams over one
+    connection, so a burst of validations pays for a single TLS handshake
+    instead of one per call. HTTP/2 is negotiated per connection via ALPN:
+    servers that do not offer it, and plain ``http://`` URLs, are served
+    over HTTP/1.1 by the same client. Without the optional ``h2`` package
+    every request falls back to HTTP/1.1.
+    
+    Args:
+        headers: Default headers sent with every request
+        max_connections: Maximum connections per pool; HTTP/2 only opens
+            more than one when the server's stream limit is reached
+        max_keepalive_connections: Idle connections kept open for reuse
+    """
+    
+    name = "http2"
+    multiplexed = True
+    
+    def __init__(self, headers: Optional[Dict[str, str]] = None, max_connections: int = 10,
+                 max_keepalive_connections: Optional[int] = None):
+        if httpx is None:
+            raise ImportError("The http2 transport requires httpx (pip install 'httpx[http2]')")
+        super().__init__(headers)
+        # HTTP/1-only hop-by-hop header; not allowed on HTTP/2 connections
+        self.headers.pop("Connection", None)
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections or max_connections
+        self.http2 = h2 is not None
+        self._requests = 0
+        self._connections = 0
+        self._versions: Dict[str, int] = {}
+        if not self.http2:
+            logger.warning("KEYMASTER_TRANSPORT=http2 but h2 is not installed; using HTTP/1.1 (pip install 'httpx[http2]')")
+    
+    def _build(self) -> "httpx.Client":
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections
+        )
+        logger.debug("Built KeyMaster HTTP/2 client (http2=%s, pid=%s)", self.http2, os.getpid())
+        return httpx.Client(http2=self.http2, headers=self.headers, limits=limits, verify=True)
+    
+    def _connection_opened(self) -> None:
+        with self._lock:
+            self._connections += 1
+    
+    def post(self, url: str, body: bytes, timeout: float, endpoint: Optional[str] = None) -> TransportResponse:
+        client = self.pool
+        tracer = PhaseTracer(endpoint or endpoint_name(url), self._connection_opened)
+        try:
+            response = client.post(url, content=body, timeout=timeout, extensions={"trace": tracer})
+        except httpx.HTTPError as e:
+            raise transport_error_from_httpx(e) from e
+        version = response.http_version
+        with self._lock:
+            self._requests += 1
+            self._versions[version] = self._versions.get(version, 0) + 1
+        return TransportResponse(response.status_code, response.content, response.headers, version)
+    
+    def warm_up(self, url: str, timeout: float) -> bool:
+        try:
+            self.pool.head(url, timeout=timeout, extensions={"trace": PhaseTracer("warmup", self._connection_opened)})
+        except httpx.HTTPError as e:
+            logger.debug("KeyMaster warm-up request failed: %s", e)
+            return False
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get connection statistics for the current process.
+        
+        Pool hits and misses have the same meaning as for RequestsTransport;
+        ``http_versions`` counts responses per negotiated protocol.
+        """
+        with self._lock:
+            return {
+                "pool_hits": max(self._requests - self._connections, 0),
+                "pool_misses": self._connections,
+                "session_rebuilds": self._rebuilds,
+                "http_versions": dict(self._versions)
+            }
+    
+    def _reset_after_fork(self) -> None:
+        super()._reset_after_fork()
+        self._requests = 0
+        self._connections = 0
+        self._versions = {}
+
+def _accept_all(url: str, payload: Any) -> Dict[str, Any]:
+    return {"success": True, "message": "Authenticated (in-memory transport)", "userStatus": "active"}
+
+class InMemoryTransport(Transport):
+    """
+    Transport that answers requests in-process, for offline tests and demos.
+    
+    Example:
+        transport = InMemoryTransport(lambda url, payload: (401, {"success": False, "message": "Invalid key"}))
+        client = KeyMasterClient(transport=transport)
+    
+    Args:
+        handler: Called as ``handler(url, payload)`` with the decoded request
+            body. Returns a response dict, or ``(status_code, body)`` /
+            ``(status_code, body, headers)`` where body is a dict or bytes.
+            It may raise the ``Transport*`` errors to simulate network
+            failures. Defaults to accepting every request.
+        latency: Seconds to wait before answering; a request whose timeout is
+            shorter raises TransportTimeout
+        history: Number of recent ``(url, payload)`` requests kept in ``requests``
+    """
+    
+    name = "memory"
+    
+    def __init__(self, handler: Optional[Callable[[str, Any], Any]] = None,
+                 latency: float = 0.0, history: int = 100):
+        self.handler = handler or _accept_all
+        self.latency = latency
+        self.requests: "deque[Tuple[str, Any]]" = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._count = 0
+    
+    def post(self, url: str, body: bytes, timeout: float, endpoint: Optional[str] = None) -> TransportResponse:
+        payload = loads(body)
+        with self._lock:
+            self._count += 1
+            self.requests.append((url, payload))
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+            if self.latency > timeout:
+                raise TransportTimeout(f"In-memory request timed out after {timeout}s")
+        
+        answer = self.handler(url, payload)
+        status_code, headers = 200, {}
+        if isinstance(answer, tuple):
+            status_code, answer, headers = (answer + ({},))[:3]
+        content = answer if isinstance(answer, bytes) else dumps(answer)
+        return TransportResponse(status_code, content, CaseInsensitiveDict(headers))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"requests_answered": self._count}
+
+def create_transport(name: str = TRANSPORT, headers: Optional[Dict[str, str]] = None,
+                     pool_maxsize: int = 10, pool_connections: int = 4,
+                     pool_block: bool = False) -> Transport:
+    """
+    Build a network transport by name.
+    
+    Args:
+        name: "requests" or "http2"
+        headers: Default headers sent with every request
+        pool_maxsize: Keep-alive connections per host
+        pool_connections: Number of per-host pools to cache (requests only)
+        pool_block: Block when the pool is exhausted (requests only)
+    
+    Returns:
+        Transport instance
+    """
+    if name not in TRANSPORT_NAMES:
+        raise ValueError(f"Transport must be one of {', '.join(TRANSPORT_NAMES)}")
+    if name == "http2" and httpx is None:
+        logger.warning("KEYMASTER_TRANSPORT=http2 but httpx is not installed; using requests (pip install 'httpx[http2]')")
+        name = "requests"
+    if name == "http2":
+        return HTTP2Transport(headers, max_connections=pool_maxsize)
+    return RequestsTransport(headers, pool_maxsize=pool_maxsize,
+                             pool_connections=pool_connections, pool_block=pool_block)
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Module settings are read at import time: keep every file the modules write
+# (HWID, caches, logs, rate limit buckets) in a scratch directory
+_scratch = tempfile.mkdtemp(prefix="keymaster-tests-")
+os.environ.update({
+    "KEYMASTER_ACCOUNT_UID": "test-account",
+    "SECRET_KEY": "test-secret-key",
+    "LOG_FILE": "",
+    "LOG_LEVEL": "WARNING",
+    "XDG_CONFIG_HOME": os.path.join(_scratch, "config"),
+    "XDG_CACHE_HOME": os.path.join(_scratch, "cache"),
+    "KEYMASTER_CACHE_BACKEND": "memory",
+    "KEYMASTER_HOST_MAX_IN_FLIGHT": "0",
+    "KEYMASTER_HEDGE": "0",
+    "PROFILE_SAMPLE_RATE": "0",
+})
+for name in ("KEYMASTER_METRICS_DIR", "KEYMASTER_LOG_SHARED_QUEUE", "KEYMASTER_RATELIMIT_DB",
+             "SESSION_REVOCATION_FILE", "PROFILE_TOKEN"):
+    os.environ.pop(name, None)
+
+from keymaster_auth import KeyMasterClient, RetryPolicy, CircuitBreaker, HedgePolicy, UpstreamLimiter
+from keymaster_transport import InMemoryTransport
+
+@pytest.fixture
+def make_client():
+    """
+    Build a KeyMasterClient on an InMemoryTransport with its own limiter,
+    breaker and policies, so tests never share state or touch the network.
+    
+    Example:
+        client = make_client(handler, latency=0.1, max_in_flight=2)
+    """
+    clients = []
+    
+    def factory(handler=None, latency=0.0, max_in_flight=10, queue_timeout=1.0,
+                max_attempts=1, hedging=False, hedge_policy=None):
+        client = KeyMasterClient(
+            transport=InMemoryTransport(handler, latency=latency),
+            limiter=UpstreamLimiter(max_in_flight=max_in_flight, queue_timeout=queue_timeout),
+            retry_policy=RetryPolicy(max_attempts=max_attempts, base_delay=0.01, jitter=False),
+            breaker=CircuitBreaker(),
+            hedging=hedging,
+            hedge_policy=hedge_policy or HedgePolicy(),
+        )
+        clients.append(client)
+        return client
+    
+    yield factory
+    for client in clients:
+        client.close()
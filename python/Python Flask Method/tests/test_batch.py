@@ -0,0 +1,28 @@
+import io
+
+from keymaster_batch import _read_records, validate_licenses
+
+def test_read_records_skips_lines_that_are_not_records(caplog):
+    stream = io.StringIO('{"license_key": "K-1"}\n5\n"K-2"\nnot json\n\n["K-3", "H-3"]\nnull\n')
+    assert list(_read_records(stream, "jsonl")) == [{"license_key": "K-1"}, ["K-3", "H-3"]]
+    assert [record.getMessage() for record in caplog.records] == [
+        "Skipping line 2: expected a JSON object or array, got int",
+        "Skipping line 3: expected a JSON object or array, got str",
+        "Skipping invalid JSON on line 4",
+        "Skipping line 7: expected a JSON object or array, got NoneType",
+    ]
+
+def test_read_records_csv():
+    stream = io.StringIO("license_key,hwid\nK-1,H-1\n")
+    assert list(_read_records(stream, "csv")) == [{"license_key": "K-1", "hwid": "H-1"}]
+
+def test_batch_survives_bad_lines_and_deduplicates(make_client):
+    client = make_client(lambda url, payload: {"success": payload["licenseKey"] != "K-BAD"})
+    stream = io.StringIO('{"license_key": "k-1", "hwid": "H"}\n5\n["K-1", "H"]\n{"licenseKey": "K-BAD", "hwid": "H"}\n')
+    rows = sorted(validate_licenses(_read_records(stream, "jsonl"), "account", default_app_version="1.0",
+                                    client=client, use_cache=False), key=lambda row: row["index"])
+    
+    assert [row["index"] for row in rows] == [0, 1, 2]
+    assert [row["result"]["success"] for row in rows] == [True, True, False]
+    assert [row["deduplicated"] for row in rows] == [False, True, False]
+    assert client.transport.stats()["requests_answered"] == 2
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import stat
+
+import pytest
+
+from keymaster_cache import (AuthResultCache, InsecureCacheFileError, SQLiteAuthResultCache,
+                             make_license_cache_key)
+
+KEY = make_license_cache_key("account", " abcd-1234 ", "HWID-1", "1.0.0")
+GRANTED = {"success": True, "message": "ok", "expiresAt": "2099-01-01T00:00:00Z"}
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "keymaster" / "auth_cache.db")
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_make_license_cache_key_normalizes_the_request():
+    assert KEY == ("account", "ABCD-1234", "HWID-1", "1.0.0", "")
+    assert make_license_cache_key("account", "abcd-1234", "HWID-1", "1.0.0", "bob")[4] == "bob"
+
+def test_memory_cache_only_keeps_cacheable_results():
+    cache = AuthResultCache(maxsize=10, ttl=60, negative_ttl=30)
+    assert cache.put(KEY, GRANTED)
+    assert not cache.put(KEY, {"success": False, "errorCode": "TIMEOUT_ERROR"})
+    assert not cache.put(KEY, {"success": False, "errorCode": "HTTP_503"})
+    assert cache.get(KEY)["message"] == "ok"
+
+def test_sqlite_cache_roundtrip(cache_path):
+    cache = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret=None)
+    assert cache.get(KEY) is None
+    assert cache.put(KEY, GRANTED)
+    
+    # Another worker on the host reads the same entry
+    other = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret=None)
+    result = other.get(KEY)
+    assert result["success"] is True and result["expiresAt"] == GRANTED["expiresAt"]
+    assert other.stats()["hits"] == 1
+    
+    assert other.invalidate_license_key("abcd-1234") == 1
+    assert cache.get(KEY) is None
+
+def test_sqlite_cache_files_are_private(cache_path):
+    cache = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret=None)
+    cache.put(KEY, GRANTED)
+    assert mode(os.path.dirname(cache_path)) & 0o077 == 0
+    assert mode(cache_path) == 0o600
+    assert mode(cache_path + ".key") == 0o600
+    assert mode(cache_path + "-wal") & 0o077 == 0
+
+def test_sqlite_cache_does_not_store_license_keys(cache_path):
+    cache = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret="s3cret")
+    cache.put(KEY, GRANTED)
+    conn = sqlite3.connect(cache_path)
+    try:
+        cache_key, license_key = conn.execute("SELECT cache_key, license_key FROM signed_results").fetchone()
+    finally:
+        conn.close()
+    assert "ABCD-1234" not in cache_key and "ABCD-1234" not in license_key
+
+def test_sqlite_cache_discards_tampered_rows(cache_path):
+    cache = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret="s3cret")
+    cache.put(KEY, {"success": False, "errorCode": "INVALID_KEY", "message": "Invalid license"})
+    conn = sqlite3.connect(cache_path)
+    try:
+        conn.execute("UPDATE signed_results SET result = ?",
+                     (b'{"success": true, "message": "Invalid license"}',))
+        conn.commit()
+    finally:
+        conn.close()
+    assert cache.get(KEY) is None
+    
+    # Rows signed with another key are rejected as well
+    cache.put(KEY, GRANTED)
+    forged = SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, negative_ttl=30, secret="other")
+    assert forged.get(KEY) is None
+
+def test_sqlite_cache_refuses_a_world_writable_directory(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    with pytest.raises(InsecureCacheFileError):
+        SQLiteAuthResultCache(str(shared / "auth_cache.db"), maxsize=10, ttl=60, secret=None)
+
+def test_sqlite_cache_tightens_an_existing_loose_file(cache_path):
+    os.makedirs(os.path.dirname(cache_path), mode=0o700)
+    with open(cache_path, "w"):
+        pass
+    os.chmod(cache_path, 0o666)
+    SQLiteAuthResultCache(cache_path, maxsize=10, ttl=60, secret="s3cret")
+    assert mode(cache_path) == 0o600
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+import keymaster_auth
+from keymaster_auth import SingleFlight, _send_request
+
+API_URL = "https://keymaster.test/api/authenticate-key"
+PAYLOAD = {"licenseKey": "K-1", "hwid": "H-1"}
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    """A fresh coalescer, so stats only count this test's calls."""
+    coalescer = SingleFlight("test")
+    monkeypatch.setattr(keymaster_auth, "request_coalescer", coalescer)
+    return coalescer
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.001)
+
+def run_concurrently(*calls):
+    """Start one thread per call; returns the threads and a list collecting their results."""
+    results = []
+    threads = [threading.Thread(target=lambda call=call: results.append(call())) for call in calls]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+def test_identical_requests_on_one_client_share_one_upstream_call(make_client, coalescer):
+    release = threading.Event()
+    
+    def handler(url, payload):
+        release.wait(5)
+        return {"success": True, "licenseKey": payload["licenseKey"]}
+    
+    client = make_client(handler)
+    threads, results = run_concurrently(*[lambda: _send_request(API_URL, PAYLOAD, client)] * 5)
+    wait_for(lambda: coalescer.stats()["coalesced_calls"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert client.transport.stats()["requests_answered"] == 1
+    assert coalescer.stats() == {"upstream_calls": 1, "coalesced_calls": 4, "in_flight": 0}
+    assert [result["licenseKey"] for result in results] == ["K-1"] * 5
+    # Every caller gets its own copy of the result
+    assert len({id(result) for result in results}) == 5
+
+def test_identical_requests_on_different_clients_are_not_coalesced(make_client, coalescer):
+    release = threading.Event()
+    
+    def handler_for(name):
+        def handler(url, payload):
+            release.wait(5)
+            return {"success": True, "client": name}
+        return handler
+    
+    first = make_client(handler_for("first"))
+    second = make_client(handler_for("second"))
+    threads, results = run_concurrently(lambda: _send_request(API_URL, PAYLOAD, first),
+                                         lambda: _send_request(API_URL, PAYLOAD, second))
+    wait_for(lambda: coalescer.stats()["in_flight"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert sorted(result["client"] for result in results) == ["first", "second"]
+    assert first.transport.stats()["requests_answered"] == 1
+    assert second.transport.stats()["requests_answered"] == 1
+    assert coalescer.stats()["coalesced_calls"] == 0
+
+def test_make_key_depends_on_client_and_body():
+    first, second = object(), object()
+    assert SingleFlight.make_key(API_URL, b"{}", first) == SingleFlight.make_key(API_URL, "{}", first)
+    assert SingleFlight.make_key(API_URL, b"{}", first) != SingleFlight.make_key(API_URL, b"{}", second)
+    assert SingleFlight.make_key(API_URL, b"{}", first) != SingleFlight.make_key(API_URL, b"[]", first)
+    assert "licenseKey" not in SingleFlight.make_key(API_URL, b'{"licenseKey": "K-1"}', first)
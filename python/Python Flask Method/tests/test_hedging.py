@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import keymaster_async
+from keymaster_auth import HedgePolicy, RetryPolicy, _send_request, endpoint_name
+from keymaster_metrics import HEDGES_TOTAL
+
+API_URL = "https://keymaster.test/api/authenticate-key"
+
+@pytest.fixture
+def slow_first_attempt():
+    """
+    Handler whose first attempt per license key stalls until
+    ``handler.release`` is set (at the latest when the test ends); later
+    attempts (the hedges) answer right away.
+    """
+    lock = threading.Lock()
+    seen = {}
+    release = threading.Event()
+    
+    def handler(url, payload):
+        with lock:
+            attempt = seen[payload["licenseKey"]] = seen.get(payload["licenseKey"], 0) + 1
+        if attempt == 1:
+            release.wait(5)
+        return {"success": True, "attempt": attempt}
+    
+    handler.release = release
+    yield handler
+    release.set()
+
+def hedge_policy(**overrides):
+    settings = {"initial_delay": 0.02, "min_delay": 0.01, "budget": 1.0, "burst": 10}
+    settings.update(overrides)
+    return HedgePolicy(**settings)
+
+def test_hedge_answers_a_stalled_attempt(make_client, slow_first_attempt):
+    policy = hedge_policy()
+    client = make_client(slow_first_attempt, hedging=True, hedge_policy=policy, queue_timeout=0)
+    started = time.perf_counter()
+    result = _send_request(API_URL, {"licenseKey": "K-1"}, client, timeout=3)
+    
+    assert result["attempt"] == 2
+    assert time.perf_counter() - started < 1
+    stats = policy.stats()
+    assert stats["calls"] == 1 and stats["hedged"] == 1 and stats["won"] == 1
+
+def test_fast_attempts_are_not_hedged(make_client):
+    policy = hedge_policy(initial_delay=1)
+    client = make_client(lambda url, payload: {"success": True}, hedging=True, hedge_policy=policy)
+    for n in range(5):
+        assert _send_request(API_URL, {"licenseKey": f"K-{n}"}, client, timeout=3)["success"]
+    assert policy.stats()["hedged"] == 0
+    assert client.transport.stats()["requests_answered"] == 5
+
+def test_budget_caps_hedges(make_client, slow_first_attempt):
+    # One hedge in the bucket and no budget earned per call
+    policy = hedge_policy(budget=0, burst=1)
+    client = make_client(slow_first_attempt, hedging=True, hedge_policy=policy, queue_timeout=0)
+    assert _send_request(API_URL, {"licenseKey": "K-1"}, client, timeout=3)["attempt"] == 2
+    
+    # The next stalled attempt is not hedged and waits for the original request
+    caller = threading.Thread(target=_send_request, args=(API_URL, {"licenseKey": "K-2"}, client),
+                              kwargs={"timeout": 3})
+    caller.start()
+    time.sleep(0.1)
+    slow_first_attempt.release.set()
+    caller.join()
+    stats = policy.stats()
+    assert stats["calls"] == 2
+    assert stats["hedged"] == 1
+    assert stats["budget_denied"] == 1
+
+def test_hedge_without_a_free_slot_is_refunded(make_client, slow_first_attempt):
+    policy = hedge_policy()
+    client = make_client(slow_first_attempt, hedging=True, hedge_policy=policy, max_in_flight=1,
+                         queue_timeout=0.5)
+    caller = threading.Thread(target=_send_request, args=(API_URL, {"licenseKey": "K-1"}, client),
+                              kwargs={"timeout": 3})
+    caller.start()
+    time.sleep(0.1)
+    slow_first_attempt.release.set()
+    caller.join()
+    stats = policy.stats()
+    assert stats["hedged"] == 0
+    assert stats["budget_denied"] == 0
+    # Only the original request was sent
+    assert client.transport.stats()["requests_answered"] == 1
+
+def hedge_outcomes():
+    """Current HEDGES_TOTAL counts by outcome for API_URL."""
+    endpoint = endpoint_name(API_URL)
+    return {outcome: HEDGES_TOTAL._values.get(HEDGES_TOTAL._key({"endpoint": endpoint, "outcome": outcome}), 0)
+            for outcome in ("sent", "busy", "won", "budget")}
+
+class MockAsyncClient(keymaster_async.AsyncKeyMasterClient):
+    """Async client whose requests are answered by ``handler(attempt)`` through httpx.MockTransport."""
+    
+    def __init__(self, handler, **settings):
+        super().__init__(retry_policy=RetryPolicy(max_attempts=1), hedging=True, **settings)
+        self.attempts = 0
+        
+        async def respond(request):
+            self.attempts += 1
+            return httpx.Response(200, json=await handler(self.attempts))
+        
+        self._respond = respond
+    
+    def _build_client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self._respond))
+
+async def stall_first_attempt(attempt):
+    if attempt == 1:
+        await asyncio.sleep(5)
+    return {"success": True, "attempt": attempt}
+
+def test_async_hedge_answers_a_stalled_attempt():
+    policy = hedge_policy()
+    before = hedge_outcomes()
+    
+    async def main():
+        client = MockAsyncClient(stall_first_attempt, hedge_policy=policy,
+                                 limiter=keymaster_async.AsyncUpstreamLimiter(max_in_flight=2, queue_timeout=1))
+        try:
+            return await keymaster_async._send_request(API_URL, {"licenseKey": "K-1"}, client)
+        finally:
+            await client.aclose()
+    
+    started = time.perf_counter()
+    assert asyncio.run(main())["attempt"] == 2
+    assert time.perf_counter() - started < 1
+    assert policy.stats()["won"] == 1
+    after = hedge_outcomes()
+    assert after["sent"] - before["sent"] == 1
+    assert after["won"] - before["won"] == 1
+
+def test_async_hedge_without_a_free_slot_is_refunded():
+    policy = hedge_policy()
+    before = hedge_outcomes()
+    
+    async def stall_briefly(attempt):
+        await asyncio.sleep(0.1)
+        return {"success": True, "attempt": attempt}
+    
+    async def main():
+        # The hedge must not wait for the primary's slot, even though the limiter would
+        client = MockAsyncClient(stall_briefly, hedge_policy=policy,
+                                 limiter=keymaster_async.AsyncUpstreamLimiter(max_in_flight=1, queue_timeout=1))
+        try:
+            result = await keymaster_async._send_request(API_URL, {"licenseKey": "K-1"}, client)
+            return result, client.attempts
+        finally:
+            await client.aclose()
+    
+    result, attempts = asyncio.run(main())
+    assert result["attempt"] == 1 and attempts == 1
+    stats = policy.stats()
+    assert stats["hedged"] == 0 and stats["budget_denied"] == 0
+    after = hedge_outcomes()
+    assert after["busy"] - before["busy"] == 1
+    assert after["sent"] == before["sent"]
@@ -0,0 +1,132 @@
+import os
+import stat
+
+import pytest
+
+import app as app_module
+import keymaster_ratelimit
+from keymaster_cache import InsecureCacheFileError
+from keymaster_auth import UpstreamBusyError, UpstreamLimiter
+from keymaster_ratelimit import (HostConcurrencyLimit, MemoryBucketStore, RateLimiter, SQLiteBucketStore,
+                                 parse_limit)
+
+class RecordingStore(MemoryBucketStore):
+    """Memory store that remembers which buckets were spent from."""
+    
+    def __init__(self):
+        super().__init__()
+        self.keys = []
+    
+    def take(self, key, burst, rate, cost=1.0):
+        self.keys.append(key)
+        return super().take(key, burst, rate, cost)
+
+def test_parse_limit():
+    assert parse_limit("20/60") == (20.0, 20.0 / 60)
+    assert parse_limit("5") == (5.0, 5.0)
+    for disabled in (None, "", "0", "off", "0/60"):
+        assert parse_limit(disabled) is None
+
+def test_host_limit_hands_out_distinct_slots(tmp_path):
+    limit = HostConcurrencyLimit(2, directory=str(tmp_path))
+    first = limit.acquire(timeout=0)
+    second = limit.acquire(timeout=0)
+    assert {first, second} == {0, 1}
+    assert limit.acquire(timeout=0) is None
+    
+    # Releasing one handle frees exactly that slot
+    limit.release(first)
+    assert limit.acquire(timeout=0) == first
+    limit.release(first)
+    limit.release(second)
+
+def test_host_limit_is_shared_through_the_lock_files(tmp_path):
+    # Separate instances open their own file descriptions, like separate workers
+    worker_a = HostConcurrencyLimit(1, directory=str(tmp_path))
+    worker_b = HostConcurrencyLimit(1, directory=str(tmp_path))
+    slot = worker_a.acquire(timeout=0)
+    assert slot == 0
+    assert worker_b.acquire(timeout=0.02) is None
+    worker_a.release(slot)
+    assert worker_b.acquire(timeout=0) == 0
+
+def test_host_limit_files_are_private(tmp_path):
+    directory = tmp_path / "slots"
+    limit = HostConcurrencyLimit(2, directory=str(directory))
+    limit.release(limit.acquire(timeout=0))
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    for index in range(2):
+        assert stat.S_IMODE(os.stat(directory / f"slot-{index}.lock").st_mode) == 0o600
+
+def test_host_limit_refuses_a_world_writable_directory(tmp_path, monkeypatch, caplog):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    with pytest.raises(InsecureCacheFileError):
+        HostConcurrencyLimit(1, directory=str(shared)).acquire(timeout=0)
+    
+    monkeypatch.setattr(keymaster_ratelimit, "HOST_MAX_IN_FLIGHT", 4)
+    monkeypatch.setattr(keymaster_ratelimit, "HOST_SLOTS_DIR", str(shared))
+    assert keymaster_ratelimit.default_host_limit() is None
+    assert "host-wide limit disabled" in caplog.text
+    monkeypatch.setattr(keymaster_ratelimit, "HOST_SLOTS_DIR", str(tmp_path / "private"))
+    assert isinstance(keymaster_ratelimit.default_host_limit(), HostConcurrencyLimit)
+
+def test_nested_limiter_contexts_release_their_own_host_slots(tmp_path):
+    host_limit = HostConcurrencyLimit(2, directory=str(tmp_path))
+    limiter = UpstreamLimiter(max_in_flight=5, queue_timeout=0.02, host_limit=host_limit)
+    with limiter:
+        with limiter:
+            assert host_limit._held == {0, 1}
+            with pytest.raises(UpstreamBusyError):
+                limiter.acquire()
+        assert len(host_limit._held) == 1
+    assert host_limit._held == set()
+    assert limiter.stats()["in_flight"] == 0
+
+def test_rate_limiter_rejects_after_the_burst():
+    limiter = RateLimiter({"ip": (2, 0.001), "username": None}, store=MemoryBucketStore())
+    assert limiter.limits.keys() == {"ip"}
+    assert limiter.check(ip="10.0.0.1") == (None, 0.0)
+    assert limiter.check(ip="10.0.0.1") == (None, 0.0)
+    scope, wait = limiter.check(ip="10.0.0.1")
+    assert scope == "ip" and wait > 0
+    # Other identities and unlimited scopes are unaffected
+    assert limiter.check(ip="10.0.0.2") == (None, 0.0)
+    assert limiter.check(username="bob") == (None, 0.0)
+
+def test_sqlite_buckets_are_shared_between_limiters(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    worker_a = RateLimiter({"username": (1, 0.001)}, store=SQLiteBucketStore(path))
+    worker_b = RateLimiter({"username": (1, 0.001)}, store=SQLiteBucketStore(path))
+    assert worker_a.check(username="Bob") == (None, 0.0)
+    assert worker_b.check(username=" bob ")[0] == "username"
+
+def test_login_checks_the_ip_bucket_before_reading_the_form(monkeypatch):
+    store = RecordingStore()
+    monkeypatch.setattr(app_module, "auth_rate_limiter",
+                        RateLimiter({"ip": (1, 0.001), "username": (10, 0.001)}, store=store))
+    form_reads = []
+    
+    class RecordingRequest(app_module.app.request_class):
+        @property
+        def form(self):
+            form_reads.append(self.path)
+            return super().form
+    
+    monkeypatch.setattr(app_module.app, "request_class", RecordingRequest)
+    monkeypatch.setattr(app_module, "authenticate_client_user",
+                        lambda *args: {"success": False, "message": "Invalid credentials"})
+    
+    client = app_module.app.test_client()
+    client.post("/auth", data={"username": "bob", "password": "secret"})
+    assert form_reads
+    assert [key.split(":")[0] for key in store.keys] == ["ip", "username"]
+    
+    store.keys.clear()
+    form_reads.clear()
+    response = client.post("/auth", data={"username": "bob", "password": "secret"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert [key.split(":")[0] for key in store.keys] == ["ip"]
+    assert form_reads == []
@@ -0,0 +1,92 @@
+import pickle
+
+import pytest
+
+import keymaster_codec
+from keymaster_auth import NetworkError, parse_response
+from keymaster_codec import OrjsonCodec, StdlibJsonCodec, create_codec, dumps, loads
+from keymaster_result import AuthResult, parse_expiry
+
+@pytest.fixture(params=["json", "orjson"])
+def codec(request):
+    """Run a test once per codec (orjson only when it is installed)."""
+    if request.param == "orjson" and keymaster_codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    previous = keymaster_codec.codec
+    keymaster_codec.set_codec(create_codec(request.param))
+    yield keymaster_codec.codec
+    keymaster_codec.set_codec(previous)
+
+def test_create_codec_by_name():
+    assert isinstance(create_codec("json"), StdlibJsonCodec)
+    if keymaster_codec.orjson is not None:
+        assert isinstance(create_codec("orjson"), OrjsonCodec)
+    with pytest.raises(ValueError):
+        create_codec("yaml")
+
+def test_codec_roundtrip(codec):
+    result = AuthResult(True, "Authenticated", user_status="active", extra={"plan": "pro"})
+    body = dumps({"result": result, "key": "ABCD"})
+    assert isinstance(body, bytes)
+    decoded = loads(body)
+    assert decoded == {"result": {"success": True, "message": "Authenticated", "userStatus": "active",
+                                  "plan": "pro"}, "key": "ABCD"}
+    assert loads(body.decode("utf-8")) == decoded
+    with pytest.raises(ValueError):
+        loads(b"<html>")
+
+def test_auth_result_behaves_like_a_dict():
+    result = AuthResult.from_dict({"success": True, "message": "ok", "expiresAt": 1700000000, "seats": 3})
+    assert result["success"] is True and result.success is True
+    assert result.get("errorCode") is None and "errorCode" not in result
+    assert result.get("errorCode", "none") == "none"
+    with pytest.raises(KeyError):
+        result["errorCode"]
+    assert result["seats"] == 3 and result.extra == {"seats": 3}
+    assert dict(result) == {"success": True, "message": "ok", "expiresAt": 1700000000, "seats": 3}
+    assert len(result) == 4
+    
+    result["errorCode"] = "EXPIRED"
+    result["note"] = "x"
+    del result["message"]
+    assert result.to_dict() == {"success": True, "errorCode": "EXPIRED", "expiresAt": 1700000000,
+                                "seats": 3, "note": "x"}
+    assert result == result.to_dict()
+
+def test_auth_result_copies_are_independent():
+    result = AuthResult(True, "ok", extra={"seats": 3})
+    copy = result.copy()
+    copy["seats"] = 4
+    copy["message"] = "changed"
+    assert result["seats"] == 3 and result["message"] == "ok"
+    assert pickle.loads(pickle.dumps(result)) == result
+
+def test_parse_expiry():
+    assert parse_expiry(1700000000) == 1700000000.0
+    assert parse_expiry("2023-11-14T22:13:20Z") == 1700000000.0
+    assert parse_expiry("2023-11-14T23:13:20+01:00") == 1700000000.0
+    for missing in (None, "", "next tuesday"):
+        assert parse_expiry(missing) is None
+
+def test_expiry_reads_every_expiry_field():
+    assert AuthResult(True, expires_at="2023-11-14T22:13:20Z").expiry == 1700000000.0
+    assert AuthResult.from_dict({"success": True, "expiryDate": 1700000000}).expiry == 1700000000.0
+    assert AuthResult(True).expiry is None
+
+def test_parse_response_success(codec):
+    result = parse_response(200, b'{"success": true, "message": "ok", "userStatus": "active"}')
+    assert isinstance(result, AuthResult)
+    assert result.to_dict() == {"success": True, "message": "ok", "userStatus": "active"}
+
+def test_parse_response_http_errors(codec):
+    result = parse_response(403, b'{"message": "License revoked", "errorCode": "REVOKED"}')
+    assert result.to_dict() == {"success": False, "message": "License revoked", "errorCode": "REVOKED"}
+    # Proxy error pages are not JSON
+    result = parse_response(502, b"<html>Bad Gateway</html>")
+    assert result.to_dict() == {"success": False, "message": "HTTP 502 error", "errorCode": "HTTP_502"}
+
+def test_parse_response_rejects_invalid_success_bodies(codec):
+    with pytest.raises(NetworkError):
+        parse_response(200, b"<html>")
+    with pytest.raises(NetworkError):
+        parse_response(200, b"[1, 2]")
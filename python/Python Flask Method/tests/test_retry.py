@@ -0,0 +1,155 @@
+import time
+
+import pytest
+
+from keymaster_auth import CircuitBreaker, CircuitOpenError, NetworkError, RetryPolicy, _send_request
+from keymaster_transport import TransportConnectionError, TransportConnectTimeout, TransportTimeout
+
+API_URL = "https://keymaster.test/api/authenticate-key"
+
+def failing_then_ok(error, failures=1):
+    """Handler that fails the first ``failures`` requests with ``error`` (an exception or a status)."""
+    calls = []
+    
+    def handler(url, payload):
+        calls.append(payload)
+        if len(calls) <= failures:
+            if isinstance(error, int):
+                return error, {"success": False, "message": "unavailable"}
+            raise error
+        return {"success": True}
+    
+    return handler
+
+def test_backoff_grows_exponentially_up_to_max_delay():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.5, multiplier=2, jitter=False)
+    assert [policy.backoff(attempt) for attempt in range(5)] == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+
+def test_jittered_backoff_stays_within_bounds():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.5, multiplier=2, jitter=True)
+    for attempt in range(5):
+        nominal = min(0.5, 0.1 * 2 ** attempt)
+        assert all(0 <= policy.backoff(attempt) <= nominal for _ in range(50))
+
+def test_retry_after_is_a_floor_capped_by_max_delay():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.5, jitter=False)
+    assert policy.backoff(0, retry_after=0.3) == 0.3
+    assert policy.backoff(2, retry_after=0.1) == pytest.approx(0.4)
+    assert policy.backoff(0, retry_after=60) == 0.5
+
+def test_attempts_never_run_past_the_deadline():
+    policy = RetryPolicy(deadline=0.2)
+    deadline = policy.start()
+    assert 0 < policy.attempt_timeout(deadline) <= 0.2
+    assert policy.can_wait(0.1, deadline)
+    assert not policy.can_wait(0.3, deadline)
+    assert policy.start(timeout=0) is None
+    assert not RetryPolicy(deadline=0).start()
+
+def test_backoff_is_cut_short_by_the_call_timeout(make_client):
+    client = make_client(failing_then_ok(TransportConnectionError("refused"), failures=10), max_attempts=10)
+    client.retry_policy.base_delay = 0.1
+    started = time.perf_counter()
+    # Attempts at 0s and 0.1s; the next backoff (0.2s) would end past the 0.25s budget
+    with pytest.raises(NetworkError):
+        _send_request(API_URL, {"licenseKey": "K-1"}, client, timeout=0.25)
+    assert time.perf_counter() - started < 0.25
+    assert client.transport.stats()["requests_answered"] == 2
+
+@pytest.mark.parametrize("error", [TransportConnectionError("refused"), TransportTimeout("read timeout"),
+                                   503, 429, 502])
+def test_transient_failures_are_retried(make_client, error):
+    client = make_client(failing_then_ok(error), max_attempts=3)
+    assert _send_request(API_URL, {"licenseKey": "K-1"}, client)["success"] is True
+    assert client.transport.stats()["requests_answered"] == 2
+
+@pytest.mark.parametrize("status", [400, 401, 403, 500])
+def test_definitive_statuses_are_not_retried(make_client, status):
+    client = make_client(failing_then_ok(status), max_attempts=3)
+    assert _send_request(API_URL, {"licenseKey": "K-1"}, client)["success"] is False
+    assert client.transport.stats()["requests_answered"] == 1
+
+def test_malformed_responses_are_not_retried(make_client):
+    client = make_client(lambda url, payload: b"<html>", max_attempts=3)
+    with pytest.raises(NetworkError):
+        _send_request(API_URL, {"licenseKey": "K-1"}, client)
+    assert client.transport.stats()["requests_answered"] == 1
+
+def test_read_timeouts_are_only_retried_when_allowed(make_client):
+    client = make_client(failing_then_ok(TransportTimeout("read timeout")), max_attempts=3)
+    client.retry_policy.retry_on_timeout = False
+    with pytest.raises(NetworkError):
+        _send_request(API_URL, {"licenseKey": "K-1"}, client)
+    assert client.transport.stats()["requests_answered"] == 1
+    
+    # A connect timeout never reached the server
+    client = make_client(failing_then_ok(TransportConnectTimeout("connect timeout")), max_attempts=3)
+    client.retry_policy.retry_on_timeout = False
+    assert _send_request(API_URL, {"licenseKey": "K-1"}, client)["success"] is True
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats() == {"state": "open", "consecutive_failures": 3, "times_opened": 1, "rejected": 1}
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+    for outcome in ("failure", "failure", "success", "failure", "failure"):
+        breaker.before_call()
+        getattr(breaker, f"record_{outcome}")()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["consecutive_failures"] == 2
+
+def test_half_open_allows_one_probe_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    # Only one trial call at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.stats()["state"] == "closed" and breaker.stats()["consecutive_failures"] == 0
+    breaker.before_call()
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["times_opened"] == 2
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+
+def test_open_circuit_fails_fast_without_reaching_the_server(make_client):
+    responses = {"status": 503}
+    client = make_client(lambda url, payload: (responses["status"], {"success": responses["status"] == 200}))
+    client.breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.1)
+    for n in range(2):
+        assert _send_request(API_URL, {"licenseKey": f"K-{n}"}, client)["success"] is False
+    with pytest.raises(CircuitOpenError):
+        _send_request(API_URL, {"licenseKey": "K-2"}, client)
+    assert client.transport.stats()["requests_answered"] == 2
+    
+    # The probe after the recovery timeout succeeds and closes the circuit
+    responses["status"] = 200
+    time.sleep(0.11)
+    assert _send_request(API_URL, {"licenseKey": "K-3"}, client)["success"] is True
+    assert client.breaker.state == CircuitBreaker.CLOSED
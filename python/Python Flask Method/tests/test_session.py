@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from keymaster_session import InvalidSessionToken, SessionRevocations, SessionTokenManager
+
+SECRET = "test-session-secret"
+AUTH_RESPONSE = {"success": True, "userStatus": "active", "expiresAt": "2099-01-01T00:00:00Z"}
+
+@pytest.fixture
+def revocations(tmp_path):
+    return SessionRevocations(str(tmp_path / "revocations.json"), reload_interval=0)
+
+def make_manager(revocations, **settings):
+    settings.setdefault("revocation", "user")
+    return SessionTokenManager(SECRET, revocations=revocations, **settings)
+
+def test_issue_and_verify(revocations):
+    manager = make_manager(revocations)
+    claims = manager.verify(manager.issue("bob", AUTH_RESPONSE))
+    assert claims["sub"] == "bob"
+    assert claims["st"] == "active"
+    assert claims["ent"] == 4070908800
+    assert claims["jti"]
+    assert claims["iat"] < claims["exp"] <= claims["iat"] + manager.ttl
+
+def test_missing_tampered_and_foreign_tokens_are_rejected(revocations):
+    manager = make_manager(revocations)
+    token = manager.issue("bob", AUTH_RESPONSE)
+    payload, _, signature = token.rpartition(".")
+    forged_payload = manager._serializer.dump_payload({"sub": "admin"}).decode("ascii")
+    for bad in (None, "", "not-a-token", f"{payload}.{signature[::-1]}", f"{forged_payload}.{signature}"):
+        with pytest.raises(InvalidSessionToken):
+            manager.verify(bad)
+    # Signed with another key, e.g. by a worker with a different SECRET_KEY
+    other = SessionTokenManager("other-secret", revocations=revocations, revocation="user")
+    with pytest.raises(InvalidSessionToken):
+        other.verify(token)
+
+def test_expired_token_is_rejected(revocations):
+    manager = make_manager(revocations, ttl=1)
+    token = manager.issue("bob", AUTH_RESPONSE)
+    time.sleep(1.1)
+    with pytest.raises(InvalidSessionToken, match="expired"):
+        manager.verify(token)
+
+def test_token_never_outlives_the_entitlement(revocations):
+    manager = make_manager(revocations)
+    soon = time.time() + 60
+    claims = manager.verify(manager.issue("bob", {"success": True, "expiresAt": soon}))
+    assert claims["exp"] <= soon
+
+def test_revoked_session_rejects_all_of_its_tokens(revocations):
+    manager = make_manager(revocations, refresh_after=0)
+    token = manager.issue("bob", AUTH_RESPONSE)
+    claims = manager.verify(token)
+    refreshed = manager.refresh(claims)
+    other_session = manager.issue("bob", AUTH_RESPONSE)
+    
+    assert manager.revoke(claims)
+    for token in (token, refreshed):
+        with pytest.raises(InvalidSessionToken, match="revoked"):
+            manager.verify(token)
+    # Only the logged-out session is affected
+    assert manager.verify(other_session)["sub"] == "bob"
+
+def test_revoked_user_rejects_earlier_tokens_only(revocations):
+    manager = make_manager(revocations)
+    bob = manager.issue("bob", AUTH_RESPONSE)
+    alice = manager.issue("alice", AUTH_RESPONSE)
+    revocations.revoke_user("bob")
+    with pytest.raises(InvalidSessionToken, match="revoked"):
+        manager.verify(bob)
+    assert manager.verify(alice)["sub"] == "alice"
+    # A login right after the revocation, even within the same second, is valid
+    assert manager.verify(manager.issue("bob", AUTH_RESPONSE))["sub"] == "bob"
+
+def test_revoke_user_is_ignored_in_global_mode(revocations):
+    manager = make_manager(revocations, revocation="global")
+    token = manager.issue("bob", AUTH_RESPONSE)
+    revocations.revoke_user("bob")
+    assert manager.verify(token)["sub"] == "bob"
+
+def test_epoch_bump_rejects_every_earlier_token(revocations):
+    manager = make_manager(revocations, revocation="global")
+    tokens = [manager.issue(name, AUTH_RESPONSE) for name in ("bob", "alice")]
+    assert revocations.revoke_all() == 1
+    for token in tokens:
+        with pytest.raises(InvalidSessionToken, match="revoked"):
+            manager.verify(token)
+    assert manager.verify(manager.issue("bob", AUTH_RESPONSE))["ep"] == 1
+
+def test_no_revocation_mode_ignores_revocations(revocations):
+    manager = make_manager(revocations, revocation="none")
+    claims = manager.verify(manager.issue("bob", AUTH_RESPONSE))
+    assert not manager.revoke(claims)
+    revocations.revoke_all()
+    assert manager.verify(manager.issue("bob", AUTH_RESPONSE))["sub"] == "bob"
+
+def test_revocations_reach_other_workers_through_the_file(revocations):
+    worker_a = make_manager(revocations)
+    worker_b = make_manager(SessionRevocations(revocations.path, reload_interval=0))
+    bob = worker_a.issue("bob", AUTH_RESPONSE)
+    alice = worker_a.issue("alice", AUTH_RESPONSE)
+    
+    # Logged out on worker A, rejected by worker B
+    worker_a.revoke(worker_a.verify(bob))
+    with pytest.raises(InvalidSessionToken, match="revoked"):
+        worker_b.verify(bob)
+    assert worker_b.verify(alice)["sub"] == "alice"
+    
+    # Everyone revoked on worker B, rejected by worker A
+    worker_b.revocations.revoke_all()
+    with pytest.raises(InvalidSessionToken, match="revoked"):
+        worker_a.verify(alice)
+
+def test_needs_refresh(revocations):
+    manager = make_manager(revocations, refresh_after=60, max_age=3600)
+    now = time.time()
+    claims = {"sub": "bob", "iat": now, "auth": now, "ent": None}
+    assert not manager.needs_refresh(claims)
+    assert manager.needs_refresh(dict(claims, iat=now - 120))
+    # Not past the login's max age or the entitlement expiry
+    assert not manager.needs_refresh(dict(claims, iat=now - 120, auth=now - 3600))
+    assert not manager.needs_refresh(dict(claims, iat=now - 120, ent=now - 1))
+
+def test_refresh_keeps_user_claims_and_session(revocations):
+    manager = make_manager(revocations, refresh_after=0)
+    claims = manager.verify(manager.issue("bob", AUTH_RESPONSE, login_time=time.time() - 100))
+    time.sleep(0.01)
+    refreshed = manager.verify(manager.refresh(claims))
+    for name in ("sub", "st", "ent", "auth", "jti"):
+        assert refreshed[name] == claims[name]
+    assert refreshed["iat"] > claims["iat"]
+    assert refreshed["exp"] >= claims["exp"]
@@ -0,0 +1,29 @@
+import app as app_module
+from keymaster_static import PAGE_VARIANTS, CachedPage
+
+def test_login_page_links_assets_under_each_prefix(monkeypatch):
+    monkeypatch.setattr(app_module, "login_page_cache", CachedPage(app_module.login_page_cache.render))
+    client = app_module.app.test_client()
+    plain = client.get("/")
+    # Mounted under a prefix by the reverse proxy
+    mounted = client.get("/", headers={"X-Forwarded-Prefix": "/keymaster"})
+    
+    assert b'href="/static/style.' in plain.data
+    assert b'href="/keymaster/static/style.' in mounted.data
+    assert plain.headers["ETag"] != mounted.headers["ETag"]
+    # Both renderings stay cached
+    assert client.get("/").data == plain.data
+    assert client.get("/", headers={"If-None-Match": mounted.headers["ETag"],
+                                    "X-Forwarded-Prefix": "/keymaster"}).status_code == 304
+
+def test_cached_page_keeps_a_bounded_number_of_prefixes():
+    renders = []
+    page = CachedPage(lambda: renders.append(1) or "<html></html>")
+    with app_module.app.test_request_context("/"):
+        page.response()
+        page.response()
+    for n in range(PAGE_VARIANTS + 5):
+        with app_module.app.test_request_context("/", base_url=f"http://localhost/p{n}/"):
+            page.response()
+    assert len(renders) == PAGE_VARIANTS + 6
+    assert len(page._assets) == PAGE_VARIANTS
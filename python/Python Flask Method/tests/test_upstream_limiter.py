@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+import keymaster_auth
+from keymaster_auth import NetworkError, UpstreamBusyError, _send_request
+from keymaster_transport import TransportConnectionError
+
+API_URL = "https://keymaster.test/api/authenticate-key"
+
+@pytest.fixture
+def default_client():
+    """Install a client as the process-wide default for the duration of a test."""
+    previous = keymaster_auth.get_default_client()
+    
+    def install(client):
+        keymaster_auth.set_default_client(client)
+        return client
+    
+    yield install
+    keymaster_auth.set_default_client(previous)
+
+def test_in_flight_cap_holds(make_client):
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+    
+    def handler(url, payload):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threading.Event().wait(0.05)
+        with lock:
+            active[0] -= 1
+        return {"success": True}
+    
+    client = make_client(handler, max_in_flight=2, queue_timeout=5)
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(_send_request(API_URL, {"licenseKey": f"K-{n}"}, client)))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(results) == 8 and all(result["success"] for result in results)
+    assert peak[0] == 2
+    stats = client.limiter.stats()
+    assert stats["peak_in_flight"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["rejected"] == 0
+
+def test_queue_timeout_returns_503_with_retry_after(make_client, default_client):
+    import app as app_module
+    
+    started = threading.Event()
+    release = threading.Event()
+    
+    def handler(url, payload):
+        started.set()
+        release.wait(5)
+        return {"success": True, "userStatus": "active"}
+    
+    client = default_client(make_client(handler, max_in_flight=1, queue_timeout=0.05))
+    holder = threading.Thread(target=_send_request, args=(API_URL, {"licenseKey": "HOLD"}, client))
+    holder.start()
+    try:
+        assert started.wait(5)
+        response = app_module.app.test_client().post("/auth", data={"username": "bob", "password": "secret"})
+    finally:
+        release.set()
+        holder.join()
+    
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == app_module.BUSY_RETRY_AFTER
+    assert client.limiter.stats()["rejected"] == 1
+
+def test_busy_limiter_raises_without_calling_upstream(make_client):
+    release = threading.Event()
+    client = make_client(lambda url, payload: release.wait(5) and {"success": True},
+                         max_in_flight=1, queue_timeout=0.05)
+    holder = threading.Thread(target=_send_request, args=(API_URL, {"licenseKey": "HOLD"}, client))
+    holder.start()
+    try:
+        while client.limiter.stats()["in_flight"] == 0:
+            threading.Event().wait(0.001)
+        with pytest.raises(UpstreamBusyError):
+            _send_request(API_URL, {"licenseKey": "OTHER"}, client)
+    finally:
+        release.set()
+        holder.join()
+    assert client.transport.stats()["requests_answered"] == 1
+
+def test_slot_released_when_transport_raises(make_client):
+    def handler(url, payload):
+        raise TransportConnectionError("connection reset")
+    
+    client = make_client(handler, max_in_flight=1, queue_timeout=0.05, max_attempts=2)
+    for attempt in range(3):
+        with pytest.raises(NetworkError):
+            _send_request(API_URL, {"licenseKey": f"K-{attempt}"}, client)
+    
+    stats = client.limiter.stats()
+    assert stats["in_flight"] == 0
+    assert stats["rejected"] == 0
+    # The single slot is free again
+    client.limiter.acquire(timeout=0)
+    client.limiter.release()
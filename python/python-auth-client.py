@@ -5,8 +5,79 @@ import json
 import uuid
 import os
 import platform
+import time
+import threading
+import hashlib
+import hmac
+import tempfile
+import logging
+from collections import OrderedDict
+from datetime import datetime
+try:
+    import orjson  # optional faster JSON codec; parses the raw response bytes directly
+    _json_dumps, _json_loads = orjson.dumps, orjson.loads
+except ImportError:
+    _json_dumps, _json_loads = lambda obj: json.dumps(obj).encode("utf-8"), json.loads
 API_BASE_URL = "https://keymaster-agni.vercel.app/api/authenticate-key"
-def get_persistent_hwid(app_name="YourPythonApp"):
+# Library diagnostics go to logging (silent unless the host app configures it); the payload and
+# response body are never logged because they contain the license key and HWID.
+logger = logging.getLogger("keymaster_client")
+# In-process license cache: successes are reused for CACHE_TTL seconds, definitive rejections for
+# CACHE_NEGATIVE_TTL seconds. Transient failures (timeouts, network errors) are never cached.
+CACHE_MAXSIZE = 256
+CACHE_TTL = 300
+CACHE_NEGATIVE_TTL = 30
+TRANSIENT_ERROR_CODES = {"TIMEOUT_ERROR", "JSON_DECODE_ERROR", "CLIENT_REQUEST_EXCEPTION", "NETWORK_ERROR", "SERVER_ERROR", "RATE_LIMITED", "HTTP_408", "HTTP_429"}
+class LicenseCache:
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL):
+        self.maxsize, self.ttl, self.negative_ttl = maxsize, ttl, negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+    @staticmethod
+    def make_key(master_user_id, license_key, hwid, app_version, username=None):
+        return (master_user_id, license_key.upper(), hwid, app_version, username or "")
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+    def put(self, key, result):
+        if not isinstance(result, dict):
+            return
+        error_code = str(result.get("errorCode") or "")
+        if result.get("success") is True:
+            ttl = self.ttl
+        elif result.get("success") is False and error_code and error_code not in TRANSIENT_ERROR_CODES and not error_code.startswith("HTTP_5"):
+            ttl = self.negative_ttl
+        else:
+            return
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    def invalidate(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries), "hit_ratio": self.hits / lookups if lookups else 0.0}
+license_cache = LicenseCache()
+def get_app_data_dir(app_name="YourPythonApp"):
     if platform.system() == "Windows":
         base_dir = os.getenv('APPDATA') or os.path.join(os.path.expanduser("~"), 'AppData', 'Roaming')
     elif platform.system() == "Darwin":
@@ -14,7 +85,9 @@ def get_persistent_hwid(app_name="YourPythonApp"):
     else:
         base_dir = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser("~"), '.config')
     safe_app_name = "".join(c if c.isalnum() else "_" for c in app_name)
-    app_data_dir = os.path.join(base_dir, safe_app_name.lower())
+    return os.path.join(base_dir, safe_app_name.lower())
+def get_persistent_hwid(app_name="YourPythonApp"):
+    app_data_dir = get_app_data_dir(app_name)
     hwid_file_path = os.path.join(app_data_dir, "hwid.dat")
     try:
         if not os.path.exists(app_data_dir):
@@ -25,15 +98,15 @@ def get_persistent_hwid(app_name="YourPythonApp"):
                 if hwid:
                     return hwid
     except Exception as e:
-        print(f"Error reading HWID file: {e}")
+        logger.warning("Error reading HWID file: %s", e)
     new_hwid = str(uuid.uuid4()).upper()
     try:
         with open(hwid_file_path, "w") as f_out:
             f_out.write(new_hwid)
     except Exception as e:
-        print(f"Error writing HWID file: {e}")
+        logger.warning("Error writing HWID file: %s", e)
     return new_hwid
-def authenticate_license(master_user_id, license_key, hwid, app_version, username=None):
+def authenticate_license(master_user_id, license_key, hwid, app_version, username=None, use_cache=True):
     placeholder_uid = "PASTE_YOUR_KEYMASTER_ACCOUNT_UID_HERE"
     if not master_user_id or master_user_id == placeholder_uid:
         return {"success": False, "message": "Configuration Error: MasterUserId is not set in the Python application. This ID must be set by the application developer by replacing the placeholder.", "errorCode": "CLIENT_MISSING_MASTER_USER_ID"}
@@ -47,19 +120,141 @@ def authenticate_license(master_user_id, license_key, hwid, app_version, usernam
     }
     if username:
         payload["username"] = username
+    cache_key = LicenseCache.make_key(master_user_id, license_key, hwid, app_version, username) if use_cache else None
+    if cache_key is not None:
+        cached = license_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    result = _send_license_request(payload)
+    if cache_key is not None:
+        license_cache.put(cache_key, result)
+    return result
+def _send_license_request(payload):
     headers = {"Content-Type": "application/json"}
-    print(f"Sending to KeyMaster: {json.dumps(payload)}")
+    logger.debug("Sending license check to KeyMaster for key %s...", payload["licenseKey"][:4])
     try:
-        response = requests.post(API_BASE_URL, data=json.dumps(payload), headers=headers, timeout=30)
-        print(f"KeyMaster Response Status: {response.status_code}")
-        print(f"KeyMaster Response Body: {response.text}")
-        return response.json()
+        response = requests.post(API_BASE_URL, data=_json_dumps(payload), headers=headers, timeout=30)
+        logger.debug("KeyMaster response status: %s", response.status_code)
+        result = _json_loads(response.content)
+        if not isinstance(result, dict):
+            raise ValueError("KeyMaster response is not a JSON object")
+        return result
     except requests.exceptions.Timeout:
         return {"success": False, "message": "The request to KeyMaster timed out.", "errorCode": "TIMEOUT_ERROR"}
-    except requests.exceptions.JSONDecodeError:
-        return {"success": False, "message": f"Error decoding KeyMaster API response. Status: {response.status_code}, Body: {response.text[:200]}...", "errorCode": "JSON_DECODE_ERROR"}
     except requests.exceptions.RequestException as e:
         return {"success": False, "message": f"Network or request error: {e}", "errorCode": "CLIENT_REQUEST_EXCEPTION"}
+    except ValueError:
+        body = response.content[:200].decode("utf-8", errors="replace")
+        return {"success": False, "message": f"Error decoding KeyMaster API response. Status: {response.status_code}, Body: {body}...", "errorCode": "JSON_DECODE_ERROR"}
+# Offline license lease: after a successful online check the result is stored next to hwid.dat with an
+# expiry and an HMAC keyed on the HWID, so later launches can start without a network round trip.
+# The MAC ties a lease to this machine and detects edits or corruption; it is not a secret against a
+# local attacker who can also read hwid.dat. A lease is "fresh" until expiresAt; for LEASE_GRACE_PERIOD
+# seconds after that it is only honoured when KeyMaster cannot be reached. Once past the grace period
+# the app must validate online again. Neither the lease nor its grace period outlives the entitlement
+# expiry returned by KeyMaster (expiresAt), and no lease is written for an already expired entitlement.
+LEASE_FILE_NAME = "license.lease"
+LEASE_TTL = 24 * 3600
+LEASE_GRACE_PERIOD = 72 * 3600
+LEASE_REFRESH_AFTER = 3600  # revalidate in the background once a lease is older than this
+LEASE_MAX_CLOCK_SKEW = 300
+LEASE_EXPIRY_FIELDS = ("expiresAt", "expiryDate", "expires_at")
+def _lease_path(app_name):
+    return os.path.join(get_app_data_dir(app_name), LEASE_FILE_NAME)
+def _lease_request_hash(master_user_id, license_key, app_version, username):
+    data = json.dumps([master_user_id, license_key.upper(), app_version, username or ""])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+def _lease_mac(hwid, body):
+    key = hashlib.sha256(f"keymaster-lease:{hwid}".encode("utf-8")).digest()
+    return hmac.new(key, json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8"), hashlib.sha256).hexdigest()
+def _entitlement_expiry(result):
+    for field in LEASE_EXPIRY_FIELDS:
+        value = result.get(field)
+        if value in (None, ""):
+            continue
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            logger.debug("Ignoring unparseable entitlement expiry: %r", value)
+            return None
+    return None
+def _lease_grace_deadline(lease):
+    deadline = lease["expiresAt"] + LEASE_GRACE_PERIOD
+    entitlement_expires_at = lease.get("entitlementExpiresAt")
+    return deadline if entitlement_expires_at is None else min(deadline, entitlement_expires_at)
+def write_license_lease(app_name, hwid, request_hash, result, ttl=LEASE_TTL):
+    now = time.time()
+    entitlement_expires_at = _entitlement_expiry(result)
+    if entitlement_expires_at is not None and entitlement_expires_at <= now:
+        delete_license_lease(app_name)
+        return
+    expires_at = now + ttl if entitlement_expires_at is None else min(now + ttl, entitlement_expires_at)
+    body = {"v": 1, "requestHash": request_hash, "issuedAt": now, "expiresAt": expires_at, "entitlementExpiresAt": entitlement_expires_at, "result": result}
+    lease = dict(body, mac=_lease_mac(hwid, body))
+    path = _lease_path(app_name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".lease-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f_out:
+                json.dump(lease, f_out)
+                f_out.flush()
+                os.fsync(f_out.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except Exception as e:
+        logger.warning("Error writing license lease: %s", e)
+def read_license_lease(app_name, hwid, request_hash):
+    try:
+        with open(_lease_path(app_name), "r") as f_in:
+            lease = json.load(f_in)
+        mac = lease.pop("mac", "")
+        if not hmac.compare_digest(mac, _lease_mac(hwid, lease)) or lease.get("requestHash") != request_hash:
+            return None
+        if lease["issuedAt"] > time.time() + LEASE_MAX_CLOCK_SKEW:
+            return None
+        return lease
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+def delete_license_lease(app_name):
+    try:
+        os.remove(_lease_path(app_name))
+    except OSError:
+        pass
+def _is_transient_failure(result):
+    error_code = str(result.get("errorCode") or "")
+    return result.get("success") is not True and (not error_code or error_code in TRANSIENT_ERROR_CODES or error_code.startswith("HTTP_5"))
+def _revalidate_lease(master_user_id, license_key, hwid, app_version, username, app_name, request_hash, on_revoked):
+    result = authenticate_license(master_user_id, license_key, hwid, app_version, username, use_cache=False)
+    if result.get("success") is True:
+        write_license_lease(app_name, hwid, request_hash, result)
+    elif not _is_transient_failure(result):
+        delete_license_lease(app_name)
+        if on_revoked:
+            on_revoked(result)
+def authenticate_license_with_lease(master_user_id, license_key, hwid, app_version, username=None, app_name="YourPythonApp", background_revalidate=True, on_revoked=None):
+    if not license_key:
+        return authenticate_license(master_user_id, license_key, hwid, app_version, username)
+    request_hash = _lease_request_hash(master_user_id, license_key, app_version, username)
+    lease = read_license_lease(app_name, hwid, request_hash)
+    now = time.time()
+    if lease and now < lease["expiresAt"]:
+        if background_revalidate and now - lease["issuedAt"] > LEASE_REFRESH_AFTER:
+            threading.Thread(target=_revalidate_lease, args=(master_user_id, license_key, hwid, app_version, username, app_name, request_hash, on_revoked), daemon=True, name="keymaster-lease-refresh").start()
+        return dict(lease["result"], leased=True, leaseExpiresAt=lease["expiresAt"])
+    result = authenticate_license(master_user_id, license_key, hwid, app_version, username, use_cache=False)
+    if result.get("success") is True:
+        write_license_lease(app_name, hwid, request_hash, result)
+    elif _is_transient_failure(result):
+        if lease and now < _lease_grace_deadline(lease):
+            return dict(lease["result"], leased=True, leaseExpiresAt=lease["expiresAt"], leaseGrace=True)
+    else:
+        delete_license_lease(app_name)
+    return result
 if __name__ == "__main__":
     MY_KEYMASTER_ACCOUNT_UID = "PASTE_YOUR_KEYMASTER_ACCOUNT_UID_HERE"
     if MY_KEYMASTER_ACCOUNT_UID == "PASTE_YOUR_KEYMASTER_ACCOUNT_UID_HERE":
@@ -73,7 +268,7 @@ if __name__ == "__main__":
         print(f"\nUsing MasterUserId: {MY_KEYMASTER_ACCOUNT_UID}")
         print(f"Using HWID: {my_hwid}")
         print(f"Authenticating key: {my_license_key} for App v{my_app_version}...")
-        result = authenticate_license(MY_KEYMASTER_ACCOUNT_UID, my_license_key, my_hwid, my_app_version, my_username)
+        result = authenticate_license_with_lease(MY_KEYMASTER_ACCOUNT_UID, my_license_key, my_hwid, my_app_version, my_username, app_name="MyGreatPythonApp")
         print("\n--- Authentication Result ---")
         if result and result.get("success"):
             print(f"Status: Successful, Message: {result.get('message')}, User Status: {result.get('userStatus', 'N/A')}")